@@ -4,12 +4,36 @@
 # Description: This file contains the RESTFul API defination
 
 from api_env import *
+import json
 import logging
 import os, sys
-from flask import Flask
-from flask_restful import reqparse, abort, Api, Resource
+if server_mode == 'gevent':
+	# sockets and threads must be patched before docker/requests are imported, so every connection, job worker,
+	# sampler and event watcher runs as a greenlet and the docker unix socket calls don't block the process
+	try:
+		from gevent import monkey
+	except ImportError:
+		sys.exit("server_mode 'gevent' requires the gevent package")
+	monkey.patch_all()
+from flask import Flask, Response, request, stream_with_context
+from flask_restful import abort, Api, Resource
 from docker_wrap import *
-from helper import search_result_filter
+from helper import SEARCH_MODES, parse_byte_range, parse_field_paths, project, sorted_page
+from request_schema import RequestSchema, Field, boolean, comma_list, positive_int, raw
+from job_engine import JobEngine, JobQueueFull, JobFailed, track_progress, sse_events
+from scheduler import SchedulerBusy
+from stats_sampler import sse_stats
+from host_pool import HostRegistry
+from container_template import ContainerTemplates
+from image_catalog import ImageCatalog, CATALOG_SORTS
+from terminal import TerminalGateway
+from system_wrap import SystemCollector
+import metrics
+from profiler import SamplingProfiler, PROFILE_FORMATS
+import profiler
+from build_cache import parse_context, parse_digest
+from compression import COMPRESSIONS, MIME_TYPES, EXTENSIONS
+from database import Database
 
 
 logging.basicConfig(filename=api_log, level=logging_level)
@@ -17,257 +41,835 @@ logging.basicConfig(filename=api_log, level=logging_level)
 
 app = Flask(__name__)
 api = Api(app)
+if metrics_enabled:
+	metrics.instrument_app(app)
+# Requests profiled on demand, see /api/v1/system/profiler
+request_profiler = SamplingProfiler()
+if profiler_enabled:
+	profiler.instrument_app(app, request_profiler)
 
 docker_host = Docker()
 if docker_host.handle is None:
 	logging.error("Docker Host cann't be connected")
 	exit(1)
+if inventory_cache_enabled:
+	docker_host.start_inventory_cache()
+if stats_sampler_enabled:
+	docker_host.start_stats_sampler()
+if snapshot_enabled:
+	docker_host.start_snapshots()
+
+# Registry of all of the docker hosts in docker_host_list, used by the multi-host APIs
+host_registry = HostRegistry()
+host_registry.start()
+
+# Image metadata of all of the hosts mirrored into the 'images' collection
+image_catalog = ImageCatalog(host_registry, Database)
+if image_catalog_enabled:
+	image_catalog.start()
+
+# Named container templates stored in the 'conf_container' collection, the database is connected on first use
+container_templates = ContainerTemplates(docker_host, Database)
+
+# Asynchronous jobs for the long running daemon operations
+jobs = JobEngine()
+
+# Interactive exec/attach sessions over WebSocket
+terminals = TerminalGateway()
+
+# Host memory, cpu and disk samples, the System HW Info APIs answer from them
+system_collector = SystemCollector()
+if system_collector_enabled:
+	system_collector.start()
 
 def invalidate_parameters_warning():
 	return {"message": "Invalidate Parameter"}, 400
 
-# Define Request Parser
-parser = reqparse.RequestParser()
-for param in request_arguments:
-	parser.add_argument(param)
+# job type -> operation class of the scheduler, see SCHEDULED_METHODS
+JOB_CLASSES = {'pull': 'registry', 'push': 'registry', 'save': 'transfer', 'commit': 'build', 'build': 'build'}
+
+def bulk_inspect(kind, select, args):
+	# args['id'] are the comma separated ids, or args['labels'] the comma separated "key=value" selectors.
+	# args['fields'] are the comma separated field paths kept in each document, eg. "State.Status,
+	# NetworkSettings.Networks.*.IPAddress". All of the fields are returned without it.
+	if args['concurrency'] < 1 or args['timeout'] <= 0:
+		return invalidate_parameters_warning()
+	if args['id']:
+		object_ids = args['id']
+	elif args['labels']:
+		object_ids = select(args['labels'])
+	else:
+		return invalidate_parameters_warning()
+	# keep the order, drop the duplicates
+	object_ids = sorted(set(object_ids), key=object_ids.index)
+	if len(object_ids) > bulk_inspect_max_ids:
+		return {"message": "Too many objects, at most {} per request".format(bulk_inspect_max_ids),
+		        "status": "failed"}, 400
+	try:
+		fields = parse_field_paths(args['fields']) if args['fields'] else None
+	except ValueError as e:
+		return {"message": str(e), "status": "failed"}, 400
+	results = docker_host.bulk_inspect(kind, object_ids, fields=fields,
+	                                   concurrency=min(args['concurrency'], bulk_inspect_concurrency_max),
+	                                   timeout=args['timeout'])
+	return {"results": results, "count": len(results)}, 200
+
+def list_response(name, items, sorts, args):
+	# args['sort'] orders the listing by one of `sorts` then by id, args['order']: 'desc'(default) or 'asc'.
+	# args['limit'] or args['cursor'] pages it, the response is then {name: page, "cursor": ..., "has_more": ...}
+	# and the next page is read with its "cursor". args['fields'] are the comma separated field paths kept in each
+	# object, eg. "Id,Names,State". The plain listing is returned without any of them.
+	paged = args['limit'] is not None or args['cursor'] is not None
+	if not paged and args['sort'] is None and not args['fields']:
+		return items, 200
+	limit = args['limit'] if args['limit'] is not None else list_page_size
+	if paged and not 1 <= limit <= list_page_size_max:
+		return invalidate_parameters_warning()
+	try:
+		fields = parse_field_paths(args['fields']) if args['fields'] else None
+		page, cursor, has_more = sorted_page(items, sorts[args['sort'] or 'created'],
+		                                     descending=args['order'] == 'desc', limit=limit if paged else None,
+		                                     cursor=args['cursor'])
+	except ValueError as e:
+		return {"message": str(e), "status": "failed"}, 400
+	if fields is not None:
+		page = [project(item, fields) for item in page]
+	if not paged:
+		return page, 200
+	return {name: page, "cursor": cursor, "has_more": has_more}, 200
+
+def list_fields(sorts):
+	return (Field('sort', choices=tuple(sorted(sorts))), Field('order', default='desc', choices=('asc', 'desc')),
+	        Field('limit', type=int), Field('cursor'), Field('fields', type=comma_list))
+
+bulk_inspect_schema = RequestSchema(Field('id', type=comma_list), Field('labels', type=comma_list),
+                                    Field('fields', type=comma_list),
+                                    Field('concurrency', type=int, default=bulk_inspect_concurrency),
+                                    Field('timeout', type=float, default=bulk_inspect_timeout))
+
+def admitted_job(func):
+	def run(job):
+		with docker_host.scheduler.admitted():
+			return func(job)
+	return run
+
+def submit_job(kind, func, key=None, params=None):
+	# Queue the job and return its id at once, the client polls /api/v1/job/<job_id> or follows its events
+	op_class = JOB_CLASSES.get(kind)
+	try:
+		if scheduler_enabled and op_class is not None and (key is None or jobs.get_inflight(key) is None):
+			# the jobs are admitted here, once queued they run on the workers of their class and wait for a slot
+			# up to scheduler_job_wait_timeout
+			kinds = [k for k, c in JOB_CLASSES.items() if c == op_class]
+			docker_host.scheduler.check(op_class, pending=jobs.pending(kinds))
+		job = jobs.submit(kind, admitted_job(func), key=key, params=params, pool=op_class or 'default')
+	except SchedulerBusy as e:
+		return e.data, 429, {'Retry-After': str(e.retry_after)}
+	except JobQueueFull as e:
+		return {"message": str(e), "status": "failed"}, 503
+	return {"job_id": job.id, "status": job.status, "merged": job.subscribers > 1}, 202
 
 # TODO: Rename all classes to match the partern:  Network-, Docker-, Container-, Image-
 # Docker APIs
 class RegistryLogin(Resource):
+	schema = RequestSchema(Field('login_user', required=True), Field('login_pass', required=True), Field('registry_srv'))
+
 	def post(self):
-		args = parser.parse_args()
-		if args['login_user'] is not None and args['login_pass'] is not None:
-			return docker_host.login_registry(args['login_user'], args['login_pass'], args['registry_srv']), 200
-		else:
-			return invalidate_parameters_warning()
+		args = self.schema.parse()
+		return docker_host.login_registry(args['login_user'], args['login_pass'], args['registry_srv']), 200
 
-# TODO: wait get_docker_events() function wrapper finished
+# TODO: get_docker_events() returns a blocking generator, wait for a streaming response support
 # class DockerEvents(Resource):
 # 	def get(self):
 # 		return docker_host.get_docker_events(), 200
 
+# args['refresh']: take a new snapshot now instead of serving the latest one
+snapshot_schema = RequestSchema(Field('refresh', type=boolean, default=False))
+
+def snapshot_response(name):
+	# The snapshot age is sent in the 'Age' header, an 'If-None-Match' with the current ETag gets a 304
+	snapshot = docker_host.snapshots.get(name)
+	if snapshot is None:
+		return None
+	state = snapshot.refresh() if snapshot_schema.parse()['refresh'] else snapshot.latest()
+	if state['data'] is None:
+		return {"message": state['error'], "status": "failed"}, 503
+	headers = {'ETag': '"{}"'.format(state['etag']), 'Age': str(int(state['age'])), 'Cache-Control': 'no-cache'}
+	if request.if_none_match.contains(state['etag']):
+		return Response(status=304, headers=headers)
+	return state['data'], 200, headers
+
 class DiskUtilization(Resource):
 	def get(self):
-		return docker_host.get_disk_utils(), 200
+		return snapshot_response('df') or (docker_host.get_disk_utils(), 200)
 
 # Docker Image APIs
 class DockerInfo(Resource):
 	def get(self):
-		return docker_host.get_docker_info(), 200
+		return snapshot_response('info') or (docker_host.get_docker_info(), 200)
+
+class DockerScheduler(Resource):
+	# Running and waiting operations of every class, with their average wait and run seconds
+	def get(self):
+		return docker_host.scheduler.stats(), 200
 
 class ImagesList(Resource):
+	# args['match'] is the search mode: 'prefix'(default), 'exact' or 'glob'
+	# args['label']: comma separated "key" or "key=value" selectors, args['dangling']: True for the untagged images
+	# only. The listing is sorted, paged and projected by list_response().
+	schema = RequestSchema(Field('match', default='prefix', choices=SEARCH_MODES))
+	list_schema = RequestSchema(Field('label', type=comma_list), Field('dangling', type=boolean),
+	                            *list_fields(IMAGE_SORTS))
+
 	def get(self, id_name=None):
 		if id_name is None:
-			return docker_host.get_image_list(), 200
+			args = self.list_schema.parse()
+			filters = {}
+			if args['label']:
+				filters['label'] = args['label']
+			if args['dangling'] is not None:
+				filters['dangling'] = args['dangling']
+			return list_response('images', docker_host.get_image_list(filters=filters), IMAGE_SORTS, args)
 		else:
-			image_list = docker_host.get_image_list()
-			return search_result_filter(image_list, ['RepoTags','Id'], keyword=id_name), 200
+			args = self.schema.parse()
+			return docker_host.search_images(id_name, mode=args['match']), 200
 
 class ImageSearchOnPublicRegister(Resource):
+	schema = RequestSchema(Field('keyword', required=True))
+
 	def post(self):
-		args = parser.parse_args()
+		args = self.schema.parse()
 		if args['keyword'] is not None and str(args['keyword']).strip() != "":
 			return docker_host.public_image_search(keyword=args['keyword']), 200
 		else:
 			return invalidate_parameters_warning()
 
 class PullImage(Resource):
+	schema = RequestSchema(Field('image_name', required=True), Field('image_tag', default='latest'), Field('repo_name'))
+
 	def post(self):
-		args=parser.parse_args()
-		return docker_host.pull_image(args['image_name'], args['image_tag'], args['repo_name'])
+		args = self.schema.parse()
+		name, tag, repo = args['image_name'], args['image_tag'], args['repo_name']
+		reference = (repo + '/' if repo else '') + name + ':' + tag
+
+		def pull(job):
+			result = docker_host.pull_image(name, tag, repo, stream=True)
+			if isinstance(result, dict):
+				raise JobFailed(result['message'])
+			return track_progress(job, result)
+		# identical in-flight pulls are merged into one job
+		return submit_job('pull', pull, key='pull:' + reference, params={'image': reference})
 
 class ImageInspect(Resource):
+	schema = RequestSchema(Field('image_id', required=True))
+
 	def post(self):
 		# TODO: will support "repo/name:tag" later
-		args = parser.parse_args()
-		if args['image_id'] is None:
-			return invalidate_parameters_warning()
-		else:
-			return docker_host.inspect_image(args['image_id']), 200
+		args = self.schema.parse()
+		return docker_host.inspect_image(args['image_id']), 200
+
+class ImageInspectBulk(Resource):
+	# Inspect many images at once, see bulk_inspect()
+	schema = bulk_inspect_schema
+
+	def post(self):
+		return bulk_inspect('image', docker_host.select_images, self.schema.parse())
 
 class RemoveImage(Resource):
+	schema = RequestSchema(Field('image_id', required=True), Field('force'))
+
 	def post(self):
-		args = parser.parse_args()
-		if args['image_id'] is None:
-			return invalidate_parameters_warning()
-		else:
-			if  args['force'] is None:
-				is_force = False
-			else:
-				is_force = True
-			return docker_host.remove_image(args['image_id'], force_remove=is_force), 200
+		args = self.schema.parse()
+		# any value of args['force'] means force
+		is_force = args['force'] is not None
+		return docker_host.remove_image(args['image_id'], force_remove=is_force), 200
 
 class ChangeImageTag(Resource):
+	schema = RequestSchema(Field('image_id', required=True), Field('repo_name', required=True), Field('tag_name'),
+	                       Field('force'))
+
 	def post(self):
-		args = parser.parse_args()
+		args = self.schema.parse()
 		# args['image_id'] is also could be "repo/image:tag" this function still work
 		# args['repo_name'] is new repository name for tag into. "new_repo/new_image"
 		# args['tag_name'] is new tag name to be assign to image, if None, "latest" will be assigned
-		if args['image_id'] is None or args['repo_name'] is None:
-			return invalidate_parameters_warning()
-		else:
-			if args['force'] is None:
-				is_force = False
-			else:
-				is_force = True
-			# return value should be boolean
-			return docker_host.tag_image(args['image_id'], args['repo_name'], args['tag_name'], force=is_force), 200
+		is_force = args['force'] is not None
+		# return value should be boolean
+		return docker_host.tag_image(args['image_id'], args['repo_name'], force=is_force, tag=args['tag_name']), 200
 
 class PushImage(Resource):
+	schema = RequestSchema(Field('repo_name', required=True), Field('tag'))
+
 	def post(self):
-		args = parser.parse_args()
-		if args['repo_name'] is None:
-			return invalidate_parameters_warning()
-		else:
-			return docker_host.push_image(args['repo_name'], args['tag']), 200
+		args = self.schema.parse()
+		repository, tag = args['repo_name'], args['tag']
+
+		def push(job):
+			return track_progress(job, docker_host.push_image(repository, tag, stream=True))
+		return submit_job('push', push, params={'repository': repository, 'tag': tag})
 
 class SaveImage(Resource):
+	# mode 'archive' saves the image in the layer deduplicating archive store instead of a tarball in save_path,
+	# tarball_name is then the archive name
+	schema = RequestSchema(Field('image_name', required=True), Field('save_path'), Field('tarball_name'),
+	                       Field('mode', default='tarball', choices=('tarball', 'archive')))
+
 	def post(self):
-		args = parser.parse_args()
-		if not os.path.exists(args['save_path']) or args['image_name'] is None:
+		args = self.schema.parse()
+		image_name, save_path, tarball_name = args['image_name'], args['save_path'], args['tarball_name']
+		if args['mode'] == 'archive':
+			def save(job):
+				progress = lambda read: job.update_progress(image_name, 'Saving', read)
+				result = docker_host.save_image_archive(image_name, tarball_name, progress=progress)
+				if result['status'] != 'succeed':
+					raise JobFailed(result['message'])
+				return result
+			return submit_job('save', save, params={'image': image_name, 'archive': tarball_name})
+		if save_path is None or not os.path.exists(save_path):
 			return invalidate_parameters_warning()
-		else:
-			return docker_host.save_image(args['image_name'], args['save_path'], tarball_name=args['tarball_name']), 200
+
+		def save(job):
+			result = docker_host.save_image(image_name, save_path, tarball_name=tarball_name,
+			                                progress=lambda written: job.update_progress(image_name, 'Saving', written))
+			if result['status'] != 'succeed':
+				raise JobFailed(result['message'])
+			return result
+		return submit_job('save', save, params={'image': image_name, 'save_path': save_path})
 
 class LoadImage(Resource):
+	# mode 'archive' loads the image saved in the archive store under the name tarball_name, with its own tags
+	schema = RequestSchema(Field('tarball_name', required=True), Field('image_name'), Field('image_tag'),
+	                       Field('changes'), Field('mode', default='tarball', choices=('tarball', 'archive')))
+
 	def post(self):
-		args = parser.parse_args()
+		args = self.schema.parse()
+		if args['mode'] == 'archive':
+			if args['tarball_name'] not in docker_host.archives.names():
+				return invalidate_parameters_warning()
+			return docker_host.load_image_archive(args['tarball_name'])
 		# args['tarball_name'] should be a full path for tarball. it could be local path or uri
 		# args['image_name'] should be a full name of image with repository name 'repo/name'
-		if os.path.isfile(args['tarball_name']) and args['image_name'] is not None:
+		if args['image_name'] is not None and os.path.isfile(args['tarball_name']):
 			return docker_host.load_image(args['tarball_name'], repository=args['image_name'], tag=args['image_tag'],
 			                              changes=args['changes'])
 		else:
 			return invalidate_parameters_warning()
 
+class ImageArchives(Resource):
+	# The archives of the store with the bytes of their tarballs, the bytes stored and the bytes saved by sharing
+	def get(self):
+		return docker_host.archives.stats(), 200
+
+class RemoveImageArchive(Resource):
+	# The blobs of the removed archive stay until a gc, unless gc is set
+	schema = RequestSchema(Field('name', required=True), Field('gc', type=boolean, default=False))
+
+	def post(self):
+		args = self.schema.parse()
+		try:
+			docker_host.archives.remove(args['name'])
+		except (KeyError, ValueError):
+			return {"message": "Image archive {} not found".format(args['name']), "status": "failed"}, 404
+		result = {"message": "Image archive {} removed".format(args['name']), "status": "succeed"}
+		if args['gc']:
+			result['gc'] = docker_host.archives.gc()
+		return result, 200
+
+class ImageArchiveGC(Resource):
+	# Remove the blobs no archive references anymore
+	def post(self):
+		result = docker_host.archives.gc()
+		result['status'] = 'succeed'
+		return result, 200
+
+class SaveImageStream(Resource):
+	# Download the image tarball streamed from the daemon, 'Range: bytes=start-end' resumes an interrupted download.
+	# Content-Length and Content-Range are only known after one complete download of the same image.
+	schema = RequestSchema(Field('image_name', required=True))
+
+	def get(self):
+		args = self.schema.parse()
+		try:
+			byte_range = parse_byte_range(request.headers.get('Range'))
+		except ValueError:
+			return {"message": "Invalidate Range"}, 416
+		start, end = byte_range if byte_range is not None else (0, None)
+		try:
+			image_id, size, stats, chunks = docker_host.stream_image_save(args['image_name'], start=start, end=end)
+		except errors.NotFound:
+			return {'message': 'Image Not Found', 'status': 'failed'}, 404
+		headers = {'Accept-Ranges': 'bytes',
+		           'X-Transfer-Id': stats.id,
+		           'Content-Disposition': 'attachment; filename="{}.tar"'.format(image_id.split(':')[-1][:12])}
+		status = 200
+		if size is not None:
+			if start >= size:
+				chunks.close()
+				return {"message": "Invalidate Range"}, 416, {'Content-Range': 'bytes */{}'.format(size)}
+			last = size - 1 if end is None else min(end, size - 1)
+			headers['Content-Length'] = str(last - start + 1)
+			if byte_range is not None:
+				headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, last, size)
+				status = 206
+		elif end is not None:
+			headers['Content-Range'] = 'bytes {}-{}/*'.format(start, end)
+			status = 206
+		elif byte_range is not None:
+			# the total size is unknown, tell the client where the body starts instead of a Content-Range
+			headers['X-Content-Offset'] = str(start)
+		return Response(stream_with_context(chunks), status=status, headers=headers, mimetype='application/x-tar')
+
+class LoadImageStream(Resource):
+	# Upload the tarball as the request body, it is piped straight into the daemon.
+	# args['image_name'] set: import a filesystem tarball as 'repo/name', otherwise load a saved image tarball
+	# the body is the upload, the fields are only read from the query string
+	schema = RequestSchema(Field('image_name'), Field('image_tag'), Field('changes'), location='args')
+
+	def post(self):
+		args = self.schema.parse()
+		return docker_host.stream_image_load(request.stream, repository=args['image_name'], tag=args['image_tag'],
+		                                     changes=args['changes']), 200
+
+class ImageTransfers(Resource):
+	def get(self):
+		return docker_host.transfers.list(), 200
+
+class ImageCatalogQuery(Resource):
+	# Answered from the 'images' collection only, eg. args['digest'] for the hosts having an image, or
+	# args['unused_since'] with args['sort']='size' for the largest images not used since that epoch second.
+	# args['present']: False for the removed images. args['cursor'] pages the results when args['sort'] is None.
+	schema = RequestSchema(Field('digest'), Field('image_id'), Field('tag'), Field('host'),
+	                       Field('present', type=boolean, default=True), Field('unused_since', type=int),
+	                       Field('min_size', type=int), Field('sort', choices=tuple(CATALOG_SORTS)),
+	                       Field('order', default='desc', choices=('asc', 'desc')),
+	                       Field('limit', type=int, default=db_page_size), Field('cursor'))
+
+	def get(self):
+		args = self.schema.parse()
+		filters = {'Present': args['present']}
+		for arg, key in (('digest', 'Digests'), ('image_id', 'Id'), ('tag', 'RepoTags'), ('host', 'Host'),
+		                 ('unused_since', 'LastUsed__lt'), ('min_size', 'Size__gte')):
+			if args[arg] is not None:
+				filters[key] = args[arg]
+		try:
+			return image_catalog.query(filters, sort=args['sort'], descending=args['order'] == 'desc',
+			                           limit=args['limit'], cursor=args['cursor']), 200
+		except ValueError:
+			return invalidate_parameters_warning()
+
+# Job APIs
+class JobList(Resource):
+	def get(self):
+		return jobs.list(), 200
+
+class JobStatus(Resource):
+	def get(self, job_id):
+		job = jobs.get(job_id)
+		if job is None:
+			return {"message": "Job Not Found"}, 404
+		return job.to_dict(), 200
+
+class JobEvents(Resource):
+	# Server-sent events of the job progress, 'Last-Event-ID' resumes from the last received event
+	def get(self, job_id):
+		job = jobs.get(job_id)
+		if job is None:
+			return {"message": "Job Not Found"}, 404
+		try:
+			last_event_id = int(request.headers.get('Last-Event-ID', 0))
+		except ValueError:
+			return invalidate_parameters_warning()
+		return Response(stream_with_context(sse_events(job, last_event_id)), mimetype='text/event-stream',
+		                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+class BuildContextMissing(Resource):
+	# JSON body: {"files": {path: sha256 of content}}, the answer lists the digests to upload before the build
+	def post(self):
+		body = request.get_json(silent=True) or {}
+		try:
+			context = parse_context(body.get('files'))
+		except (ValueError, TypeError) as e:
+			return {"message": str(e), "status": "failed"}, 400
+		missing = docker_host.build_cache.missing([digest for _, digest, _ in context])
+		return {"missing": missing, "files": len(context), "cache": docker_host.build_cache.stats()}, 200
+
+class BuildContextBlob(Resource):
+	# The request body is the content of one context file, it is stored under its sha256
+	def put(self, digest):
+		try:
+			digest = parse_digest(digest)
+			size = docker_host.build_cache.put(digest, request.stream)
+		except ValueError as e:
+			return {"message": str(e), "status": "failed"}, 400
+		return {"digest": 'sha256:' + digest, "size": size, "status": "succeed"}, 201
+
 class BuildImage(Resource):
-	#TODO implement the function of build images from dockerfile
-	# https://docker-py.readthedocs.io/en/stable/api.html#module-docker.api.build
-	pass
+	# JSON body: {"files": {path: sha256 or {"digest": sha256, "mode": file mode}}, "tag": "repo/name:tag",
+	# "dockerfile": path, "buildargs": {name: value}, "nocache": bool, "pull": bool}
+	# All of the files must be uploaded first, see BuildContextMissing. The build runs as a job with the daemon
+	# output as its events.
+	def post(self):
+		body = request.get_json(silent=True) or {}
+		try:
+			context = parse_context(body.get('files'))
+		except (ValueError, TypeError) as e:
+			return {"message": str(e), "status": "failed"}, 400
+		missing = docker_host.build_cache.missing([digest for _, digest, _ in context])
+		if missing:
+			return {"message": "Upload the missing context files first", "missing": missing, "status": "failed"}, 409
+		tag = body.get('tag')
+
+		def build(job):
+			stats, stream = docker_host.build_image(context, tag=tag, dockerfile=body.get('dockerfile'),
+			                                        buildargs=body.get('buildargs'), nocache=bool(body.get('nocache')),
+			                                        pull=bool(body.get('pull')))
+			try:
+				messages = track_progress(job, stream)
+			except Exception:
+				stats.finish('failed')
+				raise
+			image_id = None
+			for message in messages:
+				image_id = (message.get('aux') or {}).get('ID', image_id)
+			return {'image_id': image_id, 'tag': tag, 'context': stats.to_dict()}
+		return submit_job('build', build, params={'tag': tag, 'files': len(context)})
 
 
 # Docker Container APIs
 class ListContainers(Resource):
+	# any value of args['all'] includes the stopped containers. args['label'], args['status'] and args['ancestor'] are
+	# comma separated daemon filters, eg. label=tier=web, status=exited,dead, ancestor=nginx:latest. The listing is
+	# sorted, paged and projected by list_response().
+	schema = RequestSchema(Field('all'), Field('label', type=comma_list), Field('status', type=comma_list),
+	                       Field('ancestor', type=comma_list), *list_fields(CONTAINER_SORTS))
+
 	def post(self):
-		args = parser.parse_args()
-		if args['all'] is not None:
-			return docker_host.get_containers(all=True), 200
-		else:
-			return docker_host.get_containers(), 200
+		args = self.schema.parse()
+		filters = {}
+		for arg in ('label', 'status', 'ancestor'):
+			if args[arg]:
+				filters[arg] = args[arg]
+		if any(status not in CONTAINER_STATUSES for status in args['status'] or []):
+			return invalidate_parameters_warning()
+		# the stopped containers are only matched by a status filter with 'all'
+		include_all = args['all'] is not None or bool(args['status'])
+		containers = docker_host.get_containers(all=include_all, filters=filters)
+		return list_response('containers', containers, CONTAINER_SORTS, args)
 
 class CreateContainer(Resource):
+	# create_container() arguments, the LIST/DICT ones are given in a JSON body. args['host_config'] and
+	# args['networking_config'] are passed as they are, eg. {"Binds": [...], "PortBindings": {...}}
+	schema = RequestSchema(Field('image', required=True), Field('command', type=raw), Field('hostname'), Field('user'),
+	                       Field('detach', type=boolean), Field('stdin_open', type=boolean), Field('tty', type=boolean),
+	                       Field('ports', type=raw), Field('environment', type=raw), Field('volumes', type=raw),
+	                       Field('network_disabled', type=boolean), Field('name'), Field('entrypoint', type=raw),
+	                       Field('working_dir'), Field('domainname'), Field('mac_address'), Field('labels', type=raw),
+	                       Field('stop_signal'), Field('healthcheck', type=raw), Field('stop_timeout', type=int),
+	                       Field('runtime'), Field('host_config', type=raw), Field('networking_config', type=raw))
+
 	def post(self):
-		args = parser.parse_args()
-		new_container = docker_host.create_container(args=args)
+		args = self.schema.parse()
+		new_container = docker_host.new_container(args)
 		return new_container, 200
 
-class StartContainer(Resource):
+class ContainerTemplateList(Resource):
+	def get(self):
+		return container_templates.list(), 200
+
+class ContainerTemplateCreate(Resource):
+	# JSON body: {"name": template name, "spec": create_container() arguments with optional "host_config"
+	# (create_host_config() arguments) and "networking_config" ({network name: endpoint arguments})}
 	def post(self):
-		args = parser.parse_args()
-		if args.get('container_id') is None:
+		body = request.get_json(silent=True) or {}
+		if not body.get('name') or not isinstance(body.get('spec'), dict):
 			return invalidate_parameters_warning()
-		else:
-			return docker_host.start_container(args.get('container_id')), 200
+		try:
+			template = container_templates.register(body['name'], body['spec'])
+		except ValueError as e:
+			return {"message": str(e)}, 400
+		return dict((k, v) for k, v in template.items() if k != 'payload'), 200
 
-class StopContainer(Resource):
+class ContainerTemplateRemove(Resource):
+	schema = RequestSchema(Field('name', required=True))
+
+	def post(self):
+		args = self.schema.parse()
+		if not container_templates.remove(args['name']):
+			return {"message": "Template Not Found"}, 404
+		return {"message": "Template {} removed".format(args['name']), "status": "succeed"}, 200
+
+class ContainerTemplateRun(Resource):
+	# JSON body: {"name": template name, "overrides": {"command", "environment", "labels", "hostname"},
+	# "container_names": [names] or "count": number of containers}, at most template_run_max_containers of them
 	def post(self):
-		args = parser.parse_args()
-		if args.get('container_id') is None:
+		body = request.get_json(silent=True) or {}
+		if not body.get('name'):
 			return invalidate_parameters_warning()
-		else:
-			return docker_host.stop_container(args.get('container_id')), 200
+		names = body.get('container_names')
+		try:
+			count = int(body.get('count', 1))
+			return container_templates.instantiate(body['name'], overrides=body.get('overrides'), container_names=names,
+			                                       count=count), 200
+		except KeyError:
+			return {"message": "Template Not Found"}, 404
+		except (ValueError, TypeError) as e:
+			return {"message": str(e)}, 400
+
+class StartContainer(Resource):
+	schema = RequestSchema(Field('container_id', required=True))
+
+	def post(self):
+		args = self.schema.parse()
+		return docker_host.start_container(args['container_id']), 200
+
+class StopContainer(Resource):
+	schema = RequestSchema(Field('container_id', required=True))
+
+	def post(self):
+		args = self.schema.parse()
+		return docker_host.stop_container(args['container_id']), 200
 
 class RestartContainer(Resource):
+	schema = RequestSchema(Field('container_id', required=True))
+
 	def post(self):
-		args = parser.parse_args()
-		if args.get('container_id') is None:
-			return invalidate_parameters_warning()
-		else:
-			return docker_host.restart_container(args.get('container_id')), 200
+		args = self.schema.parse()
+		return docker_host.restart_container(args['container_id']), 200
 
 class RemoveContainer(Resource):
+	schema = RequestSchema(Field('container_id', required=True))
+
+	def post(self):
+		args = self.schema.parse()
+		return docker_host.remove_container(args['container_id']), 200
+
+class BatchContainers(Resource):
+	# args['action']: 'start', 'stop', 'restart' or 'remove'
+	# args['container_id']: comma separated container ids, or args['labels']: comma separated "key=value" selectors
+	# args['mode']: 'best_effort'(default) runs all of them, 'fail_fast' skips the rest after the first failure
+	# The result of each container is streamed as one JSON line as soon as it finishes, then a summary line.
+	schema = RequestSchema(Field('action', required=True, choices=BATCH_ACTIONS),
+	                       Field('container_id', type=comma_list), Field('labels', type=comma_list),
+	                       Field('mode', default='best_effort', choices=('best_effort', 'fail_fast')),
+	                       Field('concurrency', type=int, default=batch_concurrency),
+	                       Field('timeout', type=float, default=batch_timeout))
+
 	def post(self):
-		args = parser.parse_args()
-		if args.get('container_id') is None:
+		args = self.schema.parse()
+		concurrency = args['concurrency']
+		if concurrency < 1:
 			return invalidate_parameters_warning()
+		if args['container_id']:
+			container_ids = args['container_id']
+		elif args['labels']:
+			container_ids = docker_host.select_containers(args['labels'])
 		else:
-			return docker_host.remove_container(args.get('container_id')), 200
+			return invalidate_parameters_warning()
+		# keep the order, drop the duplicates
+		container_ids = sorted(set(container_ids), key=container_ids.index)
+		results = docker_host.batch_containers(args['action'], container_ids,
+		                                       concurrency=min(concurrency, batch_concurrency_max), timeout=args['timeout'],
+		                                       fail_fast=args['mode'] == 'fail_fast')
+
+		def generate():
+			summary = {}
+			for result in results:
+				summary[result['status']] = summary.get(result['status'], 0) + 1
+				yield json.dumps(result) + '\n'
+			yield json.dumps({'summary': summary, 'total': len(container_ids)}) + '\n'
+		return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 class ListMappingPorts(Resource):
+	schema = RequestSchema(Field('container_id', required=True))
+
 	def post(self):
-		args = parser.parse_args()
-		if args.get('container_id') is None:
-			return invalidate_parameters_warning()
-		else:
-			return docker_host.list_mapping_ports(args.get('container_id')), 200
+		args = self.schema.parse()
+		return docker_host.list_mapping_ports(args['container_id']), 200
 
 class CommitContainer(Resource):
+	schema = RequestSchema(Field('container_id', required=True), Field('repo_name', required=True),
+	                       Field('tag_name', required=True), Field('message'), Field('author'),
+	                       Field('changes', type=raw), Field('conf', type=raw))
+
 	def post(self):
-		args = parser.parse_args()
-		if args.get('container_id') is None or args.get('repo_name') is None or args.get('tag_name') is None:
-			return invalidate_parameters_warning()
-		else:
-			return docker_host.commit_to_image(args), 200
+		args = self.schema.parse()
+		return submit_job('commit', lambda job: docker_host.commit_to_image(args),
+		                  params={'container_id': args['container_id'], 'repository': args['repo_name'],
+		                          'tag': args['tag_name']})
 
 class ExecContainer(Resource):
 	# Container 'exec' function and redirect the console to a web based terminal console.
+	schema = RequestSchema(Field('container_id', required=True), Field('cmd'))
+
 	def post(self):
-		args = parser.parse_args()
-		if args.get('container_id') is None:
-			return  invalidate_parameters_warning()
+		args = self.schema.parse()
+		if args['cmd'] is None:
+			return docker_host.attach_container(args['container_id'])
 		else:
-			if args.get('cmd') is None:
-				return docker_host.attach_container(args['container_id'])
-			else:
-				return docker_host.exec_container(args['container_id'], args['cmd']), 200
+			return docker_host.exec_container(args['container_id'], args['cmd']), 200
 
 class AttachContainer(Resource):
+	schema = RequestSchema(Field('container_id', required=True))
+
 	def post(self):
-		args = parser.parse_args()
-		if args.get('container_id') is None:
-			return invalidate_parameters_warning()
-		else:
-			return docker_host.attach_container(args['container_id'])
+		args = self.schema.parse()
+		return docker_host.attach_container(args['container_id'])
+
+class ContainerTerminal(Resource):
+	# WebSocket terminal: an exec of args['cmd'] with a TTY, or an attach to the container when args['cmd'] is None.
+	# args['rows']/args['cols'] is the initial TTY size, see terminal.py for the messages.
+	schema = RequestSchema(Field('container_id', required=True), Field('cmd'), Field('rows', type=int),
+	                       Field('cols', type=int), location='args')
+
+	def get(self):
+		args = self.schema.parse()
+		ws = request.environ.get('wsgi.websocket')
+		if ws is None:
+			return {"message": "WebSocket upgrade required, it is served in 'gevent' server mode",
+			        "status": "failed"}, 400
+		try:
+			terminal = docker_host.open_terminal(args['container_id'], cmd=args['cmd'], rows=args['rows'],
+			                                     cols=args['cols'])
+		except errors.NotFound:
+			ws.close()
+			return Response()
+		terminals.run(ws, args['container_id'], args['cmd'], terminal)
+		# the connection is already upgraded, nothing more is sent
+		return Response()
+
+class TerminalSessions(Resource):
+	def get(self):
+		return terminals.list(), 200
+
+def log_tail(value):
+	# 'all' or number of lines
+	return 'all' if value == 'all' else int(value)
 
 class ContainerLog(Resource):
+	# args['tail']: lines from the end to start with, args['since']/args['until']: epoch seconds,
+	# args['limit']: lines per page, args['cursor']: 'cursor' of the previous page to get the next one,
+	# args['follow']: stream the lines until the container stops
+	schema = RequestSchema(Field('container_id', required=True), Field('tail', type=log_tail, default='all'),
+	                       Field('since', type=positive_int), Field('until', type=positive_int),
+	                       Field('limit', type=int, default=log_page_size), Field('cursor'),
+	                       Field('timestamps', type=boolean, default=False), Field('stdout', type=boolean, default=True),
+	                       Field('stderr', type=boolean, default=True), Field('follow', type=boolean, default=False))
+
 	def post(self):
-		args = parser.parse_args()
-		if args.get('container_id') is None:
-			return  invalidate_parameters_warning()
-		else:
-			return docker_host.pull_container_log(args), 200
+		args = self.schema.parse()
+		options = {'tail': args['tail'], 'since': args['since'], 'timestamps': args['timestamps'],
+		           'stdout': args['stdout'], 'stderr': args['stderr'], 'cursor': args['cursor']}
+		try:
+			if args['follow']:
+				lines = docker_host.follow_container_log(args['container_id'], **options)
+				return Response(stream_with_context(lines), mimetype='text/plain')
+			return docker_host.pull_container_log(args['container_id'], until=args['until'],
+			                                      limit=min(args['limit'], log_page_size_max), **options), 200
+		except ValueError:
+			return invalidate_parameters_warning()
+		except (errors.InvalidArgument, errors.InvalidVersion) as e:
+			# eg. 'until' needs a daemon of API 1.35 or newer
+			return {"message": str(e), "status": "failed"}, 400
+		except errors.NotFound:
+			return {"message": "Container Not Found"}, 404
 
 class DisplayContainerProcesses(Resource):
+	schema = RequestSchema(Field('container_id', required=True))
+
 	def post(self):
-		args = parser.parse_args()
-		if args.get('container_id') is None:
-			return invalidate_parameters_warning()
-		else:
-			return docker_host.container_top(), 200
+		args = self.schema.parse()
+		return docker_host.container_top(args), 200
 
 class ContainerResourceUsage(Resource):
+	schema = RequestSchema(Field('container_id', required=True))
+
 	def post(self):
-		args = parser.parse_args()
-		if args.get('container_id') is None:
+		args = self.schema.parse()
+		return docker_host.container_res_usage(args), 200
+
+class ContainerStatsCurrent(Resource):
+	# Latest sample of all of the running containers, answered from memory
+	def get(self):
+		if docker_host.stats_sampler is None:
+			return {"message": "Stats sampler is disabled"}, 404
+		return docker_host.stats_sampler.current(), 200
+
+class ContainerStatsHistory(Resource):
+	# args['tier'] is the history resolution in seconds, args['window'] the length of history in seconds
+	schema = RequestSchema(Field('container_id', required=True), Field('tier', type=int), Field('window', type=int))
+
+	def get(self):
+		args = self.schema.parse()
+		if docker_host.stats_sampler is None:
 			return invalidate_parameters_warning()
-		else:
-			return docker_host.container_res_usage(args), 200
+		try:
+			history = docker_host.stats_sampler.history(args['container_id'], resolution=args['tier'],
+			                                            seconds=args['window'])
+		except ValueError:
+			return invalidate_parameters_warning()
+		if history is None:
+			return {"message": "Container Not Sampled"}, 404
+		return history, 200
+
+class ContainerStatsStream(Resource):
+	# Server-sent events of live samples, args['container_id'] is a comma separated list. All containers if None
+	schema = RequestSchema(Field('container_id', type=comma_list))
+
+	def get(self):
+		args = self.schema.parse()
+		if docker_host.stats_sampler is None:
+			return {"message": "Stats sampler is disabled"}, 404
+		container_ids = args['container_id'] or None
+		return Response(stream_with_context(sse_stats(docker_host.stats_sampler, container_ids)),
+		                mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 class ContainerInfo(Resource):
+	schema = RequestSchema(Field('container_id', required=True))
+
 	def post(self):
-		args = parser.parse_args()
-		if args.get('container_id') is None:
-			return invalidate_parameters_warning()
-		else:
-			return docker_host.container_info(args), 200
+		args = self.schema.parse()
+		return docker_host.container_info(args), 200
+
+class ContainerInspectBulk(Resource):
+	# Inspect many containers at once, stopped ones included, see bulk_inspect()
+	schema = bulk_inspect_schema
+
+	def post(self):
+		return bulk_inspect('container', docker_host.select_containers, self.schema.parse())
 
 class ExportContainer(Resource):
-	# TODO: Export Container to a Tar file
-	pass
+	# Download the root filesystem tarball of a container. args['compression']: 'none'(default), 'gzip' or 'zstd',
+	# compressed by args['threads'] threads. The throughput and ratio are in /api/v1/docker/image/transfers.
+	schema = RequestSchema(Field('container_id', required=True), Field('compression', default='none',
+	                       choices=COMPRESSIONS), Field('level', type=int),
+	                       Field('threads', type=int, default=compress_threads))
+
+	def get(self):
+		args = self.schema.parse()
+		if args['threads'] < 1:
+			return invalidate_parameters_warning()
+		try:
+			stats, chunks = docker_host.export_container(args['container_id'], compression=args['compression'],
+			                                             level=args['level'],
+			                                             threads=min(args['threads'], compress_threads_max))
+		except errors.NotFound:
+			return {"message": "Container Not Found", "status": "failed"}, 404
+		except ValueError as e:
+			return {"message": str(e), "status": "failed"}, 400
+		headers = {'X-Transfer-Id': stats.id,
+		           'Content-Disposition': 'attachment; filename="{}{}"'.format(args['container_id'][:12],
+		                                                                      EXTENSIONS[args['compression']])}
+		return Response(stream_with_context(chunks), headers=headers, mimetype=MIME_TYPES[args['compression']])
 
 class ImportContainer(Resource):
-	# TODO: Import Tar file to a container
-	pass
+	# Upload a root filesystem tarball as the request body, args['compression'] is detected by default
+	schema = RequestSchema(Field('repo_name', required=True), Field('tag_name'), Field('changes'),
+	                       Field('compression', default='auto', choices=('auto',) + COMPRESSIONS), location='args')
+
+	def post(self):
+		args = self.schema.parse()
+		return docker_host.import_container(request.stream, args['repo_name'], tag=args['tag_name'],
+		                                    changes=args['changes'], compression=args['compression']), 200
 
 # Docker Networking API
 class NetworkConnect(Resource):
@@ -323,6 +925,40 @@ class VolumeList(Resource):
 
 # NOTE: This version is for a single node environment. Swarm support doesn't included.
 #       For later multiple node support will use K8S implementation.
+#       The multi-host APIs below only query all of the hosts in docker_host_list in parallel.
+
+# Multi-host APIs
+# args['timeout'] is the per host timeout in seconds, host_call_timeout by default
+fan_out_schema = RequestSchema(Field('timeout', type=float, default=host_call_timeout))
+
+def fan_out_hosts(call, merged=False):
+	timeout = fan_out_schema.parse()['timeout']
+	if merged:
+		return host_registry.fan_out_merged(call, timeout=timeout), 200
+	return host_registry.fan_out(call, timeout=timeout), 200
+
+class HostList(Resource):
+	def get(self):
+		return host_registry.status(), 200
+
+class HostsImageList(Resource):
+	def get(self):
+		return fan_out_hosts(lambda client: client.images(), merged=True)
+
+class HostsContainerList(Resource):
+	schema = RequestSchema(Field('all'))
+
+	def get(self):
+		show_all = self.schema.parse()['all'] is not None
+		return fan_out_hosts(lambda client: client.containers(all=show_all), merged=True)
+
+class HostsDockerInfo(Resource):
+	def get(self):
+		return fan_out_hosts(lambda client: client.info())
+
+class HostsDiskUtilization(Resource):
+	def get(self):
+		return fan_out_hosts(lambda client: client.df())
 
 # Tesseract System API
 # User API
@@ -372,16 +1008,74 @@ class GroupList(Resource):
 	def post(self):
 		pass
 
+class Metrics(Resource):
+	# Request, daemon call and streamed bytes metrics in the Prometheus text format
+	def get(self):
+		if not metrics_enabled:
+			return {"message": "Metrics are disabled"}, 404
+		return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+class ProfilerSettings(Resource):
+	# args['rate'] is the fraction of the requests profiled, 0 stops the sampling. args['route'] limits it to one
+	# route rule, eg. '/api/v1/docker/container'. A request with the profiler_header header set to profiler_token is
+	# always profiled, no header is accepted without a token.
+	schema = RequestSchema(Field('rate', type=float, required=True), Field('route'))
+
+	def get(self):
+		if not profiler_enabled:
+			return {"message": "Profiler is disabled"}, 404
+		return {"rate": request_profiler.rate, "route": request_profiler.route, "header": profiler_header,
+		        "interval": request_profiler.interval, "profiles": request_profiler.list()}, 200
+
+	def post(self):
+		args = self.schema.parse()
+		if not profiler_enabled:
+			return {"message": "Profiler is disabled"}, 404
+		try:
+			request_profiler.configure(args['rate'], args['route'])
+		except ValueError:
+			return invalidate_parameters_warning()
+		return {"rate": request_profiler.rate, "route": request_profiler.route, "status": "succeed"}, 200
+
+class ProfileDownload(Resource):
+	# args['name'] is a profile name of ProfilerSettings, args['format'] 'collapsed' for flamegraph.pl or
+	# 'speedscope' for https://www.speedscope.app
+	schema = RequestSchema(Field('name', required=True), Field('format', default='collapsed',
+	                       choices=PROFILE_FORMATS), location='args')
+
+	def get(self):
+		args = self.schema.parse()
+		if not profiler_enabled:
+			return {"message": "Profiler is disabled"}, 404
+		try:
+			profile = request_profiler.read(args['name'], args['format'])
+		except KeyError:
+			return {"message": "Profile Not Found"}, 404
+		filename = args['name'].replace('/', '_')
+		if args['format'] == 'speedscope':
+			filename = filename.replace('.collapsed', '.speedscope.json')
+		return Response(profile, mimetype='application/json' if args['format'] == 'speedscope' else 'text/plain',
+		                headers={'Content-Disposition': 'attachment; filename="{}"'.format(filename)})
+
 # System HW Info
+# args['window'] is the length of history in seconds, only the latest sample if None
+hw_schema = RequestSchema(Field('window', type=int))
+
 class HwHDD(Resource):
-	# TODO: get all hdd information and utilization
+	# Disk io counters, rates and utilization of every block device, and the usage of the mounted filesystems
 	def post(self):
-		pass
+		args = hw_schema.parse()
+		if not system_collector_enabled:
+			return {"message": "System collector is disabled"}, 404
+		return system_collector.disk_info(args['window']), 200
 
 class HwMemory(Resource):
-	# TODO: get memory information and utilization
+	# Memory usage and the cpu busy/iowait percents, the latter show the memory and io pressure together
 	def post(self):
-		pass
+		args = hw_schema.parse()
+		if not system_collector_enabled:
+			return {"message": "System collector is disabled"}, 404
+		return system_collector.memory_info(args['window']), 200
 
 class GpuInfo(Resource):
 	# TODO: get gpu information /could use filter to get specified information/ could specify gpu number /driver ver
@@ -409,6 +1103,7 @@ class GpuPowerCap(Resource):
 # Implementation of Docker API routing
 api.add_resource(RegistryLogin, '/api/v1/docker/login')
 api.add_resource(DockerInfo, '/api/v1/docker/info')
+api.add_resource(DockerScheduler, '/api/v1/docker/scheduler')
 api.add_resource(DiskUtilization, '/api/v1/docker/disk_util')
 
 # Implementation of Docker Image API Routing
@@ -416,26 +1111,56 @@ api.add_resource(ImagesList, '/api/v1/docker/image', '/api/v1/docker/image/<stri
 api.add_resource(ImageSearchOnPublicRegister, '/api/v1/docker/image/search')
 api.add_resource(PullImage, '/api/v1/docker/image/pull')
 api.add_resource(ImageInspect, '/api/v1/docker/image/inspect')
+api.add_resource(ImageInspectBulk, '/api/v1/docker/image/inspect/bulk')
 api.add_resource(RemoveImage, '/api/v1/docker/image/remove')
 api.add_resource(ChangeImageTag, '/api/v1/docker/image/tag')
 api.add_resource(PushImage, '/api/v1/docker/image/push')
 api.add_resource(SaveImage, '/api/v1/docker/image/save')
 api.add_resource(LoadImage, '/api/v1/docker/image/load')
+api.add_resource(ImageArchives, '/api/v1/docker/image/archive')
+api.add_resource(RemoveImageArchive, '/api/v1/docker/image/archive/remove')
+api.add_resource(ImageArchiveGC, '/api/v1/docker/image/archive/gc')
+api.add_resource(SaveImageStream, '/api/v1/docker/image/save/stream')
+api.add_resource(LoadImageStream, '/api/v1/docker/image/load/stream')
+api.add_resource(ImageTransfers, '/api/v1/docker/image/transfers')
+api.add_resource(BuildImage, '/api/v1/docker/image/build')
+api.add_resource(BuildContextMissing, '/api/v1/docker/image/build/missing')
+api.add_resource(BuildContextBlob, '/api/v1/docker/image/build/blob/<digest>')
+api.add_resource(ImageCatalogQuery, '/api/v1/docker/image/catalog')
 
 # Implementation of Docker Container API Routing
 api.add_resource(ListContainers, '/api/v1/docker/container')
 api.add_resource(CreateContainer, '/api/v1/docker/container/create')
+api.add_resource(ContainerTemplateList, '/api/v1/docker/container/template')
+api.add_resource(ContainerTemplateCreate, '/api/v1/docker/container/template/create')
+api.add_resource(ContainerTemplateRemove, '/api/v1/docker/container/template/remove')
+api.add_resource(ContainerTemplateRun, '/api/v1/docker/container/template/run')
 api.add_resource(StartContainer, '/api/v1/docker/container/start')
 api.add_resource(StopContainer, '/api/v1/docker/container/stop')
 api.add_resource(RestartContainer, '/api/v1/docker/container/restart')
 api.add_resource(RemoveContainer, '/api/v1/docker/container/remove')
 api.add_resource(ListMappingPorts, '/api/v1/docker/container/port')
+api.add_resource(BatchContainers, '/api/v1/docker/container/batch')
 api.add_resource(CommitContainer, '/api/v1/docker/container/commit')
 api.add_resource(ExecContainer, '/api/v1/docker/container/exec')
+api.add_resource(ExportContainer, '/api/v1/docker/container/export')
+api.add_resource(ImportContainer, '/api/v1/docker/container/import')
+api.add_resource(ContainerTerminal, '/api/v1/docker/container/terminal')
+api.add_resource(TerminalSessions, '/api/v1/docker/container/terminal/sessions')
 api.add_resource(ContainerLog, '/api/v1/docker/container/log')
 api.add_resource(DisplayContainerProcesses, '/api/v1/docker/container/top')
 api.add_resource(ContainerResourceUsage, '/api/v1/docker/container/stats')
+api.add_resource(ContainerStatsCurrent, '/api/v1/docker/container/stats/current')
+api.add_resource(ContainerStatsHistory, '/api/v1/docker/container/stats/history')
+api.add_resource(ContainerStatsStream, '/api/v1/docker/container/stats/stream')
 api.add_resource(ContainerInfo, '/api/v1/docker/container/inspect')
+api.add_resource(ContainerInspectBulk, '/api/v1/docker/container/inspect/bulk')
+
+
+# Implementation of Job API Routing
+api.add_resource(JobList, '/api/v1/job')
+api.add_resource(JobStatus, '/api/v1/job/<string:job_id>')
+api.add_resource(JobEvents, '/api/v1/job/<string:job_id>/events')
 
 
 # Implementation of Docker Networking API Routing
@@ -453,9 +1178,41 @@ api.add_resource(VolumeInspect, '/api/v1/docker/volume/inspect')
 api.add_resource(VolumeRemove, '/api/v1/docker/volume/remove')
 
 
+# Implementation of Multi-host API Routing
+api.add_resource(HostList, '/api/v1/hosts')
+api.add_resource(HostsImageList, '/api/v1/hosts/image')
+api.add_resource(HostsContainerList, '/api/v1/hosts/container')
+api.add_resource(HostsDockerInfo, '/api/v1/hosts/info')
+api.add_resource(HostsDiskUtilization, '/api/v1/hosts/disk_util')
+
+
 # Implementation of Tesseract System Level API Routing
+api.add_resource(Metrics, '/metrics')
+api.add_resource(ProfilerSettings, '/api/v1/system/profiler')
+api.add_resource(ProfileDownload, '/api/v1/system/profiler/profile')
+api.add_resource(HwHDD, '/api/v1/system/hw/hdd')
+api.add_resource(HwMemory, '/api/v1/system/hw/memory')
+
+
+def serve():
+	if server_mode == 'gevent':
+		from gevent.pool import Pool
+		from gevent.pywsgi import WSGIServer
+		logging.info("Serving on {}:{} with gevent".format(server_host, server_port))
+		try:
+			from geventwebsocket.handler import WebSocketHandler
+		except ImportError:
+			# the REST and streaming APIs still work, only the terminal is disabled
+			logging.warning("gevent-websocket is not installed, the WebSocket terminal is disabled")
+			WebSocketHandler = None
+		options = {'handler_class': WebSocketHandler} if WebSocketHandler is not None else {}
+		server = WSGIServer((server_host, server_port), app, spawn=Pool(server_max_connections),
+		                    log=logging.getLogger('access'), error_log=logging.getLogger('error'), **options)
+		server.serve_forever()
+	else:
+		app.run(host=server_host, port=server_port, debug=True, threaded=True)
 
 
 if __name__ == '__main__':
-	app.run(debug=True)
+	serve()
 
@@ -3,15 +3,197 @@
 # Description: this file contains all of the constant of the api
 import logging
 
-request_arguments = ['login_user', 'login_pass', 'registry_srv', 'keyword', 'repo', 'image', 'tag',
-                     'image_id', 'force', 'save_path', 'load_path', 'tarball_name', 'changes', 'all', 'command',
-                     'hostname', 'user', 'detach', 'stdin_open', 'tty', 'ports', 'environment', 'volumes',
-                     'network_disabled', 'name', 'entrypoint', 'working_dir', 'domainname', 'host_config',
-                     'mac_address', 'labels', 'stop_signal', 'networking_config', 'healthcheck', 'stop_timeout',
-                     'runtime', 'container_id']
 api_log = './logs/api.log'
 docker_op_log = './logs/docker.log'
 logging_level = logging.DEBUG
 docker_host_list =['unix:///var/run/docker.sock']
+# daemon of the single host APIs
+docker_base_url = 'unix:///var/run/docker.sock'
 
 db_structure = {u'tesseract':[u'users', u'group', u'images', u'conf_network', u'conf_host', u'conf_container']}
+# indexes per collection: LIST of (LIST of (field, direction), DICT of index options)
+db_indexes = {
+	u'users': [([('username', 1)], {'unique': True}), ([('group', 1)], {})],
+	u'group': [([('name', 1)], {'unique': True})],
+	u'images': [([('Host', 1), ('Id', 1)], {'unique': True}), ([('Digests', 1)], {}), ([('RepoTags', 1)], {}),
+	            ([('Present', 1), ('Size', -1)], {}), ([('Present', 1), ('LastUsed', 1)], {})],
+	u'conf_network': [([('name', 1)], {'unique': True})],
+	u'conf_host': [([('host', 1)], {'unique': True})],
+	u'conf_container': [([('kind', 1), ('name', 1)], {'unique': True})],
+}
+# max number of buffered writes of a collection, a full buffer is flushed at once
+db_batch_size = 500
+# seconds between the flushes of the buffered writes
+db_flush_interval = 1
+# default and max number of documents in one page of a search
+db_page_size = 100
+db_page_size_max = 1000
+
+
+# Inventory cache for image/container listings, kept current from the docker event stream
+inventory_cache_enabled = True
+# seconds the cache is still served after the event stream dropped, before falling back to the daemon
+inventory_max_staleness = 5
+# seconds between full resyncs of the cache, repairs any drift from missed events
+inventory_resync_interval = 300
+# seconds to wait before reconnecting a dropped event stream
+inventory_retry_interval = 3
+
+
+# Streamed image save/load
+# max bytes read from the daemon or the upload at once, bounds the memory used per transfer
+stream_chunk_size = 1024 * 1024
+# number of latest transfers kept for /api/v1/docker/image/transfers
+transfer_history_size = 100
+
+# Asynchronous jobs for pull/push/save/commit
+# pool -> number of worker threads running its jobs. The jobs of a scheduler class run on the pool of the class, so
+# they don't wait for its slots in the workers of the other classes. The other jobs run on the 'default' pool
+job_workers = {'registry': 3, 'transfer': 2, 'build': 1, 'default': 1}
+# max number of queued jobs of a pool, more submits are rejected
+job_queue_size = 100
+# number of finished jobs kept for the status polling
+job_history_size = 200
+# number of latest progress events kept per job
+job_event_history = 1000
+# seconds between keep-alive comments on server-sent events streams
+sse_heartbeat_interval = 15
+
+# Background container resource sampler
+stats_sampler_enabled = True
+# history tiers of (resolution in seconds, number of samples kept): 5 minutes of 1s, 1 hour of 10s, 1 day of 1m
+stats_tiers = [(1, 300), (10, 360), (60, 1440)]
+# seconds between the checks for started/stopped containers
+stats_discovery_interval = 5
+# seconds between the events of /api/v1/docker/container/stats/stream
+stats_stream_interval = 1
+
+# Container log pagination
+# default and max number of lines in one page of /api/v1/docker/container/log
+log_page_size = 1000
+log_page_size_max = 10000
+
+# Multi-host connection pool for the hosts in docker_host_list
+# max number of APIClient connections per host
+host_pool_size = 4
+# seconds of the APIClient request timeout
+host_client_timeout = 60
+# default seconds to wait for each host in a fan-out call, slower hosts are reported as partial results
+host_call_timeout = 5
+# seconds between the health checks of the hosts
+host_health_interval = 10
+
+# Batch container lifecycle operations
+# default and max number of concurrent daemon calls of one batch
+batch_concurrency = 10
+batch_concurrency_max = 50
+# default seconds for a whole batch
+batch_timeout = 300
+# max number of containers created by one run of a container template
+template_run_max_containers = 100
+
+# Bulk inspect of containers and images, see /api/v1/docker/container/inspect/bulk
+# default and max number of concurrent inspect calls of one request, at most the running limit of the 'bulk'
+# scheduler class
+bulk_inspect_concurrency = 16
+bulk_inspect_concurrency_max = 64
+# seconds for the whole request, the objects not inspected in time are reported as timed out
+bulk_inspect_timeout = 30
+# max number of objects inspected by one request
+bulk_inspect_max_ids = 1000
+
+# Paged container/image listings, see ImagesList and ListContainers
+# default and max number of objects per page
+list_page_size = 100
+list_page_size_max = 1000
+
+# Serving mode
+# 'threaded': the flask development server, one OS thread per connection
+# 'gevent': gevent WSGI server, one greenlet per connection and cooperative docker sockets, for many long lived
+#           streams (followed logs, attach, SSE). It needs the gevent package.
+server_mode = 'threaded'
+server_host = '127.0.0.1'
+server_port = 5000
+# max number of concurrent connections in 'gevent' mode, every followed stream also holds a docker socket
+server_max_connections = 10000
+
+# Image catalog mirrored from every host into the 'images' collection
+image_catalog_enabled = True
+# seconds between the syncs of the catalog with the hosts
+image_catalog_sync_interval = 60
+
+# Background snapshots of the expensive daemon calls
+snapshot_enabled = True
+# seconds between the refreshes of the `docker info` and `docker system df` snapshots
+snapshot_info_interval = 30
+snapshot_df_interval = 300
+
+# WebSocket terminal gateway, needs the 'gevent' server mode and the gevent-websocket package
+# seconds without input or output before a terminal session is closed
+terminal_idle_timeout = 900
+# number of finished terminal sessions kept for /api/v1/docker/container/terminal/sessions
+terminal_history_size = 100
+
+# Build context cache
+# directory of the content-addressed context file blobs
+build_cache_path = './cache/build'
+# max bytes of cached blobs, the least recently used ones are removed beyond it
+build_cache_max_bytes = 10 * 1024 ** 3
+# seconds an uploaded blob is kept whatever the cache size, so the client can start the build that needs it
+build_cache_upload_grace = 600
+
+# Compression of the exported/imported container tarballs
+# number of threads compressing one stream
+compress_threads = 4
+compress_threads_max = 16
+# bytes compressed at once by one gzip thread, every block is one gzip member
+compress_block_size = 1024 * 1024
+
+# Layer deduplicating store of the saved images, see SaveImage with mode 'archive'
+# directory of the blobs and manifests of the archives
+archive_store_path = './archive'
+
+# Host hardware collector of /proc, see /api/v1/system/hw/*
+system_collector_enabled = True
+# seconds between the samples, and number of samples kept: 1 hour of 5s
+system_collector_interval = 5
+system_history_size = 720
+# number of samples between the reads of /proc/mounts
+system_mount_refresh = 12
+
+# Request and daemon call metrics served on /metrics in the Prometheus text format
+metrics_enabled = True
+
+# On-demand sampling profiler of the requests, see /api/v1/system/profiler
+profiler_enabled = True
+# a request with this header set to profiler_token is always profiled
+profiler_header = 'X-Profile'
+# value of the header required to profile a request, eg. a random string shared with the operators. None disables
+# the header, only the sampling rate applies
+profiler_token = None
+# fraction of the requests profiled, changed at runtime with /api/v1/system/profiler
+profiler_sample_rate = 0.0
+# seconds between the stack samples
+profiler_interval = 0.005
+# directory of the profiles and number of profiles kept, the oldest ones are removed
+profiler_path = './profiles'
+profiler_max_profiles = 500
+
+# Admission control of the daemon operations of every docker host, see scheduler.py and /api/v1/docker/scheduler
+scheduler_enabled = True
+# operations running at once on one host, whatever their class
+scheduler_max_running = 16
+# operation class -> (priority, the lowest first, max running, max waiting). A class with a full waiting queue is
+# answered with 429 and a Retry-After header
+scheduler_classes = {
+	'interactive': (0, 16, 500),
+	# the inspect calls of the bulk requests, after the single reads and never more than a few host slots
+	'bulk': (1, 4, 500),
+	'registry': (1, 3, 50),
+	'transfer': (2, 2, 50),
+	'build': (2, 1, 20),
+}
+# seconds an operation waits for a slot before it is rejected
+scheduler_wait_timeout = 30
+# seconds a job admitted at submit time waits for a slot, eg. while the slots of its class are taken by the requests
+scheduler_job_wait_timeout = 600
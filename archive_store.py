@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the layer deduplicating store of the saved image tarballs. A saved tarball is
+#              split into content-addressed blobs (one per file in the tarball, eg. every layer.tar) and a manifest
+#              of the tar headers. A blob shared by many images is stored once, the tarball is rebuilt byte for
+#              byte from the manifest when it is loaded.
+
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from api_env import *
+
+TAR_BLOCK = 512
+ARCHIVE_NAME = re.compile(r'^[A-Za-z0-9_.-]+$')
+# tar entry types whose data describes the next entry (GNU long name/link, pax headers)
+EXTENSION_TYPES = ('L', 'K', 'x', 'g')
+# tar entry types with file content
+FILE_TYPES = ('0', '\0', '7')
+
+
+def archive_name(image_name):
+	# default archive name of an image, "repo/name:tag" -> "repo_name_tag"
+	return re.sub(r'[^A-Za-z0-9_.-]', '_', image_name)
+
+
+def _entry_size(header):
+	field = header[124:136]
+	if ord(field[0]) & 0x80:
+		# base-256 encoding of the large sizes
+		size = 0
+		for c in field[1:]:
+			size = (size << 8) + ord(c)
+		return size
+	field = field.strip('\0 ')
+	return int(field, 8) if field else 0
+
+
+def _padding(size):
+	return (TAR_BLOCK - size % TAR_BLOCK) % TAR_BLOCK
+
+
+class _Reader:
+	# exact reads over an iterator of chunks
+	def __init__(self, chunks):
+		self.chunks = iter(chunks)
+		self.buffer = ''
+		self.position = 0
+
+	def read(self, size):
+		while len(self.buffer) < size:
+			chunk = next(self.chunks, None)
+			if chunk is None:
+				break
+			self.buffer += chunk
+		data, self.buffer = self.buffer[:size], self.buffer[size:]
+		self.position += len(data)
+		return data
+
+
+class ArchiveStore:
+	"""
+	Saved image archives in `path`: 'blobs/<2 hex>/<sha256>' and 'archives/<name>.json'. The blobs are reference
+	counted by the manifests, gc() removes the ones not referenced anymore.
+	"""
+	def __init__(self, path=archive_store_path, chunk_size=stream_chunk_size):
+		self.path = path
+		self.chunk_size = chunk_size
+		self.lock = threading.Lock()
+		# hex digest -> number of archives (and saves in progress) using the blob
+		self.refs = None
+
+	def _manifest_path(self, name):
+		if not ARCHIVE_NAME.match(name or ''):
+			raise ValueError("Invalidate archive name: {}".format(name))
+		return os.path.join(self.path, 'archives', name + '.json')
+
+	def _blob_path(self, digest):
+		return os.path.join(self.path, 'blobs', digest[:2], digest)
+
+	def _load(self):
+		if self.refs is None:
+			refs = {}
+			for name in self.names():
+				for digest in self._digests(self.manifest(name)):
+					refs[digest] = refs.get(digest, 0) + 1
+			self.refs = refs
+		return self.refs
+
+	def _digests(self, manifest):
+		return [e['digest'] for e in manifest['entries'] if e['digest'] is not None]
+
+	def names(self):
+		directory = os.path.join(self.path, 'archives')
+		if not os.path.isdir(directory):
+			return []
+		return sorted(n[:-len('.json')] for n in os.listdir(directory) if n.endswith('.json'))
+
+	def manifest(self, name):
+		path = self._manifest_path(name)
+		if not os.path.isfile(path):
+			raise KeyError(name)
+		with open(path) as f:
+			return json.load(f)
+
+	def add(self, name, image, chunks, progress=None):
+		"""
+		Split a saved image tarball into blobs and store its manifest, an archive with the same name is replaced
+		:param name: string of archive name
+		:param image: string of image name or id, recorded in the manifest
+		:param chunks: iterator of the tarball chunks of get_image()
+		:param progress: callable(bytes read) called after each entry
+		:return: DICT of archive summary, with the bytes written and the bytes deduplicated
+		"""
+		manifest_path = self._manifest_path(name)
+		reader = _Reader(chunks)
+		entries = []
+		pinned = []
+		written = deduplicated = 0
+		try:
+			pending = ''
+			while True:
+				header = reader.read(TAR_BLOCK)
+				if len(header) < TAR_BLOCK or header == '\0' * TAR_BLOCK:
+					break
+				size = _entry_size(header)
+				kind = header[156]
+				if kind in EXTENSION_TYPES:
+					# kept with the header of the entry it describes
+					pending += header + reader.read(size + _padding(size))
+					continue
+				digest = None
+				if kind in FILE_TYPES and size > 0:
+					digest, new = self._store_blob(reader, size)
+					pinned.append(digest)
+					if new:
+						written += size
+					else:
+						deduplicated += size
+					reader.read(_padding(size))
+				elif size > 0:
+					reader.read(size + _padding(size))
+				entries.append({'header': base64.b64encode(pending + header), 'digest': digest, 'size': size})
+				pending = ''
+				if progress is not None:
+					progress(reader.position)
+			manifest = {'name': name, 'image': image, 'created': time.time(), 'size': reader.position,
+			            'entries': entries}
+			with self.lock:
+				refs = self._load()
+				previous = self._digests(self.manifest(name)) if os.path.isfile(manifest_path) else []
+				if not os.path.isdir(os.path.dirname(manifest_path)):
+					os.makedirs(os.path.dirname(manifest_path))
+				with open(manifest_path + '.partial', 'w') as f:
+					json.dump(manifest, f)
+				os.rename(manifest_path + '.partial', manifest_path)
+				# the pins of this save become the references of the manifest
+				pinned = []
+				for digest in previous:
+					refs[digest] -= 1
+		finally:
+			self._release(pinned)
+		return {'name': name, 'image': image, 'size': manifest['size'], 'written': written,
+		        'deduplicated': deduplicated}
+
+	def _store_blob(self, reader, size):
+		# the blob is pinned as soon as it exists, gc() running meanwhile doesn't remove it
+		sha = hashlib.sha256()
+		blobs = os.path.join(self.path, 'blobs')
+		if not os.path.isdir(blobs):
+			os.makedirs(blobs)
+		partial = os.path.join(blobs, '{}.partial'.format(threading.current_thread().ident))
+		try:
+			with open(partial, 'wb') as f:
+				remaining = size
+				while remaining > 0:
+					data = reader.read(min(self.chunk_size, remaining))
+					if not data:
+						raise IOError("Unexpected end of the image tarball")
+					sha.update(data)
+					f.write(data)
+					remaining -= len(data)
+			digest = sha.hexdigest()
+			path = self._blob_path(digest)
+			with self.lock:
+				refs = self._load()
+				new = not os.path.isfile(path)
+				if new:
+					if not os.path.isdir(os.path.dirname(path)):
+						os.makedirs(os.path.dirname(path))
+					os.rename(partial, path)
+				refs[digest] = refs.get(digest, 0) + 1
+			return digest, new
+		finally:
+			if os.path.exists(partial):
+				os.remove(partial)
+
+	def _release(self, digests):
+		with self.lock:
+			refs = self._load()
+			for digest in digests:
+				refs[digest] -= 1
+
+	def open(self, name):
+		"""
+		Rebuild the tarball of an archive
+		:param name: string of archive name
+		:return: generator of tarball chunks
+		"""
+		manifest = self.manifest(name)
+		for entry in manifest['entries']:
+			yield base64.b64decode(entry['header'])
+			if entry['digest'] is not None:
+				with open(self._blob_path(entry['digest']), 'rb') as f:
+					while True:
+						chunk = f.read(self.chunk_size)
+						if not chunk:
+							break
+						yield chunk
+				padding = _padding(entry['size'])
+				if padding:
+					yield '\0' * padding
+		# end of archive
+		yield '\0' * (TAR_BLOCK * 2)
+
+	def remove(self, name):
+		"""
+		Remove the manifest of an archive, its blobs are removed by gc() when no other archive uses them
+		:param name: string of archive name
+		"""
+		path = self._manifest_path(name)
+		with self.lock:
+			refs = self._load()
+			manifest = self.manifest(name)
+			os.remove(path)
+			for digest in self._digests(manifest):
+				refs[digest] -= 1
+
+	def gc(self):
+		"""
+		Remove the blobs not referenced by any archive
+		:return: DICT of number of removed blobs and freed bytes
+		"""
+		removed = freed = 0
+		with self.lock:
+			refs = self._load()
+			for digest in [d for d, count in refs.items() if count <= 0]:
+				path = self._blob_path(digest)
+				if os.path.isfile(path):
+					freed += os.path.getsize(path)
+					os.remove(path)
+					removed += 1
+				del refs[digest]
+		return {'removed': removed, 'freed': freed}
+
+	def stats(self):
+		"""
+		:return: DICT of archives, the bytes of their tarballs, the bytes stored and the bytes saved by sharing
+		"""
+		with self.lock:
+			refs = dict(self._load())
+		archives = []
+		for name in self.names():
+			manifest = self.manifest(name)
+			archives.append({'name': name, 'image': manifest['image'], 'created': manifest['created'],
+			                 'size': manifest['size']})
+		logical = sum(a['size'] for a in archives)
+		stored = sum(os.path.getsize(self._blob_path(d)) for d in refs if os.path.isfile(self._blob_path(d)))
+		return {'archives': archives, 'tarball_bytes': logical, 'stored_bytes': stored,
+		        'saved_bytes': logical - stored, 'unreferenced': len([d for d, c in refs.items() if c <= 0])}
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+# Description: load benchmark of the main routes of api.py against the fake Docker Engine of fake_docker.py. The
+#              API runs in a child process connected to the fake daemon, every scenario is run by `concurrency`
+#              client threads for `duration` seconds. The result (p50/p90/p99 latency, requests/s, peak RSS of the
+#              API process) is written as JSON, --compare prints the change against a previous result.
+# Usage: python benchmarks/bench_api.py [--scenario images --scenario container_log ...] [--output result.json]
+#        python benchmarks/bench_api.py --compare baseline.json result.json
+
+import argparse
+import httplib
+import imp
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_docker
+
+
+def _form(**fields):
+	return urllib.urlencode(fields), {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def _image(options):
+	return 'bench/image-{}:latest'.format(random.randrange(options.images))
+
+
+def _container(options):
+	return 'bench-{}'.format(random.randrange(options.running if options.running is not None else options.containers))
+
+
+# scenario name -> callable(options, image tarball) returning (method, path, body, headers)
+SCENARIOS = {
+	'info': lambda o, tar: ('GET', '/api/v1/docker/info', None, {}),
+	'images': lambda o, tar: ('GET', '/api/v1/docker/image', None, {}),
+	'containers': lambda o, tar: ('POST', '/api/v1/docker/container') + _form(all='true'),
+	'image_inspect': lambda o, tar: ('POST', '/api/v1/docker/image/inspect') + _form(image_id=_image(o)),
+	'container_inspect': lambda o, tar: ('POST', '/api/v1/docker/container/inspect') +
+	                                    _form(container_id=_container(o)),
+	'container_log': lambda o, tar: ('POST', '/api/v1/docker/container/log') + _form(container_id=_container(o)),
+	'stats': lambda o, tar: ('POST', '/api/v1/docker/container/stats') + _form(container_id=_container(o)),
+	'stats_current': lambda o, tar: ('GET', '/api/v1/docker/container/stats/current', None, {}),
+	'image_save': lambda o, tar: ('GET', '/api/v1/docker/image/save/stream?' +
+	                              urllib.urlencode({'image_name': _image(o)}), None, {}),
+	'image_load': lambda o, tar: ('POST', '/api/v1/docker/image/load/stream', tar,
+	                              {'Content-Type': 'application/x-tar'}),
+}
+DEFAULT_SCENARIOS = ('info', 'images', 'containers', 'image_inspect', 'container_inspect', 'container_log', 'stats',
+                     'stats_current', 'image_save', 'image_load')
+
+
+def percentile(values, fraction):
+	if not values:
+		return None
+	return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def rss_kb(pid, field='VmRSS'):
+	try:
+		with open('/proc/{}/status'.format(pid)) as f:
+			for line in f:
+				if line.startswith(field + ':'):
+					return int(line.split()[1])
+	except IOError:
+		pass
+	return None
+
+
+class RSSMonitor:
+	"""
+	Peak resident memory of a process, sampled every `interval` seconds
+	"""
+	def __init__(self, pid, interval=0.05):
+		self.pid = pid
+		self.interval = interval
+		self.peak = 0
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._sample)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def reset(self):
+		self.peak = rss_kb(self.pid) or 0
+
+	def _sample(self):
+		while not self._stop.wait(self.interval):
+			self.peak = max(self.peak, rss_kb(self.pid) or 0)
+
+	def stop(self):
+		self._stop.set()
+
+
+def run_scenario(port, name, options, tar):
+	"""
+	:return: DICT of the scenario result
+	"""
+	make_request = SCENARIOS[name]
+	latencies = []
+	counters = {'errors': 0, 'bytes': 0}
+	lock = threading.Lock()
+	deadline = time.time() + options.duration
+
+	def client():
+		conn = httplib.HTTPConnection('127.0.0.1', port, timeout=60)
+		local, errors, received = [], 0, 0
+		while time.time() < deadline:
+			method, path, body, headers = make_request(options, tar)
+			started = time.time()
+			try:
+				conn.request(method, path, body, headers)
+				response = conn.getresponse()
+				while True:
+					data = response.read(65536)
+					if not data:
+						break
+					received += len(data)
+				if response.status >= 400:
+					errors += 1
+			except (httplib.HTTPException, socket.error):
+				errors += 1
+				conn.close()
+				conn = httplib.HTTPConnection('127.0.0.1', port, timeout=60)
+			local.append(time.time() - started)
+		conn.close()
+		with lock:
+			latencies.extend(local)
+			counters['errors'] += errors
+			counters['bytes'] += received
+
+	started = time.time()
+	clients = [threading.Thread(target=client) for _ in range(options.concurrency)]
+	for c in clients:
+		c.start()
+	for c in clients:
+		c.join()
+	seconds = time.time() - started
+	latencies.sort()
+	ms = lambda value: round(value * 1000, 3) if value is not None else None
+	return {'requests': len(latencies), 'errors': counters['errors'], 'seconds': round(seconds, 3),
+	        'requests_per_second': round(len(latencies) / seconds, 1),
+	        'mbytes_per_second': round(counters['bytes'] / seconds / 1024 ** 2, 2),
+	        'p50_ms': ms(percentile(latencies, 0.5)), 'p90_ms': ms(percentile(latencies, 0.9)),
+	        'p99_ms': ms(percentile(latencies, 0.99)), 'max_ms': ms(latencies[-1] if latencies else None)}
+
+
+def wait_ready(port, process, timeout=60):
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		if process.poll() is not None:
+			raise RuntimeError("The API exited with status {}".format(process.returncode))
+		try:
+			conn = httplib.HTTPConnection('127.0.0.1', port, timeout=5)
+			conn.request('GET', '/api/v1/docker/info')
+			if conn.getresponse().status == 200:
+				return
+		except (httplib.HTTPException, socket.error):
+			pass
+		time.sleep(0.2)
+	raise RuntimeError("The API didn't answer in {} seconds".format(timeout))
+
+
+def free_port():
+	s = socket.socket()
+	s.bind(('127.0.0.1', 0))
+	port = s.getsockname()[1]
+	s.close()
+	return port
+
+
+def serve_api(options):
+	# child process: the API connected to the fake daemon, configured before api.py reads api_env
+	import logging
+	import api_env
+	base_url = 'unix://' + options.socket
+	api_env.docker_base_url = base_url
+	api_env.docker_host_list = [base_url]
+	api_env.server_mode = options.server_mode
+	api_env.server_port = options.port
+	api_env.api_log = os.path.join(options.workdir, 'api.log')
+	api_env.logging_level = getattr(logging, options.log_level)
+	# the image catalog needs MongoDB
+	api_env.image_catalog_enabled = False
+	# api.py, not the api/ package next to it
+	api = imp.load_source('tesseract_api', os.path.join(ROOT, 'api.py'))
+	if options.server_mode == 'gevent':
+		api.serve()
+	else:
+		api.app.run(host=api_env.server_host, port=options.port, threaded=True)
+
+
+def run(options):
+	workdir = tempfile.mkdtemp(prefix='bench-api-')
+	socket_path = os.path.join(workdir, 'docker.sock')
+	fake = fake_docker.from_arguments(socket_path, options)
+	fake.start()
+	port = free_port()
+	command = [sys.executable, os.path.abspath(__file__), '--serve-api', '--socket', socket_path, '--port', str(port),
+	           '--workdir', workdir, '--server-mode', options.server_mode, '--log-level', options.log_level]
+	process = subprocess.Popen(command, cwd=workdir)
+	monitor = None
+	try:
+		wait_ready(port, process)
+		monitor = RSSMonitor(process.pid)
+		result = {'config': {'images': options.images, 'containers': options.containers, 'running': options.running,
+		                     'latency': options.latency, 'route_latency': options.route_latency,
+		                     'log_lines': options.log_lines, 'save_bytes': options.save_bytes,
+		                     'duration': options.duration, 'concurrency': options.concurrency,
+		                     'server_mode': options.server_mode},
+		          'started': time.time(), 'scenarios': {}}
+		for name in options.scenario or DEFAULT_SCENARIOS:
+			# a short warm up fills the caches and the connection pools
+			run_scenario(port, name, argparse.Namespace(**dict(vars(options), duration=min(1, options.duration))),
+			             fake.image_tar)
+			monitor.reset()
+			scenario = run_scenario(port, name, options, fake.image_tar)
+			scenario['peak_rss_kb'] = monitor.peak
+			result['scenarios'][name] = scenario
+			print >> sys.stderr, "{:<18} {:>8} req/s  p50 {:>9} ms  p99 {:>9} ms  errors {}".format(
+				name, scenario['requests_per_second'], scenario['p50_ms'], scenario['p99_ms'], scenario['errors'])
+		result['peak_rss_kb'] = rss_kb(process.pid, 'VmHWM')
+		result['daemon_calls'] = fake.calls
+		return result
+	finally:
+		if monitor is not None:
+			monitor.stop()
+		if process.poll() is None:
+			process.terminate()
+			process.wait()
+		fake.stop()
+		shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(baseline_path, result_path):
+	with open(baseline_path) as f:
+		baseline = json.load(f)
+	with open(result_path) as f:
+		result = json.load(f)
+	metrics = ('requests_per_second', 'p50_ms', 'p99_ms', 'peak_rss_kb')
+	print "{:<18} ".format('scenario') + ' '.join('{:>26}'.format(m) for m in metrics)
+	for name in sorted(set(baseline['scenarios']) & set(result['scenarios'])):
+		cells = []
+		for metric in metrics:
+			old, new = baseline['scenarios'][name].get(metric), result['scenarios'][name].get(metric)
+			change = '{:+.1f}%'.format((new - old) * 100.0 / old) if old and new is not None else 'n/a'
+			cells.append('{:>26}'.format('{} -> {} ({})'.format(old, new, change)))
+		print "{:<18} ".format(name) + ' '.join(cells)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Load benchmark of the API against a fake Docker Engine')
+	fake_docker.add_arguments(parser)
+	parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+	                    help='scenario to run, can be repeated. All of them by default')
+	parser.add_argument('--duration', type=float, default=10, help='seconds per scenario')
+	parser.add_argument('--concurrency', type=int, default=8, help='number of client threads')
+	parser.add_argument('--server-mode', default='threaded', choices=('threaded', 'gevent'))
+	parser.add_argument('--log-level', default='WARNING', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+	parser.add_argument('--output', help='JSON result file, stdout by default')
+	parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'RESULT'), help='compare two JSON results')
+	# child process options
+	parser.add_argument('--serve-api', action='store_true', help=argparse.SUPPRESS)
+	parser.add_argument('--socket', help=argparse.SUPPRESS)
+	parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+	parser.add_argument('--workdir', help=argparse.SUPPRESS)
+	options = parser.parse_args()
+	if options.compare:
+		compare(*options.compare)
+	elif options.serve_api:
+		serve_api(options)
+	else:
+		result = json.dumps(run(options), indent=2, sort_keys=True)
+		if options.output:
+			with open(options.output, 'w') as f:
+				f.write(result + '\n')
+		else:
+			print result
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+# Description: throughput and ratio of the export compression settings on a sample file, eg. a container tarball
+#              saved with `docker export`. Used to choose the compression, level and threads per workload.
+# Usage: python benchmarks/bench_compression.py <tarball> [max threads]
+
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compression import compress, zstandard
+from api_env import stream_chunk_size
+
+
+def read_chunks(path):
+	with open(path, 'rb') as f:
+		while True:
+			chunk = f.read(stream_chunk_size)
+			if not chunk:
+				break
+			yield chunk
+
+
+def main(path, max_threads=4):
+	size = os.path.getsize(path)
+	print "{}: {} bytes".format(path, size)
+	settings = [('gzip', level) for level in (1, 6)]
+	if zstandard is not None:
+		settings += [('zstd', level) for level in (1, 3, 9)]
+	for compression, level in settings:
+		threads = 1
+		while threads <= max_threads:
+			started = time.time()
+			compressed = sum(len(c) for c in compress(read_chunks(path), compression, level=level, threads=threads))
+			seconds = time.time() - started
+			print "  {:<5} level {:<2} threads {:<2} {:>8.1f} MB/s  ratio {:.3f}".format(
+				compression, level, threads, size / seconds / 1024 ** 2, float(size) / compressed)
+			threads *= 2
+
+
+if __name__ == '__main__':
+	main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 4)
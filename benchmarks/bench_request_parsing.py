@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+# Description: micro-benchmark of the request argument parsing. It compares the former global reqparse parser,
+#              which parsed all of the known arguments on every request, with the per-endpoint request schemas.
+# Usage: python benchmarks/bench_request_parsing.py [iterations]
+
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flask import Flask
+from flask_restful import reqparse
+from request_schema import RequestSchema, Field, boolean
+
+# the argument list of the former global parser
+LEGACY_ARGUMENTS = ['login_user', 'login_pass', 'registry_srv', 'keyword', 'repo', 'image', 'tag',
+                    'image_id', 'force', 'save_path', 'load_path', 'tarball_name', 'changes', 'all', 'command',
+                    'hostname', 'user', 'detach', 'stdin_open', 'tty', 'ports', 'environment', 'volumes',
+                    'network_disabled', 'name', 'entrypoint', 'working_dir', 'domainname', 'host_config',
+                    'mac_address', 'labels', 'stop_signal', 'networking_config', 'healthcheck', 'stop_timeout',
+                    'runtime', 'container_id', 'match', 'image_name', 'image_tag',
+                    'repo_name', 'tag_name', 'tier', 'window',
+                    'tail', 'since', 'until', 'timestamps', 'stdout', 'stderr', 'limit', 'cursor', 'follow',
+                    'timeout', 'action', 'concurrency', 'mode']
+
+
+def main(iterations=5000):
+	app = Flask(__name__)
+	legacy = reqparse.RequestParser()
+	for name in LEGACY_ARGUMENTS:
+		legacy.add_argument(name)
+	single = RequestSchema(Field('container_id', required=True))
+	log = RequestSchema(Field('container_id', required=True), Field('tail', type=int), Field('since', type=int),
+	                    Field('until', type=int), Field('limit', type=int), Field('follow', type=boolean))
+	cases = [
+		('legacy reqparse ({} args)'.format(len(LEGACY_ARGUMENTS)), legacy.parse_args),
+		('schema, 1 field', single.parse),
+		('schema, 6 fields', log.parse),
+	]
+	bodies = [('form', {'data': {'container_id': 'c1', 'tail': '100', 'follow': 'false'}}),
+	          ('json', {'json': {'container_id': 'c1', 'tail': 100, 'follow': False}})]
+	for body_name, body in bodies:
+		print "{} body, {} iterations".format(body_name, iterations)
+		with app.test_request_context('/api/v1/docker/container/log', method='POST', **body):
+			for name, parse in cases:
+				elapsed = timeit.timeit(parse, number=iterations)
+				print "  {:<32} {:>8.1f} us/parse".format(name, elapsed / iterations * 1e6)
+
+
+if __name__ == '__main__':
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+
+# Description: a fake Docker Engine served on a unix socket, for the benchmarks. It answers the Engine API calls
+#              made by docker_wrap.Docker with generated images and containers, so the API runs unchanged against
+#              it. The number of objects, the latency of every call and the size of the streamed payloads are
+#              configurable, more routes can be added with FakeDocker.route().
+# Usage: python benchmarks/fake_docker.py --socket /tmp/fake-docker.sock [--images 500] [--containers 200] ...
+
+import argparse
+import BaseHTTPServer
+import hashlib
+import json
+import os
+import re
+import SocketServer
+import struct
+import tarfile
+import threading
+import time
+import urlparse
+
+API_VERSION = re.compile(r'^/v[0-9.]+')
+
+
+def object_id(kind, index):
+	return hashlib.sha256('{}-{}'.format(kind, index)).hexdigest()
+
+
+def timestamp(seconds):
+	return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)) + '.{:09d}Z'.format(int(seconds % 1 * 1e9))
+
+
+class NotFound(Exception):
+	pass
+
+
+class UnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	daemon_threads = True
+
+	def handle_error(self, request, client_address):
+		# the API closing a stream connection, eg. a stats subscription at exit
+		pass
+
+
+class FakeDockerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def log_message(self, format, *args):
+		pass
+
+	def address_string(self):
+		return 'unix'
+
+	def do_GET(self):
+		self.dispatch('GET')
+
+	def do_POST(self):
+		self.dispatch('POST')
+
+	def do_DELETE(self):
+		self.dispatch('DELETE')
+
+	def do_HEAD(self):
+		self.dispatch('HEAD')
+
+	def dispatch(self, method):
+		url = urlparse.urlparse(self.path)
+		path = API_VERSION.sub('', url.path)
+		query = dict((k, v[-1]) for k, v in urlparse.parse_qs(url.query).items())
+		fake = self.server.fake
+		for route_method, pattern, name, handler in fake.routes:
+			if route_method != method:
+				continue
+			match = pattern.match(path)
+			if match is None:
+				continue
+			fake.count(name)
+			latency = fake.route_latency.get(name, fake.latency)
+			if latency:
+				time.sleep(latency)
+			try:
+				handler(self, query, *match.groups())
+			except NotFound as e:
+				self.send_json({'message': str(e)}, 404)
+			except IOError:
+				# the client closed a stream
+				self.close_connection = 1
+			return
+		self.send_json({'message': 'page not found'}, 404)
+
+	def send_json(self, data, status=200):
+		body = json.dumps(data)
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def start_stream(self, content_type):
+		self.send_response(200)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Transfer-Encoding', 'chunked')
+		self.end_headers()
+
+	def send_chunk(self, data):
+		if data:
+			self.wfile.write('{:x}\r\n{}\r\n'.format(len(data), data))
+			self.wfile.flush()
+
+	def end_stream(self):
+		self.wfile.write('0\r\n\r\n')
+
+	def read_body(self):
+		"""
+		:return: INT of bytes of the request body, read in chunks and dropped
+		"""
+		if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+			size = 0
+			while True:
+				length = int(self.rfile.readline().split(';')[0].strip() or '0', 16)
+				if length == 0:
+					# trailers up to the empty line
+					while self.rfile.readline() not in ('\r\n', '\n', ''):
+						pass
+					return size
+				remaining = length
+				while remaining:
+					remaining -= len(self.rfile.read(min(remaining, 65536)))
+				self.rfile.readline()
+				size += length
+		remaining = length = int(self.headers.get('Content-Length') or 0)
+		while remaining:
+			remaining -= len(self.rfile.read(min(remaining, 65536)))
+		return length
+
+
+class FakeDocker:
+	"""
+	Fake daemon with `images` images and `containers` containers, `running` of them running. Every call waits
+	`latency` seconds, or `route_latency[route name]`, before answering.
+	"""
+	def __init__(self, socket_path, images=100, containers=50, running=None, latency=0.0, route_latency=None,
+	             log_lines=1000, save_bytes=16 * 1024 ** 2, stats_interval=1.0, chunk_size=64 * 1024):
+		self.socket_path = socket_path
+		self.latency = latency
+		self.route_latency = route_latency or {}
+		self.log_lines = log_lines
+		self.stats_interval = stats_interval
+		self.chunk_size = chunk_size
+		self.lock = threading.Lock()
+		# route name -> number of calls
+		self.calls = {}
+		self.routes = []
+		self.server = None
+		self._stop = threading.Event()
+		now = int(time.time())
+		self.images = [self._image(i, now) for i in range(images)]
+		running = containers if running is None else running
+		self.containers = [self._container(i, now, i < running) for i in range(containers)]
+		self.image_tar = self._image_tar(save_bytes)
+		self._add_default_routes()
+
+	def _image(self, index, now):
+		return {'Id': 'sha256:' + object_id('image', index), 'ParentId': '',
+		        'RepoTags': ['bench/image-{}:latest'.format(index)],
+		        'RepoDigests': ['bench/image-{}@sha256:{}'.format(index, object_id('digest', index))],
+		        'Created': now - index * 60, 'Size': 50 * 1024 ** 2 + index, 'VirtualSize': 50 * 1024 ** 2 + index,
+		        'SharedSize': -1, 'Labels': {'bench.group': str(index % 10)}, 'Containers': -1}
+
+	def _container(self, index, now, running):
+		image = self.images[index % len(self.images)] if self.images else {'Id': '', 'RepoTags': ['none']}
+		return {'Id': object_id('container', index), 'Names': ['/bench-{}'.format(index)],
+		        'Image': image['RepoTags'][0], 'ImageID': image['Id'], 'Command': 'sleep infinity',
+		        'Created': now - index, 'Ports': [], 'Labels': {'bench.group': str(index % 10)},
+		        'State': 'running' if running else 'exited', 'Status': 'Up 1 hour' if running else 'Exited (0)',
+		        'HostConfig': {'NetworkMode': 'default'},
+		        'NetworkSettings': {'Networks': {'bridge': {'IPAddress': '172.17.{}.{}'.format(index // 250,
+		                                                                                       index % 250 + 2)}}},
+		        'Mounts': []}
+
+	def _image_tar(self, size):
+		# a saved image tarball with one layer of `size` bytes
+		layer = tarfile.TarInfo('layer/layer.tar')
+		layer.size = size
+		padding = (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE) % tarfile.BLOCKSIZE
+		block = os.urandom(min(size, 1024 ** 2)) if size else ''
+		data = (block * (size // len(block) + 1))[:size] if block else ''
+		return layer.tobuf(tarfile.GNU_FORMAT) + data + tarfile.NUL * padding + tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+
+	def route(self, method, pattern, name, handler):
+		"""
+		Add a route, checked before the default ones
+		:param method: string of HTTP method
+		:param pattern: string of regular expression of the path without the API version, eg. r'^/info$'
+		:param name: string of route name, used for the call counts and the route_latency
+		:param handler: callable(request handler, DICT of query, *path groups)
+		"""
+		self.routes.insert(0, (method, re.compile(pattern), name, handler))
+
+	def _add(self, method, pattern, name, handler):
+		self.routes.append((method, re.compile(pattern), name, handler))
+
+	def count(self, name):
+		with self.lock:
+			self.calls[name] = self.calls.get(name, 0) + 1
+
+	def find_image(self, name):
+		for image in self.images:
+			if image['Id'] == name or image['Id'][7:].startswith(name) or name in image['RepoTags']:
+				return image
+		raise NotFound('No such image: {}'.format(name))
+
+	def find_container(self, name):
+		for container in self.containers:
+			if container['Id'].startswith(name) or '/' + name in container['Names']:
+				return container
+		raise NotFound('No such container: {}'.format(name))
+
+	def _add_default_routes(self):
+		self._add('GET', r'^/_ping$', 'ping', self.ping)
+		self._add('GET', r'^/version$', 'version', self.version)
+		self._add('GET', r'^/info$', 'info', self.info)
+		self._add('GET', r'^/system/df$', 'df', self.df)
+		self._add('GET', r'^/events$', 'events', self.events)
+		self._add('GET', r'^/images/json$', 'images', self.list_images)
+		self._add('POST', r'^/images/load$', 'image_load', self.load_image)
+		self._add('GET', r'^/images/(.+)/get$', 'image_get', self.get_image)
+		self._add('GET', r'^/images/(.+)/json$', 'image_inspect', self.inspect_image)
+		self._add('GET', r'^/containers/json$', 'containers', self.list_containers)
+		self._add('GET', r'^/containers/([^/]+)/json$', 'container_inspect', self.inspect_container)
+		self._add('GET', r'^/containers/([^/]+)/logs$', 'container_logs', self.logs)
+		self._add('GET', r'^/containers/([^/]+)/stats$', 'container_stats', self.stats)
+		self._add('GET', r'^/containers/([^/]+)/top$', 'container_top', self.top)
+
+	def ping(self, request, query):
+		request.send_response(200)
+		request.send_header('Content-Length', '2')
+		request.end_headers()
+		request.wfile.write('OK')
+
+	def version(self, request, query):
+		request.send_json({'Version': '18.03.1-ce', 'ApiVersion': '1.37', 'MinAPIVersion': '1.12', 'Os': 'linux',
+		                   'Arch': 'amd64', 'KernelVersion': os.uname()[2]})
+
+	def info(self, request, query):
+		running = len([c for c in self.containers if c['State'] == 'running'])
+		request.send_json({'ID': 'FAKE:DOCKER', 'Containers': len(self.containers), 'ContainersRunning': running,
+		                   'ContainersStopped': len(self.containers) - running, 'Images': len(self.images),
+		                   'Driver': 'overlay2', 'NCPU': 1, 'MemTotal': 8 * 1024 ** 3, 'Name': 'fake-docker',
+		                   'ServerVersion': '18.03.1-ce', 'OperatingSystem': 'fake'})
+
+	def df(self, request, query):
+		request.send_json({'LayersSize': sum(i['Size'] for i in self.images), 'Images': self.images,
+		                   'Containers': self.containers, 'Volumes': []})
+
+	def events(self, request, query):
+		# no event ever happens, the stream stays open until the client or the daemon closes it
+		request.start_stream('application/json')
+		while not self._stop.wait(1):
+			pass
+		request.end_stream()
+
+	def list_images(self, request, query):
+		request.send_json(self.images)
+
+	def inspect_image(self, request, query, name):
+		image = self.find_image(name)
+		request.send_json({'Id': image['Id'], 'RepoTags': image['RepoTags'], 'RepoDigests': image['RepoDigests'],
+		                   'Created': timestamp(image['Created']), 'Size': image['Size'],
+		                   'VirtualSize': image['VirtualSize'], 'Architecture': 'amd64', 'Os': 'linux',
+		                   'Config': {'Labels': image['Labels'], 'Env': ['PATH=/usr/bin:/bin'], 'Cmd': ['sh']},
+		                   'RootFS': {'Type': 'layers', 'Layers': ['sha256:' + object_id('layer', 0)]}})
+
+	def get_image(self, request, query, name):
+		self.find_image(name)
+		request.start_stream('application/x-tar')
+		for start in range(0, len(self.image_tar), self.chunk_size):
+			request.send_chunk(self.image_tar[start:start + self.chunk_size])
+		request.end_stream()
+
+	def load_image(self, request, query):
+		size = request.read_body()
+		request.start_stream('application/json')
+		request.send_chunk(json.dumps({'stream': 'Loaded image: bench/loaded:latest ({} bytes)\n'.format(size)}))
+		request.end_stream()
+
+	def list_containers(self, request, query):
+		if query.get('all') in ('1', 'true', 'True'):
+			request.send_json(self.containers)
+		else:
+			request.send_json([c for c in self.containers if c['State'] == 'running'])
+
+	def inspect_container(self, request, query, name):
+		container = self.find_container(name)
+		request.send_json({'Id': container['Id'], 'Name': container['Names'][0], 'Image': container['ImageID'],
+		                   'Created': timestamp(container['Created']),
+		                   'State': {'Status': container['State'], 'Running': container['State'] == 'running',
+		                             'Pid': 1000, 'ExitCode': 0},
+		                   'Config': {'Image': container['Image'], 'Labels': container['Labels'], 'Tty': False,
+		                              'Cmd': ['sleep', 'infinity'], 'Env': ['PATH=/usr/bin:/bin']},
+		                   'HostConfig': container['HostConfig'], 'NetworkSettings': container['NetworkSettings'],
+		                   'Mounts': []})
+
+	def logs(self, request, query, name):
+		container = self.find_container(name)
+		tail = query.get('tail', 'all')
+		count = self.log_lines if tail == 'all' else min(int(tail), self.log_lines)
+		started = container['Created']
+		request.start_stream('application/vnd.docker.raw-stream')
+		frames = []
+		for i in range(self.log_lines - count, self.log_lines):
+			line = '{} line {} of {}\n'.format(timestamp(started + i * 0.001), i, container['Names'][0])
+			# stdout frame of the multiplexed stream
+			frames.append(struct.pack('>BxxxL', 1, len(line)) + line)
+			if len(frames) == 100:
+				request.send_chunk(''.join(frames))
+				frames = []
+		request.send_chunk(''.join(frames))
+		request.end_stream()
+
+	def _stats(self, container, now, sample):
+		return {'read': timestamp(now), 'pids_stats': {'current': 3},
+		        'cpu_stats': {'cpu_usage': {'total_usage': sample * 10 ** 7, 'percpu_usage': [sample * 10 ** 7]},
+		                      'system_cpu_usage': sample * 10 ** 9, 'online_cpus': 1},
+		        'memory_stats': {'usage': 64 * 1024 ** 2, 'limit': 8 * 1024 ** 3, 'stats': {'cache': 1024 ** 2}},
+		        'networks': {'eth0': {'rx_bytes': sample * 1000, 'tx_bytes': sample * 500}},
+		        'blkio_stats': {'io_service_bytes_recursive': [{'op': 'Read', 'value': sample * 4096},
+		                                                       {'op': 'Write', 'value': sample * 8192}]}}
+
+	def stats(self, request, query, name):
+		container = self.find_container(name)
+		if query.get('stream') in ('0', 'false', 'False'):
+			request.send_json(self._stats(container, time.time(), 1))
+			return
+		request.start_stream('application/json')
+		sample = 1
+		while not self._stop.is_set():
+			request.send_chunk(json.dumps(self._stats(container, time.time(), sample)) + '\n')
+			sample += 1
+			self._stop.wait(self.stats_interval)
+		request.end_stream()
+
+	def top(self, request, query, name):
+		self.find_container(name)
+		request.send_json({'Titles': ['UID', 'PID', 'CMD'], 'Processes': [['root', '1000', 'sleep infinity']]})
+
+	def start(self):
+		if os.path.exists(self.socket_path):
+			os.remove(self.socket_path)
+		self._stop.clear()
+		self.server = UnixHTTPServer(self.socket_path, FakeDockerHandler)
+		self.server.fake = self
+		thread = threading.Thread(target=self.server.serve_forever, name='fake-docker')
+		thread.daemon = True
+		thread.start()
+		return 'unix://' + self.socket_path
+
+	def stop(self):
+		self._stop.set()
+		if self.server is not None:
+			self.server.shutdown()
+			self.server.server_close()
+			self.server = None
+		if os.path.exists(self.socket_path):
+			os.remove(self.socket_path)
+
+
+def add_arguments(parser):
+	parser.add_argument('--images', type=int, default=100, help='number of images')
+	parser.add_argument('--containers', type=int, default=50, help='number of containers')
+	parser.add_argument('--running', type=int, help='number of running containers, all of them by default')
+	parser.add_argument('--latency', type=float, default=0.0, help='seconds before every answer')
+	parser.add_argument('--route-latency', action='append', default=[], metavar='ROUTE=SECONDS',
+	                    help='latency of one route, eg. containers=0.05')
+	parser.add_argument('--log-lines', type=int, default=1000, help='number of lines of every container log')
+	parser.add_argument('--save-bytes', type=int, default=16 * 1024 ** 2, help='layer size of the saved images')
+	parser.add_argument('--stats-interval', type=float, default=1.0, help='seconds between streamed stats')
+
+
+def from_arguments(socket_path, args):
+	route_latency = dict((name, float(seconds)) for name, _, seconds in
+	                     (value.partition('=') for value in args.route_latency))
+	return FakeDocker(socket_path, images=args.images, containers=args.containers, running=args.running,
+	                  latency=args.latency, route_latency=route_latency, log_lines=args.log_lines,
+	                  save_bytes=args.save_bytes, stats_interval=args.stats_interval)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Fake Docker Engine on a unix socket')
+	parser.add_argument('--socket', default='/tmp/fake-docker.sock')
+	add_arguments(parser)
+	args = parser.parse_args()
+	fake = from_arguments(args.socket, args)
+	print "Serving a fake Docker Engine on {}".format(fake.start())
+	try:
+		while True:
+			time.sleep(60)
+	except KeyboardInterrupt:
+		fake.stop()
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the content-addressed cache of the build context files. The client sends the
+#              sha256 of every file of its context, uploads only the blobs the cache doesn't have, and the build
+#              context tar is assembled from the cached blobs while it is streamed to the daemon.
+
+import hashlib
+import os
+import re
+import tarfile
+import threading
+import time
+from api_env import *
+
+DIGEST = re.compile(r'^(sha256:)?([0-9a-f]{64})$')
+
+
+def parse_digest(digest):
+	"""
+	:param digest: string of "sha256:<hex>" or "<hex>"
+	:return: string of 64 hex characters
+	"""
+	match = DIGEST.match(digest or '')
+	if match is None:
+		raise ValueError("Invalidate digest: {}".format(digest))
+	return match.group(2)
+
+
+def parse_context(files):
+	"""
+	Validate the file list of a build context
+	:param files: DICT of path -> digest string, or path -> DICT of 'digest' and 'mode'
+	:return: LIST of (path, hex digest, mode) sorted by path
+	"""
+	if not isinstance(files, dict) or not files:
+		raise ValueError("The build context has no files")
+	context = []
+	for path, entry in files.items():
+		if not isinstance(entry, dict):
+			entry = {'digest': entry}
+		path = os.path.normpath(path).lstrip('/')
+		if path.startswith('..') or path in ('', '.'):
+			raise ValueError("Invalidate path: {}".format(path))
+		context.append((path, parse_digest(entry.get('digest')), int(entry.get('mode', 0644))))
+	return sorted(context)
+
+
+class BlobStore:
+	"""
+	Cached context file blobs stored as `path/<2 hex>/<64 hex>`. The least recently used blobs are removed when the
+	cache grows over `max_bytes`, except the ones of a running build and the ones uploaded in the last
+	`upload_grace` seconds.
+	"""
+	def __init__(self, path=build_cache_path, max_bytes=build_cache_max_bytes, upload_grace=build_cache_upload_grace):
+		self.path = path
+		self.max_bytes = max_bytes
+		self.upload_grace = upload_grace
+		self.lock = threading.Lock()
+		# hex digest -> [size, last used]
+		self.blobs = None
+		self.total = 0
+		# hex digest -> number of builds streaming the blob, a pinned blob is never evicted
+		self.pins = {}
+		# hex digest -> upload time of the blobs not pinned by a build yet
+		self.uploads = {}
+
+	def _load(self):
+		if self.blobs is None:
+			blobs = {}
+			if os.path.isdir(self.path):
+				for prefix in os.listdir(self.path):
+					if not os.path.isdir(os.path.join(self.path, prefix)):
+						continue
+					for name in os.listdir(os.path.join(self.path, prefix)):
+						if DIGEST.match(name):
+							stat = os.stat(os.path.join(self.path, prefix, name))
+							blobs[name] = [stat.st_size, stat.st_mtime]
+			self.blobs = blobs
+			self.total = sum(b[0] for b in blobs.values())
+		return self.blobs
+
+	def blob_path(self, digest):
+		return os.path.join(self.path, digest[:2], digest)
+
+	def missing(self, digests):
+		"""
+		:param digests: LIST of hex digests
+		:return: LIST of the digests not in the cache
+		"""
+		with self.lock:
+			blobs = self._load()
+			return sorted(set(d for d in digests if d not in blobs))
+
+	def size(self, digest):
+		with self.lock:
+			blob = self._load().get(digest)
+			return blob[0] if blob is not None else None
+
+	def put(self, digest, stream, chunk_size=stream_chunk_size):
+		"""
+		Store an uploaded blob, its content must match the digest
+		:param digest: hex digest
+		:param stream: file-like object of the blob content
+		:return: INT of blob size
+		"""
+		path = self.blob_path(digest)
+		if not os.path.isdir(os.path.dirname(path)):
+			try:
+				os.makedirs(os.path.dirname(path))
+			except OSError:
+				# created meanwhile by a concurrent upload
+				pass
+		# written to a temporary name first, a blob in the cache is always complete
+		partial = '{}.{}.partial'.format(path, threading.current_thread().ident)
+		sha = hashlib.sha256()
+		size = 0
+		try:
+			with open(partial, 'wb') as f:
+				while True:
+					chunk = stream.read(chunk_size)
+					if not chunk:
+						break
+					sha.update(chunk)
+					size += len(chunk)
+					f.write(chunk)
+			if sha.hexdigest() != digest:
+				raise ValueError("Content doesn't match digest {}".format(digest))
+			os.rename(partial, path)
+		finally:
+			if os.path.exists(partial):
+				os.remove(partial)
+		with self.lock:
+			blobs = self._load()
+			if digest not in blobs:
+				self.total += size
+			blobs[digest] = [size, time.time()]
+			self.uploads[digest] = time.time()
+			self._evict(keep=digest)
+		return size
+
+	def pin(self, digests):
+		"""
+		Keep the blobs of a build in the cache until unpin(), they are also marked as used
+		:param digests: LIST of hex digests
+		:return: LIST of the digests not in the cache, nothing is pinned if there is any
+		"""
+		now = time.time()
+		with self.lock:
+			blobs = self._load()
+			missing = sorted(set(d for d in digests if d not in blobs))
+			if missing:
+				return missing
+			for digest in digests:
+				blobs[digest][1] = now
+				self.pins[digest] = self.pins.get(digest, 0) + 1
+				# the build that needed the upload is running, the pin keeps it from now on
+				self.uploads.pop(digest, None)
+			return []
+
+	def unpin(self, digests):
+		with self.lock:
+			for digest in digests:
+				count = self.pins.get(digest, 0) - 1
+				if count > 0:
+					self.pins[digest] = count
+				else:
+					self.pins.pop(digest, None)
+			self._evict()
+
+	def _evict(self, keep=None):
+		now = time.time()
+		for digest, uploaded in self.uploads.items():
+			if now - uploaded >= self.upload_grace:
+				del self.uploads[digest]
+		if self.total <= self.max_bytes:
+			return
+		for digest, (size, _) in sorted(self.blobs.items(), key=lambda item: item[1][1]):
+			if self.total <= self.max_bytes:
+				break
+			if digest == keep or digest in self.pins or digest in self.uploads:
+				# just stored, streamed by a build or waiting for its build, the cache stays over max_bytes meanwhile
+				continue
+			try:
+				os.remove(self.blob_path(digest))
+			except OSError:
+				pass
+			del self.blobs[digest]
+			self.total -= size
+
+	def stats(self):
+		with self.lock:
+			return {'blobs': len(self._load()), 'bytes': self.total, 'max_bytes': self.max_bytes}
+
+	def context_tar(self, context, chunk_size=stream_chunk_size, progress=None):
+		"""
+		Stream a build context tar assembled from the cached blobs, no temporary tar file is written
+		:param context: LIST of (path, hex digest, mode) of parse_context()
+		:param progress: callable taking the number of bytes sent so far
+		:return: generator of tar chunks
+		"""
+		sent = 0
+		for path, digest, mode in context:
+			with open(self.blob_path(digest), 'rb') as f:
+				info = tarfile.TarInfo(path)
+				info.size = os.fstat(f.fileno()).st_size
+				info.mode = mode
+				info.mtime = 0
+				header = info.tobuf(tarfile.GNU_FORMAT)
+				sent += len(header)
+				yield header
+				while True:
+					chunk = f.read(chunk_size)
+					if not chunk:
+						break
+					sent += len(chunk)
+					yield chunk
+					if progress is not None:
+						progress(sent)
+				padding = (tarfile.BLOCKSIZE - info.size % tarfile.BLOCKSIZE) % tarfile.BLOCKSIZE
+				if padding:
+					sent += padding
+					yield tarfile.NUL * padding
+		# end of archive
+		yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
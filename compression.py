@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the streamed compression of the exported/imported tarballs. gzip is compressed
+#              in independent blocks on a thread pool, every block is one gzip member so the output is a standard
+#              multi-member gzip file. zstd uses the multi-threaded compressor of the zstandard package.
+
+import collections
+import zlib
+from multiprocessing.pool import ThreadPool
+from api_env import *
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+COMPRESSIONS = ('none', 'gzip', 'zstd')
+# leading bytes of the compressed streams, used to detect the compression of an upload
+MAGIC = {'gzip': '\x1f\x8b', 'zstd': '\x28\xb5\x2f\xfd'}
+MIME_TYPES = {'none': 'application/x-tar', 'gzip': 'application/gzip', 'zstd': 'application/zstd'}
+EXTENSIONS = {'none': '.tar', 'gzip': '.tar.gz', 'zstd': '.tar.zst'}
+
+
+def check_compression(compression):
+	if compression not in COMPRESSIONS:
+		raise ValueError("Unsupported compression: {}".format(compression))
+	if compression == 'zstd' and zstandard is None:
+		raise ValueError("zstd compression requires the zstandard package")
+
+
+def _thread_pool(size):
+	# in the 'gevent' server mode the threading module makes greenlets, the blocks are compressed on real threads
+	try:
+		from gevent import monkey
+		if monkey.is_module_patched('threading'):
+			from gevent.threadpool import ThreadPool as GeventThreadPool
+			return GeventThreadPool(size)
+	except ImportError:
+		pass
+	return ThreadPool(size)
+
+
+def _close_pool(pool):
+	if hasattr(pool, 'terminate'):
+		pool.terminate()
+	else:
+		pool.kill()
+
+
+def _blocks(chunks, block_size):
+	buffered = []
+	length = 0
+	for chunk in chunks:
+		buffered.append(chunk)
+		length += len(chunk)
+		if length >= block_size:
+			data = ''.join(buffered)
+			for start in range(0, len(data) - block_size + 1, block_size):
+				yield data[start:start + block_size]
+			rest = data[len(data) - len(data) % block_size:]
+			buffered = [rest] if rest else []
+			length = len(rest)
+	if length:
+		yield ''.join(buffered)
+
+
+def _gzip_member(block, level):
+	# zlib releases the GIL while it compresses, the blocks are compressed in parallel
+	compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	return compressor.compress(block) + compressor.flush()
+
+
+def compress(chunks, compression, level=None, threads=compress_threads, block_size=compress_block_size):
+	"""
+	Compress a stream
+	:param chunks: iterator of data chunks
+	:param compression: one of COMPRESSIONS
+	:param level: INT of compression level, the default of the compression if None
+	:param threads: INT of number of threads
+	:param block_size: INT of bytes compressed at once by one gzip thread
+	:return: generator of compressed chunks, in order
+	"""
+	check_compression(compression)
+	if compression == 'none':
+		for chunk in chunks:
+			yield chunk
+	elif compression == 'zstd':
+		compressor = zstandard.ZstdCompressor(level=level or 3, threads=threads).compressobj()
+		for chunk in chunks:
+			data = compressor.compress(chunk)
+			if data:
+				yield data
+		yield compressor.flush()
+	else:
+		level = level or 6
+		pool = _thread_pool(threads)
+		# at most 2 blocks per thread are held, the daemon stream is read as fast as they are compressed
+		pending = collections.deque()
+		try:
+			for block in _blocks(chunks, block_size):
+				pending.append(pool.apply_async(_gzip_member, (block, level)))
+				if len(pending) >= threads * 2:
+					yield pending.popleft().get()
+			while pending:
+				yield pending.popleft().get()
+		finally:
+			_close_pool(pool)
+
+
+def detect_compression(head):
+	"""
+	:param head: string of the first bytes of a stream
+	:return: 'gzip', 'zstd' or 'none'
+	"""
+	for compression, magic in MAGIC.items():
+		if head.startswith(magic):
+			return compression
+	return 'none'
+
+
+def decompress(chunks, compression='auto'):
+	"""
+	Decompress a stream while it is read
+	:param chunks: iterator of compressed chunks
+	:param compression: one of COMPRESSIONS, or 'auto' to detect it from the leading bytes
+	:return: generator of decompressed chunks
+	"""
+	chunks = iter(chunks)
+	head = ''
+	if compression == 'auto':
+		for chunk in chunks:
+			head += chunk
+			if len(head) >= 4:
+				break
+		compression = detect_compression(head)
+	check_compression(compression)
+	stream = _chain(head, chunks)
+	if compression == 'none':
+		for chunk in stream:
+			yield chunk
+	elif compression == 'zstd':
+		decompressor = zstandard.ZstdDecompressor().decompressobj()
+		for chunk in stream:
+			data = decompressor.decompress(chunk)
+			if data:
+				yield data
+	else:
+		# a multi-member gzip stream, a new decompressor starts after the end of every member
+		decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+		for chunk in stream:
+			while chunk:
+				data = decompressor.decompress(chunk)
+				if data:
+					yield data
+				chunk = decompressor.unused_data
+				if chunk:
+					decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+		data = decompressor.flush()
+		if data:
+			yield data
+
+
+def _chain(head, chunks):
+	if head:
+		yield head
+	for chunk in chunks:
+		yield chunk
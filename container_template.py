@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the named container templates. A template is stored in the 'conf_container'
+#              collection, validated and compiled once into a create payload, and instantiated with small overrides.
+
+import copy
+import json
+import threading
+import time
+from docker.utils import split_command
+from api_env import *
+from helper import iter_parallel, ParallelTimeout
+
+TEMPLATE_COLLECTION = u'conf_container'
+# per-container values which could be changed without compiling the template again
+TEMPLATE_OVERRIDES = ('command', 'environment', 'labels', 'hostname')
+
+
+def apply_overrides(payload, overrides):
+	"""
+	Apply the per-container overrides to a copy of a compiled create payload
+	:param payload: DICT of compiled create payload
+	:param overrides: DICT of 'command', 'environment' (DICT, merged), 'labels' (DICT, merged) or 'hostname'
+	:return: DICT of create payload
+	"""
+	unknown = set(overrides) - set(TEMPLATE_OVERRIDES)
+	if unknown:
+		raise ValueError("Unsupported overrides: {}".format(', '.join(sorted(unknown))))
+	payload = copy.deepcopy(payload)
+	if overrides.get('command') is not None:
+		command = overrides['command']
+		payload['Cmd'] = split_command(command) if isinstance(command, basestring) else command
+	if overrides.get('environment'):
+		env = dict(e.split('=', 1) for e in payload.get('Env') or [] if '=' in e)
+		env.update(overrides['environment'])
+		payload['Env'] = ['{}={}'.format(k, v) for k, v in sorted(env.items())]
+	if overrides.get('labels'):
+		labels = dict(payload.get('Labels') or {})
+		labels.update(overrides['labels'])
+		payload['Labels'] = labels
+	if overrides.get('hostname') is not None:
+		payload['Hostname'] = overrides['hostname']
+	return payload
+
+
+class ContainerTemplates:
+	"""
+	Registry of named container templates. The specs are stored in the database, the compiled payloads are
+	kept in memory so creating a container from a template skips the validation and config building.
+	"""
+	def __init__(self, docker, database_factory):
+		self.docker = docker
+		self.database_factory = database_factory
+		self.database = None
+		self.lock = threading.Lock()
+		# template name -> DICT of stored template with the compiled 'payload'
+		self.templates = None
+
+	def _db(self):
+		if self.database is None:
+			self.database = self.database_factory()
+		return self.database
+
+	def _load(self):
+		# templates are loaded and compiled once, on first use
+		if self.templates is None:
+			templates = {}
+			for record in self._db().document_search(TEMPLATE_COLLECTION, {'kind': 'template'}):
+				record.pop('_id', None)
+				# the spec is stored as JSON text, label keys may contain dots which mongo doesn't allow
+				record['spec'] = json.loads(record['spec'])
+				record['payload'] = self.docker.compile_container_config(record['spec'])
+				templates[record['name']] = record
+			self.templates = templates
+		return self.templates
+
+	def register(self, name, spec):
+		"""
+		Validate, compile and store a template, an existing template with the same name is replaced
+		:param name: string of template name
+		:param spec: DICT of container spec, see Docker.compile_container_config()
+		:return: DICT of stored template
+		"""
+		payload = self.docker.compile_container_config(spec)
+		with self.lock:
+			templates = self._load()
+			version = templates[name]['version'] + 1 if name in templates else 1
+			record = {'kind': 'template', 'name': name, 'spec': spec, 'version': version, 'updated': time.time()}
+			stored = dict(record, spec=json.dumps(spec))
+			self._db().document_replace(TEMPLATE_COLLECTION, {'kind': 'template', 'name': name}, stored)
+			record['payload'] = payload
+			templates[name] = record
+		return record
+
+	def remove(self, name):
+		"""
+		:param name: string of template name
+		:return: True if the template existed
+		"""
+		with self.lock:
+			existed = self._load().pop(name, None) is not None
+			self._db().document_remove(TEMPLATE_COLLECTION, [{'kind': 'template', 'name': name}])
+		return existed
+
+	def get(self, name):
+		return self._load().get(name)
+
+	def list(self):
+		return [dict((k, v) for k, v in t.items() if k != 'payload') for t in self._load().values()]
+
+	def instantiate(self, name, overrides=None, container_names=None, count=1, concurrency=batch_concurrency,
+	                timeout=batch_timeout, max_containers=template_run_max_containers):
+		"""
+		Create containers from a template
+		:param name: string of template name
+		:param overrides: DICT of overrides applied to all of the containers, see apply_overrides()
+		:param container_names: LIST of container names, its length is the number of containers to create
+		:param count: INT of number of unnamed containers to create when container_names is not given
+		:param concurrency: INT of max number of concurrent create calls
+		:param timeout: seconds for creating all of the containers
+		:param max_containers: INT of max number of containers created at once
+		:return: LIST of DICT result per container
+		"""
+		if container_names is None:
+			if not 1 <= count <= max_containers:
+				raise ValueError("count must be between 1 and {}".format(max_containers))
+			container_names = [None] * count
+		elif not isinstance(container_names, list) or not all(isinstance(n, basestring) for n in container_names):
+			raise ValueError("container_names must be a list of strings")
+		elif not 1 <= len(container_names) <= max_containers:
+			raise ValueError("container_names must have between 1 and {} names".format(max_containers))
+		template = self.get(name)
+		if template is None:
+			raise KeyError(name)
+		payload = apply_overrides(template['payload'], overrides or {})
+		results = []
+		for index, result, error in iter_parallel(
+				lambda i: self.docker.create_container_from_payload(payload, name=container_names[i]),
+				range(len(container_names)), concurrency, timeout=timeout):
+			if error is None:
+				results.append({'name': container_names[index], 'status': 'succeed', 'result': result})
+			elif isinstance(error, ParallelTimeout):
+				results.append({'name': container_names[index], 'status': 'timeout'})
+			else:
+				results.append({'name': container_names[index], 'status': 'failed', 'message': str(error)})
+		return results
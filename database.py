@@ -1,9 +1,50 @@
-from pymongo import MongoClient, errors
-from api_env import db_structure
+import logging
+import threading
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import MongoClient, errors, ASCENDING, DeleteMany, IndexModel, InsertOne, ReplaceOne, UpdateOne
+from api_env import db_structure, db_indexes, db_batch_size, db_flush_interval, db_page_size, db_page_size_max
+
+# suffix of a search key -> comparison operator, {'size__gte': 10} is {'size': {'$gte': 10}}
+COMPARISON_OPERATORS = {'eq': '$eq', 'gt': '$gt', 'gte': '$gte', 'in': '$in', 'lt': '$lt', 'lte': '$lte',
+                        'ne': '$ne', 'nin': '$nin'}
+
+
+def build_query(search_dict):
+	"""
+	Build a mongo filter from a search dict. A key "field__op" compares the field with one of the operators in
+	COMPARISON_OPERATORS, other keys (and "$" operators) are passed as they are.
+	:param search_dict: DICT of search keys
+	:return: DICT of mongo filter
+	"""
+	query = {}
+	# the exact values first, an operator on the same field is merged with them
+	for key, value in sorted((search_dict or {}).items(), key=lambda item: '__' in item[0]):
+		field, _, op = key.rpartition('__')
+		if not field or key.startswith('$'):
+			query[key] = value
+			continue
+		if op not in COMPARISON_OPERATORS:
+			raise ValueError("Unsupported operator: {}".format(op))
+		if op in ('in', 'nin') and not isinstance(value, (list, tuple)):
+			raise ValueError("Operator {} needs a list".format(op))
+		condition = query.setdefault(field, {})
+		if not isinstance(condition, dict):
+			# an exact value and an operator on the same field
+			condition = query[field] = {'$eq': condition}
+		condition[COMPARISON_OPERATORS[op]] = list(value) if op in ('in', 'nin') else value
+	return query
 
 
 class Database:
-	def __init__(self):
+	def __init__(self, batch_size=db_batch_size, flush_interval=db_flush_interval):
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		# collection name -> LIST of buffered write operations
+		self.pending = {}
+		self.lock = threading.Lock()
+		self._stop = threading.Event()
+		self._flusher = None
 		try:
 			self.conn = MongoClient()
 			self.db = self.conn[db_structure.keys()[0]]
@@ -13,19 +54,124 @@ class Database:
 					self.db.create_collection(coll_name)
 			except Exception as e1:
 				print "Create collection failed! " + e1.message
+			self.ensure_indexes()
 		except Exception as e2:
 			print "Connect to Database Failed! " + e2.message
 
+	def ensure_indexes(self):
+		# creating an index which already exists is a no-op on the server
+		for coll_name, indexes in db_indexes.items():
+			try:
+				self.db[coll_name].create_indexes([IndexModel(keys, **options) for keys, options in indexes])
+			except errors.PyMongoError as e:
+				print "Create indexes of {} failed! ".format(coll_name) + str(e)
 
-	def document_add(self, collection_name, records_list):
-		return self.db[collection_name].insert_many(records_list)
+	def document_add(self, collection_name, records_list, buffered=False):
+		"""
+		:param buffered: True to queue the inserts and write them in the next batch
+		"""
+		if buffered:
+			return self._buffer(collection_name, [InsertOne(record) for record in records_list])
+		return self.db[collection_name].insert_many(records_list, ordered=False)
 
-	def document_remove(self, collection_name, filter_list):
-		for filter_key in filter_list:
-			self.db[collection_name].delete_many(filter_key)
+	def document_replace(self, collection_name, filter_dict, record, buffered=False):
+		if buffered:
+			return self._buffer(collection_name, [ReplaceOne(filter_dict, record, upsert=True)])
+		return self.db[collection_name].replace_one(filter_dict, record, upsert=True)
 
-	def document_search(self, collection_name, search_dict):
-		# TODO: implement the operator($gt, $eq, $gte, $in, $lt, $lte, $ne, $nin)
+	def document_update(self, collection_name, filter_dict, fields, buffered=False):
+		# only the given fields are written, the document is created if it doesn't exist
+		if buffered:
+			return self._buffer(collection_name, [UpdateOne(filter_dict, {'$set': fields}, upsert=True)])
+		return self.db[collection_name].update_one(filter_dict, {'$set': fields}, upsert=True)
+
+	def document_remove(self, collection_name, filter_list, buffered=False):
+		# all of the filters are sent in one unordered bulk write
+		operations = [DeleteMany(filter_key) for filter_key in filter_list]
+		if buffered:
+			return self._buffer(collection_name, operations)
+		self.flush(collection_name)
+		if operations:
+			return self.db[collection_name].bulk_write(operations, ordered=False)
+
+	def document_search(self, collection_name, search_dict, projection=None):
+		"""
+		:param search_dict: DICT of search keys, "field__op" keys use the comparison operators, see build_query()
+		:param projection: LIST of fields or DICT of field -> 0/1, None for the whole documents
+		:return: cursor of documents
+		"""
 		# https://docs.mongodb.com/manual/reference/operator/query-comparison/
 		# https://docs.mongodb.com/manual/reference/method/db.collection.find/
-		return self.db[collection_name].find(search_dict)
\ No newline at end of file
+		self.flush(collection_name)
+		return self.db[collection_name].find(build_query(search_dict), projection)
+
+	def document_page(self, collection_name, search_dict, projection=None, limit=db_page_size, cursor=None):
+		"""
+		One page of a search in '_id' order. The next page starts after the cursor of the previous one, so the
+		pages stay on the '_id' index instead of skipping documents.
+		:param limit: INT of documents per page
+		:param cursor: string of 'cursor' of the previous page, None for the first page
+		:return: DICT of documents (with string '_id'), cursor of the next page and has_more
+		"""
+		query = build_query(search_dict)
+		if cursor is not None:
+			try:
+				after = {'_id': {'$gt': ObjectId(cursor)}}
+			except (InvalidId, TypeError):
+				raise ValueError("Invalidate cursor: {}".format(cursor))
+			query = {'$and': [query, after]} if query else after
+		limit = min(limit, db_page_size_max)
+		self.flush(collection_name)
+		documents = list(self.db[collection_name].find(query, projection).sort('_id', ASCENDING).limit(limit + 1))
+		has_more = len(documents) > limit
+		documents = documents[:limit]
+		for document in documents:
+			document['_id'] = str(document['_id'])
+		return {'documents': documents, 'cursor': documents[-1]['_id'] if documents else cursor,
+		        'has_more': has_more}
+
+	def flush(self, collection_name=None):
+		"""
+		Write the buffered operations as unordered bulk writes. The operations of one batch may be applied in any
+		order, the writes depending on each other should not be buffered.
+		:param collection_name: string of collection name, None for all of them
+		"""
+		with self.lock:
+			if collection_name is None:
+				batches, self.pending = self.pending, {}
+			else:
+				batches = {collection_name: self.pending.pop(collection_name, [])}
+		for coll_name, operations in batches.items():
+			if not operations:
+				continue
+			try:
+				self.db[coll_name].bulk_write(operations, ordered=False)
+			except errors.BulkWriteError as e:
+				# unordered, the other operations of the batch are still written
+				logging.warning("{} of {} writes to {} failed: {}".format(
+					len(e.details.get('writeErrors', [])), len(operations), coll_name,
+					(e.details.get('writeErrors') or [{}])[0].get('errmsg')))
+			except errors.PyMongoError as e:
+				logging.error("Writing {} operations to {} failed: {}".format(len(operations), coll_name, str(e)))
+
+	def close(self):
+		self._stop.set()
+		self.flush()
+		self.conn.close()
+
+	def _buffer(self, collection_name, operations):
+		with self.lock:
+			pending = self.pending.setdefault(collection_name, [])
+			pending.extend(operations)
+			full = len(pending) >= self.batch_size
+			if self._flusher is None:
+				self._flusher = threading.Thread(target=self._flush_periodically, name='db-flush')
+				self._flusher.daemon = True
+				self._flusher.start()
+		if full:
+			self.flush(collection_name)
+		return len(operations)
+
+	def _flush_periodically(self):
+		while not self._stop.wait(self.flush_interval):
+			self.flush()
@@ -2,16 +2,61 @@
 
 import docker
 from docker import APIClient, errors
+from docker.utils.socket import frames_iter, socket_raw_iter
 import logging
 from api_env import *
+from event_warp import InventoryCache
+from helper import ImageSearchIndex, TransferRegistry, split_lines, parse_log_cursor, skip_log_lines, \
+	iter_parallel, ParallelTimeout, project
+from stats_sampler import StatsSampler
+from snapshot import Snapshot
+from build_cache import BlobStore
+from archive_store import ArchiveStore, archive_name
+from compression import compress, decompress, check_compression
+from metrics import instrument_methods, stream_bytes
+from scheduler import HostScheduler, schedule_methods
 import time
 
 
+# lifecycle actions supported by batch_containers()
+BATCH_ACTIONS = ('start', 'stop', 'restart', 'remove')
+# create_container() arguments allowed in a compiled container config, besides host_config and networking_config
+CONTAINER_CONFIG_ARGS = ('image', 'command', 'hostname', 'user', 'detach', 'stdin_open', 'tty', 'ports', 'environment',
+                         'volumes', 'network_disabled', 'entrypoint', 'working_dir', 'domainname', 'mac_address',
+                         'labels', 'stop_signal', 'healthcheck', 'stop_timeout', 'runtime')
+# keys of `docker info` changing on every call, they don't change the ETag of the snapshot
+SNAPSHOT_INFO_VOLATILE = ('SystemTime', 'NGoroutines', 'NFd', 'NEventsListener')
+# sort name -> sort value of a listed container/image, the listings are sorted by it then by id
+CONTAINER_SORTS = {'created': lambda c: c.get('Created'), 'name': lambda c: (c.get('Names') or [''])[0],
+                   'image': lambda c: c.get('Image'), 'state': lambda c: c.get('State')}
+IMAGE_SORTS = {'created': lambda i: i.get('Created'), 'size': lambda i: i.get('Size'),
+               'tag': lambda i: (i.get('RepoTags') or [''])[0]}
+# container states accepted by the 'status' filter of the daemon
+CONTAINER_STATUSES = ('created', 'restarting', 'running', 'removing', 'paused', 'exited', 'dead')
 
 
 class Docker:
 	def __init__(self, base_url=None):
 		self.handle = None
+		# in-memory image/container listings, see start_inventory_cache()
+		self.inventory = None
+		# image search index, maintained by the inventory cache
+		self.image_index = ImageSearchIndex()
+		# stats of the streamed save/load transfers
+		self.transfers = TransferRegistry(transfer_history_size, counter=stream_bytes)
+		# background container resource sampler, see start_stats_sampler()
+		self.stats_sampler = None
+		# (image id, saved reference) -> byte size of its tarball, recorded after a complete streamed save to serve
+		# ranged requests. The tags written in the tarball depend on the reference, so each one has its own size.
+		self.image_tar_sizes = {}
+		# 'info'/'df' -> Snapshot, see start_snapshots()
+		self.snapshots = {}
+		# cached build context files, see build_image()
+		self.build_cache = BlobStore()
+		# deduplicated saved images, see save_image_archive()
+		self.archives = ArchiveStore()
+		# admission control of the heavy daemon operations, see SCHEDULED_METHODS
+		self.scheduler = HostScheduler(base_url or docker_base_url)
 		self.connect_docker_daemon(base_url)
 
 
@@ -21,7 +66,7 @@ class Docker:
 		:return: Return the docker operation handle for local host
 		"""
 		if base_url is None:
-			base_url = 'unix:///var/run/docker.sock'
+			base_url = docker_base_url
 		try:
 			self.handle = APIClient(base_url=base_url)
 		except errors.APIError as e:
@@ -29,6 +74,41 @@ class Docker:
 			global logging
 			logging.error(str(e.message))
 
+	def start_inventory_cache(self):
+		"""
+		Seed the in-memory image/container inventory and keep it current from the docker event stream.
+		Listing methods are answered from the inventory while it is fresh, otherwise from the daemon.
+		:return: InventoryCache instance
+		"""
+		if self.inventory is None:
+			self.inventory = InventoryCache(self.handle)
+			self.inventory.add_image_listener(self.image_index)
+			self.inventory.start()
+		return self.inventory
+
+
+	def start_stats_sampler(self):
+		"""
+		Keep a streaming stats subscription per running container and record the computed usage history.
+		:return: StatsSampler instance
+		"""
+		if self.stats_sampler is None:
+			self.stats_sampler = StatsSampler(self.handle, self.get_containers)
+			self.stats_sampler.start()
+		return self.stats_sampler
+
+	def start_snapshots(self):
+		"""
+		Refresh the `docker info` and `docker system df` results in background, they are served from the snapshots
+		:return: DICT of name -> Snapshot instance
+		"""
+		if not self.snapshots:
+			self.snapshots = {'info': Snapshot('info', self.handle.info, snapshot_info_interval,
+			                                   volatile=SNAPSHOT_INFO_VOLATILE),
+			                  'df': Snapshot('df', self.handle.df, snapshot_df_interval)}
+			for snapshot in self.snapshots.values():
+				snapshot.start()
+		return self.snapshots
 
 	def login_registry(self, login_user, login_pass, registry_srv=None):
 		"""
@@ -46,15 +126,36 @@ class Docker:
 		Get docker information
 		:return: DICT string
 		"""
+		if 'info' in self.snapshots:
+			return self.snapshots['info'].latest()['data']
 		return self.handle.info()
 
-	def get_image_list(self):
+	def get_image_list(self, filters=None):
 		"""
 		Get all of the existing images list
+		:param filters: DICT of daemon filters, eg. {'label': ['a=b'], 'dangling': True}. None for all of the images
 		:return: DICT string for all of the images
 		"""
+		if filters:
+			# filtered by the daemon, the inventory cache only has the whole listing
+			return self.handle.images(filters=filters)
+		if self.inventory is not None and self.inventory.is_fresh():
+			return self.inventory.list_images()
 		return self.handle.images()
 
+	def search_images(self, keyword, mode='prefix'):
+		"""
+		search the local images by ID, digest or repo/tag name
+		:param keyword: string to search
+		:param mode: 'prefix'(default), 'exact' or 'glob'
+		:return: LIST of de-duplicated images, best match first
+		"""
+		if self.inventory is not None and self.inventory.is_fresh():
+			return self.image_index.search(keyword, mode=mode)
+		index = ImageSearchIndex()
+		index.rebuild(self.handle.images())
+		return index.search(keyword, mode=mode)
+
 	def public_image_search(self, keyword):
 		"""
 		get a result for searching the image from public/logged in registry
@@ -63,36 +164,43 @@ class Docker:
 		return self.handle.search(keyword)
 
 
-	# TODO: get docker events implementation
-	# def get_docker_events(self, since, until, filters, decode):
-	# 	"""
-	# 	get running docker service events
-	# 	:return: DICT for service envents
-	# 	"""
-	# 	return self.handle.event()
+	def get_docker_events(self, since=None, until=None, filters=None, decode=True):
+		"""
+		get running docker service events
+		:param since: datetime or int of epoch seconds, get events from this time
+		:param until: datetime or int of epoch seconds, get events until this time. If None, the stream won't end
+		:param filters: DICT of filters, eg. {'type': 'container', 'event': 'start'}
+		:param decode: True to decode the events to DICT
+		:return: Generator of service events, it could be cancelled by calling close()
+		"""
+		return self.handle.events(since=since, until=until, filters=filters, decode=decode)
 
 	def get_disk_utils(self):
 		"""
 		get disk utilization for docker images
 		:return: DICT of disk utilization
 		"""
+		if 'df' in self.snapshots:
+			return self.snapshots['df'].latest()['data']
 		return self.handle.df()
 
-	def pull_image(self, name, tag=None, repo=None ):
+	def pull_image(self, name, tag=None, repo=None, stream=False):
 		"""
 		pull image from repository by repo/name:tag
 		:param repo: String of repository(registry) name
 		:param name: String of image name
 		:param tag: String of tag name
-		:return: DICT response
+		:param stream: by default is false. True returns a blocking generator of decoded per-layer progress DICT
+		:return: DICT response or Generator(when use stream=True)
 		"""
 		if tag is None:
 			tag = "latest"
+		if repo is not None:
+			name = repo + "/" + name
 		try:
-			if repo is None:
-				return self.handle.pull(name, tag=tag)
-			else:
-				return self.handle.pull(repo + "/" + name, tag)
+			if stream:
+				return self.handle.pull(name, tag=tag, stream=True, decode=True)
+			return self.handle.pull(name, tag=tag)
 		except errors.NotFound as e:
 			return {'message': 'Image Not Found', 'status': 'failed'}
 
@@ -105,6 +213,48 @@ class Docker:
 		# TODO: will support image_id and "repo/name:tag" later
 		return self.handle.inspect_image(image_id)
 
+	def select_images(self, labels):
+		"""
+		Select images by labels, intermediate ones excluded
+		:param labels: LIST of label selectors "key" or "key=value", all of them must match
+		:return: LIST of image ids
+		"""
+		return self.handle.images(quiet=True, filters={'label': labels})
+
+	def bulk_inspect(self, kind, object_ids, fields=None, concurrency=bulk_inspect_concurrency,
+	                 timeout=bulk_inspect_timeout):
+		"""
+		Inspect many containers or images concurrently, keeping only the requested fields of each document
+		:param kind: string of 'container' or 'image'
+		:param object_ids: LIST of container/image ids or names
+		:param fields: projection tree of helper.parse_field_paths(), None for the whole documents
+		:param concurrency: INT of max number of concurrent daemon calls
+		:param timeout: seconds for all of the objects, unfinished ones are reported as timed out
+		:return: LIST of DICT result per object in the order of object_ids
+		"""
+		inspect = {'container': self.handle.inspect_container, 'image': self.handle.inspect_image}[kind]
+		# every inspect call takes a bulk slot of the scheduler, the fan-out is at most the class limit so a bulk
+		# request leaves the other host slots to the single reads and the heavy operations
+		if scheduler_enabled:
+			concurrency = min(concurrency, self.scheduler.classes['bulk'].max_running)
+			inspect_one = lambda object_id: self.scheduler.run('bulk', inspect, object_id)
+		else:
+			inspect_one = inspect
+		results = {}
+		# the whole document is dropped in the worker thread, only the projection is kept
+		inspected = iter_parallel(lambda object_id: project(inspect_one(object_id), fields), object_ids, concurrency,
+		                          timeout=timeout)
+		for object_id, result, error in inspected:
+			if error is None:
+				results[object_id] = {'id': object_id, 'status': 'succeed', 'result': result}
+			elif isinstance(error, ParallelTimeout):
+				results[object_id] = {'id': object_id, 'status': 'timeout'}
+			elif isinstance(error, errors.NotFound):
+				results[object_id] = {'id': object_id, 'status': 'not_found'}
+			else:
+				results[object_id] = {'id': object_id, 'status': 'failed', 'message': str(error)}
+		return [results[object_id] for object_id in object_ids]
+
 	def remove_image(self, image_id, force_remove=False):
 		"""
 		remove the specified image by image id
@@ -112,7 +262,10 @@ class Docker:
 		:param force_remove: True or False
 		:return: DICT of result
 		"""
-		return self.handle.remove_image(image_id, force=force_remove)
+		image_ids = self._image_ids([image_id])
+		result = self.handle.remove_image(image_id, force=force_remove)
+		self._forget_image_tar_sizes(image_ids, [image_id])
+		return result
 
 	def tag_image(self, image, repository, force=False, tag=None):
 		"""
@@ -123,37 +276,59 @@ class Docker:
 		:param force: True or false
 		:return: Boolean result of tag
 		"""
-		return self.handle.tag(image, repository, tag, force=force)
+		references = [image, '{}:{}'.format(repository, tag) if tag else repository]
+		# the image losing the tag to this one is saved with other tags too
+		image_ids = self._image_ids(references)
+		result = self.handle.tag(image, repository, tag, force=force)
+		self._forget_image_tar_sizes(image_ids, references)
+		return result
+
+	def _image_ids(self, references):
+		image_ids = set()
+		for reference in references:
+			try:
+				image_ids.add(self.handle.inspect_image(reference)['Id'])
+			except errors.APIError:
+				pass
+		return image_ids
+
+	def _forget_image_tar_sizes(self, image_ids, references):
+		for key in list(self.image_tar_sizes):
+			if key[0] in image_ids or key[1] in references:
+				self.image_tar_sizes.pop(key, None)
 
 	def push_image(self, repository, tag=None, stream=False, auth_config=None):
 		"""
 		push image to new repository
 		:param repository:  String for image to be push. Image ID or Repo/Name:tag
 		:param tag: Tag for pushed image, if you don't need to change the tag, keep None.
-		:param stream: by default is false stream the outpu as blocking generator
+		:param stream: by default is false stream the outpu as blocking generator of decoded progress DICT
 		:param auth_config: overrride the credential for login()
 		:return: Result String or Generator(when use stream=True)
 		"""
-		if auth_config is None:
-			return self.handle.push(repository, tag, stream=stream)
-		else:
-			return self.handle.pull(repository, tag, stream=stream, auth_config=auth_config)
+		return self.handle.push(repository, tag, stream=stream, auth_config=auth_config, decode=stream)
 
-	def save_image(self, image_name, save_path, tarball_name=None):
+	def save_image(self, image_name, save_path, tarball_name=None, progress=None):
 		"""
 		save specified image to a tarball
 		:param image_name: string of Image ID or "repository/image:tag"
 		:param save_path:  string of path
 		:param tarball_name: string of tarball name. If not specified it will use the image_name_datetime.tar
+		:param progress: callable(bytes_written) called after each chunk is written
 		:return: return status
 		"""
 		if tarball_name is None:
 			tarball_name = image_name + "_" + str(time.time()).split('.')[0] + ".tar"
 		try:
 			img = self.handle.get_image(image_name)
-			with open(save_path + '/' + tarball_name, 'w') as f:
+			written = 0
+			with open(save_path + '/' + tarball_name, 'wb') as f:
 				for chunk in img:
 					f.write(chunk)
+					written += len(chunk)
+					stream_bytes.inc(('save',), len(chunk))
+					if progress is not None:
+						progress(written)
 			return {"message": "Image {} saved at {}".format(image_name, save_path + "/" + tarball_name), "status": "succeed"}
 		except Exception as e:
 			return {"message": e.message, "status": "failed"}
@@ -174,13 +349,237 @@ class Docker:
 			changes = None
 		return self.handle.import_image(tarball_name, repository=repository, tag=tag, changes=changes)
 
-	def get_containers(self, all=False):
+	def save_image_archive(self, image_name, name=None, progress=None):
+		"""
+		save specified image into the archive store, the layers already stored by another image are not written again
+		:param image_name: string of Image ID or "repository/image:tag"
+		:param name: string of archive name. If not specified it is derived from the image_name
+		:param progress: callable(bytes_read) called after each tarball entry
+		:return: return status, with the bytes written and deduplicated
+		"""
+		if name is None:
+			name = archive_name(image_name)
+		try:
+			result = self.archives.add(name, image_name, self.handle.get_image(image_name), progress=progress)
+			stream_bytes.inc(('save',), result['size'])
+			result.update({"message": "Image {} saved in archive {}".format(image_name, name), "status": "succeed"})
+			return result
+		except Exception as e:
+			return {"message": str(e), "status": "failed"}
+
+	def load_image_archive(self, name):
+		"""
+		load an image saved in the archive store, its tarball is rebuilt while it is sent to the daemon
+		:param name: string of archive name
+		:return: return status
+		"""
+		try:
+			result = list(self.handle.load_image(self.archives.open(name)) or [])
+			return {"message": "Image archive {} loaded".format(name), "result": result, "status": "succeed"}
+		except Exception as e:
+			return {"message": str(e), "status": "failed"}
+
+	def build_image(self, context, tag=None, dockerfile=None, buildargs=None, nocache=False, pull=False):
+		"""
+		Build an image from a context whose files are all in the build cache. The context tar is assembled from
+		the cached blobs while it is streamed to the daemon.
+		:param context: LIST of (path, hex digest, mode) of build_cache.parse_context()
+		:param tag: string of 'repo/name:tag' of the built image
+		:param dockerfile: string of Dockerfile path in the context, 'Dockerfile' by default
+		:param buildargs: DICT of build arguments
+		:param nocache: True to not use the daemon layer cache
+		:param pull: True to pull a newer version of the base image
+		:return: tuple of (TransferStats of the context, generator of decoded progress messages)
+		"""
+		digests = [digest for _, digest, _ in context]
+		# the blobs can't be evicted by the concurrent uploads while the context is streamed
+		missing = self.build_cache.pin(digests)
+		if missing:
+			raise ValueError("Missing context blobs: {}".format(', '.join(missing)))
+		pinned = [True]
+		stats = self.transfers.new('build', tag or '')
+
+		def unpin():
+			if pinned[0]:
+				pinned[0] = False
+				self.build_cache.unpin(digests)
+
+		def context_tar():
+			try:
+				for chunk in self.build_cache.context_tar(context):
+					stats.add(len(chunk))
+					yield chunk
+				stats.finish()
+			finally:
+				unpin()
+
+		try:
+			return stats, self.handle.build(fileobj=context_tar(), custom_context=True, tag=tag, dockerfile=dockerfile,
+			                                buildargs=buildargs, nocache=nocache, pull=pull, rm=True, decode=True)
+		except Exception:
+			unpin()
+			raise
+
+	def stream_image_save(self, image_name, start=0, end=None, chunk_size=stream_chunk_size):
+		"""
+		stream the tarball of an image straight from the docker daemon, nothing is buffered on the API host
+		:param image_name: string of Image ID or "repository/image:tag"
+		:param start: INT of first byte to send, the bytes before are read from the daemon and dropped
+		:param end: INT of last byte to send (inclusive), None to send until the end of tarball
+		:param chunk_size: INT of max bytes read from the daemon at once
+		:return: tuple of (image id, tarball size or None if not known yet, TransferStats, generator of chunks)
+		"""
+		image_id = self.handle.inspect_image(image_name)['Id']
+		stats = self.transfers.new('save', image_name, offset=start)
+
+		def generate():
+			img = self.handle.get_image(image_name, chunk_size=chunk_size)
+			position = 0
+			try:
+				for chunk in img:
+					chunk_start = position
+					position += len(chunk)
+					if position <= start:
+						continue
+					if chunk_start < start:
+						chunk = chunk[start - chunk_start:]
+					if end is not None and position > end + 1:
+						chunk = chunk[:len(chunk) - (position - end - 1)]
+					stats.add(len(chunk))
+					yield chunk
+					if end is not None and position > end:
+						break
+				else:
+					self.image_tar_sizes[(image_id, image_name)] = position
+				stats.finish()
+			except GeneratorExit:
+				stats.finish('aborted')
+				raise
+			except Exception as e:
+				logging.error("Streaming image {} failed: {}".format(image_name, str(e)))
+				stats.finish('failed')
+				raise
+			finally:
+				img.close()
+
+		return image_id, self.image_tar_sizes.get((image_id, image_name)), stats, generate()
+
+	def stream_image_load(self, stream, repository=None, tag=None, changes=None, chunk_size=stream_chunk_size):
+		"""
+		pipe an uploaded tarball straight into the docker daemon. Without repository it is loaded as a saved image
+		tarball (docker load), otherwise it is imported as a filesystem tarball (docker import).
+		The upload is only read as fast as the daemon accepts it, at most chunk_size bytes are held at once.
+		:param stream: file-like object of uploaded tarball
+		:param repository: string of full name of image name to be assign 'repo/name'
+		:param tag: string of imported image tag
+		:param changes: string of Dockerfile instructions applied on import
+		:param chunk_size: INT of max bytes read from the upload at once
+		:return: DICT of result with the transfer stats
+		"""
+		stats = self.transfers.new('import' if repository else 'load', repository or '')
+
+		def read_chunks():
+			while True:
+				chunk = stream.read(chunk_size)
+				if not chunk:
+					break
+				stats.add(len(chunk))
+				yield chunk
+
+		try:
+			if repository is None:
+				result = list(self.handle.load_image(read_chunks()) or [])
+			else:
+				result = self.handle.import_image_from_data(read_chunks(), repository=repository, tag=tag,
+				                                            changes=changes)
+			stats.finish()
+			return {"message": result, "status": "succeed", "transfer": stats.to_dict()}
+		except Exception as e:
+			stats.finish('failed')
+			return {"message": str(e), "status": "failed", "transfer": stats.to_dict()}
+
+	def export_container(self, container_id, compression='none', level=None, threads=compress_threads,
+	                     chunk_size=stream_chunk_size):
+		"""
+		Stream the root filesystem tarball of a container, compressed while it is read from the daemon
+		:param container_id: string of container id or name
+		:param compression: 'none', 'gzip' or 'zstd'
+		:param level: INT of compression level, None for the default one
+		:param threads: INT of number of compression threads
+		:return: tuple of (TransferStats, generator of chunks). The daemon errors are raised before the generator.
+		"""
+		check_compression(compression)
+		raw = self.handle.export(container_id, chunk_size=chunk_size)
+		# the first chunk is read at once, so a missing container is raised here instead of in the response
+		first = next(raw, '')
+		stats = self.transfers.new('export', container_id)
+
+		def read_chunks():
+			for chunk in [first] if first else []:
+				stats.add(len(chunk))
+				yield chunk
+			for chunk in raw:
+				stats.add(len(chunk))
+				yield chunk
+
+		def generate():
+			try:
+				for chunk in compress(read_chunks(), compression, level=level, threads=threads):
+					if compression != 'none':
+						stats.add_compressed(len(chunk))
+					yield chunk
+				stats.finish()
+			except Exception:
+				stats.finish('failed')
+				raise
+		return stats, generate()
+
+	def import_container(self, stream, repository, tag=None, changes=None, compression='auto',
+	                     chunk_size=stream_chunk_size):
+		"""
+		Import an uploaded root filesystem tarball as an image, it is decompressed while it is piped to the daemon
+		:param stream: file-like object of uploaded tarball
+		:param repository: string of full name of image 'repo/name'
+		:param tag: string of image tag
+		:param changes: string of Dockerfile instructions applied on import
+		:param compression: 'none', 'gzip', 'zstd', or 'auto' to detect it
+		:return: DICT of result with the transfer stats
+		"""
+		stats = self.transfers.new('import', repository)
+
+		def read_chunks():
+			while True:
+				chunk = stream.read(chunk_size)
+				if not chunk:
+					break
+				stats.add_compressed(len(chunk))
+				yield chunk
+
+		def decompressed():
+			for chunk in decompress(read_chunks(), compression):
+				stats.add(len(chunk))
+				yield chunk
+
+		try:
+			result = self.handle.import_image_from_data(decompressed(), repository=repository, tag=tag,
+			                                            changes=changes)
+			stats.finish()
+			return {"message": result, "status": "succeed", "transfer": stats.to_dict()}
+		except Exception as e:
+			stats.finish('failed')
+			return {"message": str(e), "status": "failed", "transfer": stats.to_dict()}
+
+	def get_containers(self, all=False, filters=None):
 		"""
 		get list of containers.
 		:param all: by default is 'False'. It only shows the running containers. otherwise it shows all containers include the stop/exit ones.
+		:param filters: DICT of daemon filters, eg. {'label': ['a=b'], 'status': ['exited'], 'ancestor': ['nginx']}
 		:return: return the dict of containers.
 		"""
-		# TODO: 'filter' function will be added later.
+		if filters:
+			return self.handle.containers(all=all, filters=filters)
+		if self.inventory is not None and self.inventory.is_fresh():
+			return self.inventory.list_containers(all=all)
 		return self.handle.containers(all=all)
 
 	def new_container(self, args):
@@ -363,6 +762,42 @@ class Docker:
 		                                                   link_local_ips=args['link_local_ips'])
 		return endpoint_dict
 
+	def compile_container_config(self, spec):
+		"""
+		Validate a container spec and build the ready-to-send /containers/create payload from it
+		:param spec: DICT of create_container() arguments, with optional 'host_config' DICT of create_host_config()
+		             arguments and 'networking_config' DICT of network name -> create_endpoint_config() arguments
+		:return: DICT of create payload, it could be sent many times with create_container_from_payload()
+		"""
+		spec = dict(spec)
+		host_config = spec.pop('host_config', None)
+		networks = spec.pop('networking_config', None)
+		unknown = set(spec) - set(CONTAINER_CONFIG_ARGS)
+		if unknown:
+			raise ValueError("Unknown container arguments: {}".format(', '.join(sorted(unknown))))
+		if not spec.get('image'):
+			raise ValueError("Container image is required")
+		try:
+			if host_config is not None:
+				spec['host_config'] = self.handle.create_host_config(**host_config)
+			if networks:
+				spec['networking_config'] = self.handle.create_networking_config(
+					dict((network, self.handle.create_endpoint_config(**(endpoint or {})))
+					     for network, endpoint in networks.items()))
+			spec['command'] = spec.get('command')
+			return dict(self.handle.create_container_config(**spec))
+		except (TypeError, errors.DockerException) as e:
+			raise ValueError(str(e))
+
+	def create_container_from_payload(self, payload, name=None):
+		"""
+		Create a container from a payload built by compile_container_config()
+		:param payload: DICT of create payload
+		:param name: string of container name, None to let docker name it
+		:return: DICT of new container id and warnings
+		"""
+		return self.handle.create_container_from_config(payload, name=name)
+
 	def start_container(self, container_id):
 		"""
 		This func is for start a created container by ID
@@ -395,6 +830,48 @@ class Docker:
 		"""
 		return self.handle.remove_container(container_id)
 
+	def select_containers(self, labels):
+		"""
+		Select containers by labels, stopped ones included
+		:param labels: LIST of label selectors "key" or "key=value", all of them must match
+		:return: LIST of container ids
+		"""
+		return [c['Id'] for c in self.handle.containers(all=True, filters={'label': labels})]
+
+	def batch_containers(self, action, container_ids, concurrency=batch_concurrency, timeout=batch_timeout,
+	                     fail_fast=False):
+		"""
+		Run a lifecycle action on many containers with bounded concurrency
+		:param action: string of 'start', 'stop', 'restart' or 'remove'
+		:param container_ids: LIST of container ids or names
+		:param concurrency: INT of max number of concurrent daemon calls
+		:param timeout: seconds for the whole batch, unfinished containers are reported as timed out
+		:param fail_fast: True to stop after the first failure, the calls not started yet are dropped and all of
+		                  the unfinished containers are reported as skipped
+		:return: generator of DICT result per container in completion order
+		"""
+		operation = {'start': self.start_container, 'stop': self.stop_container,
+		             'restart': self.restart_container, 'remove': self.remove_container}[action]
+		started = time.time()
+		finished = set()
+		results = iter_parallel(operation, container_ids, concurrency, timeout=timeout)
+		for container_id, result, error in results:
+			finished.add(container_id)
+			if error is None:
+				yield {'container_id': container_id, 'action': action, 'status': 'succeed', 'result': result}
+			elif isinstance(error, ParallelTimeout):
+				yield {'container_id': container_id, 'action': action, 'status': 'timeout'}
+			else:
+				yield {'container_id': container_id, 'action': action, 'status': 'failed', 'message': str(error)}
+				if fail_fast:
+					break
+		# closing the results drops the calls not started yet, the running ones finish in background
+		results.close()
+		for container_id in container_ids:
+			if container_id not in finished:
+				yield {'container_id': container_id, 'action': action, 'status': 'skipped'}
+		logging.debug("Batch {} of {} containers took {:.3f}s".format(action, len(container_ids), time.time() - started))
+
 	def list_mapping_ports(self, container_id):
 		"""
 		This func will show all of the mapping of host-> container ports.
@@ -417,13 +894,73 @@ class Docker:
 		                          changes=args.get('changes'),
 		                          conf=args.get('conf'))
 
-	def pull_container_log(self, args):
+	def pull_container_log(self, container_id, tail='all', since=None, until=None, timestamps=False, stdout=True,
+	                       stderr=True, limit=log_page_size, cursor=None):
 		"""
-		Pull logs of a running container
-		:param args: args[container_id]: container id or name
-		:return: return list of log lines
+		Pull one page of logs of a container. The log is streamed from the daemon and reading stops after `limit`
+		lines, so the memory used doesn't depend on the log size.
+		:param container_id: container id or name
+		:param tail: INT of lines from the end of the log to start with, or 'all'
+		:param since: INT of epoch seconds, only the lines after this time
+		:param until: INT of epoch seconds, only the lines before this time
+		:param timestamps: True to prefix the lines with their RFC3339Nano timestamp
+		:param stdout: True to include stdout
+		:param stderr: True to include stderr
+		:param limit: INT of max lines in the page
+		:param cursor: string of cursor returned by the previous page, the page starts after it and `tail` is ignored
+		:return: DICT of lines, cursor of the last line and has_more
+		"""
+		if cursor is not None:
+			since, tail = parse_log_cursor(cursor)[0][0], 'all'
+		lines = []
+		has_more = False
+		stream = self._open_log(container_id, False, tail, since, until, stdout, stderr)
+		for timestamp, line, line_cursor in skip_log_lines(self._log_lines(stream), cursor):
+			if len(lines) >= limit:
+				has_more = True
+				break
+			line = line.decode('utf-8', 'replace')
+			lines.append(timestamp + ' ' + line if timestamps else line)
+			cursor = line_cursor
+		return {'lines': lines, 'cursor': cursor, 'has_more': has_more}
+
+	def follow_container_log(self, container_id, tail='all', since=None, timestamps=False, stdout=True,
+	                         stderr=True, cursor=None):
+		"""
+		Follow logs of a container
+		:param container_id: container id or name
+		:param tail: INT of lines from the end of the log to start with, or 'all'
+		:param since: INT of epoch seconds, only the lines after this time
+		:param timestamps: True to prefix the lines with their RFC3339Nano timestamp
+		:param stdout: True to include stdout
+		:param stderr: True to include stderr
+		:param cursor: string of cursor returned by a page, following starts after it
+		:return: generator of log lines with line break, it ends when the container stops
 		"""
-		return str(self.handle.logs(args['container_id'])).split('\n')
+		if cursor is not None:
+			since, tail = parse_log_cursor(cursor)[0][0], 'all'
+		# opened here so a missing container is raised before the response starts
+		stream = self._open_log(container_id, True, tail, since, None, stdout, stderr)
+
+		def follow():
+			for timestamp, line, _ in skip_log_lines(self._log_lines(stream), cursor):
+				yield (timestamp + ' ' + line if timestamps else line) + '\n'
+		return follow()
+
+	def _open_log(self, container_id, follow, tail, since, until, stdout, stderr):
+		# the lines are always requested with timestamps, they are the pagination cursor
+		return self.handle.logs(container_id, stdout=stdout, stderr=stderr, stream=True, timestamps=True,
+		                        tail=tail, since=since if since else None, follow=follow,
+		                        until=until if until else None)
+
+	def _log_lines(self, stream):
+		try:
+			for line in split_lines(stream):
+				stream_bytes.inc(('log',), len(line))
+				timestamp, _, text = line.partition(' ')
+				yield timestamp, text
+		finally:
+			stream.close()
 
 
 	def attach_container(self, container_id):
@@ -431,21 +968,90 @@ class Docker:
 		# https://docker-py.readthedocs.io/en/stable/containers.html?highlight=exec#docker.models.containers.Container.attach
 		return self.handle.attach(container_id)
 
-	def exec_container(self, args):
-		# there will be more parameters for choose, deployment later
-		# in this version, only pass the 'cmd' parameter into method, other parameters keeps default value.
-		# https://docker-py.readthedocs.io/en/stable/containers.html?highlight=exec#docker.models.containers.Container.exec_run
+	def exec_container(self, container_id, cmd):
+		"""
+		Run a command in a running container and wait for it, the interactive one is open_terminal()
+		:param container_id: string of container id or name
+		:param cmd: string or LIST of command
+		:return: DICT of exec id, exit code and output
+		"""
+		exec_id = self.handle.exec_create(container_id, cmd)['Id']
+		output = self.handle.exec_start(exec_id)
+		return {'exec_id': exec_id, 'exit_code': self.handle.exec_inspect(exec_id).get('ExitCode'),
+		        'output': output.decode('utf-8', 'replace')}
 
-		return self.handle.exec_run(args['cmd'])
+	def open_terminal(self, container_id, cmd=None, rows=None, cols=None):
+		"""
+		Open an interactive session on the hijacked docker socket: a new exec instance of cmd with a TTY, or an
+		attach to the main process of the container when cmd is None
+		:param container_id: string of container id or name
+		:param cmd: string or LIST of command, None to attach
+		:param rows: INT of initial TTY height
+		:param cols: INT of initial TTY width
+		:return: tuple of (socket, iterator of output chunks, resize(rows, cols))
+		"""
+		if cmd is not None:
+			exec_id = self.handle.exec_create(container_id, cmd, stdin=True, tty=True)['Id']
+			sock = self.handle.exec_start(exec_id, tty=True, socket=True)
+			resize = lambda height, width: self.handle.exec_resize(exec_id, height=height, width=width)
+			tty = True
+		else:
+			tty = (self.handle.inspect_container(container_id).get('Config') or {}).get('Tty')
+			sock = self.handle.attach_socket(container_id, params={'stdin': 1, 'stdout': 1, 'stderr': 1, 'stream': 1})
+			resize = lambda height, width: self.handle.resize(container_id, height=height, width=width)
+		if rows and cols:
+			resize(rows, cols)
+		# the output of a container without TTY is multiplexed in frames
+		return sock, socket_raw_iter(sock) if tty else frames_iter(sock), resize
 
 	def container_top(self, args):
 		return self.handle.top(args['container_id'])
 
 
 	def container_res_usage(self, args):
-		# Method 'stats' returns a generator. Need to use next(gen) to get data
-		return self.handle.stats(args['container_id'])
+		"""
+		Get the resource usage of a container
+		:param args: args[container_id]: container id or name
+		:return: DICT of latest sample from the stats sampler, raw one-shot stats if the container is not sampled
+		"""
+		if self.stats_sampler is not None:
+			current = self.stats_sampler.current(args['container_id'])
+			if current is not None:
+				return current
+		# one-shot stats costs the daemon about a second
+		return self.handle.stats(args['container_id'], stream=False)
 
 	def container_info(self, args):
 		return  self.handle.inspect_container(args['container_id'])
 
+
+# method name -> operation class of the scheduler. The long lived sessions (follow log, terminal) aren't scheduled,
+# they would hold a slot until the client leaves.
+SCHEDULED_METHODS = {
+	'pull_image': 'registry',
+	'push_image': 'registry',
+	'save_image': 'transfer',
+	'load_image': 'transfer',
+	'save_image_archive': 'transfer',
+	'load_image_archive': 'transfer',
+	'stream_image_save': 'transfer',
+	'stream_image_load': 'transfer',
+	'export_container': 'transfer',
+	'import_container': 'transfer',
+	'build_image': 'build',
+	'commit_to_image': 'build',
+	'get_image_list': 'interactive',
+	'inspect_image': 'interactive',
+	'get_containers': 'interactive',
+	'container_info': 'interactive',
+	'container_res_usage': 'interactive',
+	'container_top': 'interactive',
+	'list_mapping_ports': 'interactive',
+	'pull_container_log': 'interactive',
+}
+
+if scheduler_enabled:
+	schedule_methods(Docker, SCHEDULED_METHODS)
+# after the scheduler, the call durations include the wait for a slot
+if metrics_enabled:
+	instrument_methods(Docker)
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the docker event stream watcher and the in-memory inventory cache
+#              which answers the image/container listings without a round trip to the daemon
+
+import calendar
+import logging
+import threading
+import time
+from docker import errors
+from api_env import *
+
+
+# Container event actions which don't change the container listing
+IGNORED_CONTAINER_ACTIONS = ('attach', 'detach', 'resize', 'top', 'copy', 'export', 'archive-path', 'extract-to-dir',
+                             'commit', 'exec_create', 'exec_start', 'exec_detach', 'exec_die')
+# Image event actions which don't change the image listing
+IGNORED_IMAGE_ACTIONS = ('save', 'push')
+# Container states reported by /containers/json when all=False
+RUNNING_STATES = ('running', 'paused', 'restarting')
+
+
+def rfc3339_to_epoch(date_str):
+	"""
+	Convert the RFC3339 time string from inspect results into the epoch seconds used by listings
+	:param date_str: string like "2018-05-22T21:54:52.123456789Z"
+	:return: int of epoch seconds, 0 if it cann't be parsed
+	"""
+	try:
+		return calendar.timegm(time.strptime(date_str[:19], '%Y-%m-%dT%H:%M:%S'))
+	except (TypeError, ValueError):
+		return 0
+
+
+def image_summary(inspect):
+	"""
+	Build the /images/json summary of an image from its inspect document
+	:param inspect: DICT of inspect_image() result
+	:return: DICT in the same format as one item of images()
+	"""
+	config = inspect.get('Config') or {}
+	return {
+		'Id': inspect.get('Id'),
+		'ParentId': inspect.get('Parent', ''),
+		'RepoTags': inspect.get('RepoTags') or None,
+		'RepoDigests': inspect.get('RepoDigests') or None,
+		'Created': rfc3339_to_epoch(inspect.get('Created')),
+		'Size': inspect.get('Size'),
+		'VirtualSize': inspect.get('VirtualSize'),
+		'SharedSize': -1,
+		'Labels': config.get('Labels'),
+		'Containers': -1
+	}
+
+
+def newest_first(summaries):
+	# the order of the daemon listings, the id keeps the order of the summaries created in the same second stable
+	return sorted(summaries, key=lambda s: (s.get('Created') or 0, s.get('Id')), reverse=True)
+
+
+class InventoryCache:
+	"""
+	In-memory copy of the image and container listings of one docker host.
+	It is seeded with a full listing and kept current by a watcher thread following the docker event stream.
+	A full resync is done when the stream drops and every `resync_interval` seconds.
+	"""
+	def __init__(self, handle, max_staleness=inventory_max_staleness, resync_interval=inventory_resync_interval,
+	             retry_interval=inventory_retry_interval):
+		self.handle = handle
+		self.max_staleness = max_staleness
+		self.resync_interval = resync_interval
+		self.retry_interval = retry_interval
+		self.lock = threading.Lock()
+		self.images = {}
+		self.containers = {}
+		# objects with rebuild(images)/update(image)/remove(image_id) kept in sync with the images, eg. search index
+		self.image_listeners = []
+		# listings are rebuilt lazily after a change, reads between changes return the same list
+		self._image_list = None
+		self._container_list = None
+		self.synced = False
+		self.connected = False
+		# time of the last full resync or event, used for the staleness bound while the stream is down
+		self.last_confirmed = 0
+		self.last_resync = 0
+		self._stream = None
+		self._resync_requested = False
+		self._stop = threading.Event()
+		self._watcher = None
+		self._timer = None
+
+	def start(self):
+		"""
+		Start the event watcher and the periodic resync timer
+		:return: None
+		"""
+		if self._watcher is not None:
+			return
+		self._stop.clear()
+		self._watcher = threading.Thread(target=self._watch, name='inventory-watcher')
+		self._watcher.daemon = True
+		self._watcher.start()
+		self._timer = threading.Thread(target=self._resync_timer, name='inventory-resync')
+		self._timer.daemon = True
+		self._timer.start()
+
+	def add_image_listener(self, listener):
+		"""
+		Register an object to be notified of image changes. It is rebuilt at once if the cache is already synced.
+		:param listener: object with rebuild(images), update(image) and remove(image_id) methods
+		:return: None
+		"""
+		self.image_listeners.append(listener)
+		if self.synced:
+			listener.rebuild(self.list_images())
+
+	def stop(self):
+		"""
+		Stop watching the event stream. The cache will be reported as stale afterwards.
+		:return: None
+		"""
+		self._stop.set()
+		self._close_stream()
+		self._watcher = None
+		self._timer = None
+
+	def is_fresh(self):
+		"""
+		Check whether the cache could be used to answer a listing
+		:return: True when the event stream is connected or dropped less than max_staleness seconds ago
+		"""
+		if not self.synced:
+			return False
+		if self.connected:
+			return True
+		return time.time() - self.last_confirmed <= self.max_staleness
+
+	def list_images(self):
+		"""
+		:return: LIST of image summaries, same format and order (newest first) as APIClient.images()
+		"""
+		image_list = self._image_list
+		if image_list is None:
+			with self.lock:
+				image_list = self._image_list = newest_first(self.images.values())
+		return image_list
+
+	def list_containers(self, all=False):
+		"""
+		:param all: by default only the running containers are returned, set True to include stopped/exited ones
+		:return: LIST of container summaries, same format and order (newest first) as APIClient.containers()
+		"""
+		container_list = self._container_list
+		if container_list is None:
+			with self.lock:
+				container_list = self._container_list = newest_first(self.containers.values())
+		if all:
+			return container_list
+		return [c for c in container_list if c.get('State') in RUNNING_STATES]
+
+	def resync(self):
+		"""
+		Replace the cache content with a full listing from the daemon
+		:return: None
+		"""
+		images = self.handle.images()
+		containers = self.handle.containers(all=True)
+		with self.lock:
+			self.images = dict((i['Id'], i) for i in images)
+			self.containers = dict((c['Id'], c) for c in containers)
+			self._image_list = None
+			self._container_list = None
+			self.synced = True
+			self.last_resync = self.last_confirmed = time.time()
+		for listener in self.image_listeners:
+			listener.rebuild(images)
+		logging.debug("Inventory resynced: {} images, {} containers".format(len(images), len(containers)))
+
+	def apply_event(self, event):
+		"""
+		Update the cache according to one decoded docker event
+		:param event: DICT of docker event
+		:return: None
+		"""
+		event_type = event.get('Type')
+		action = event.get('Action') or event.get('status') or ''
+		actor_id = (event.get('Actor') or {}).get('ID') or event.get('id')
+		if actor_id is None:
+			return
+		if event_type == 'container':
+			# health_status events come as "health_status: healthy"
+			if action.split(':')[0] not in IGNORED_CONTAINER_ACTIONS:
+				self._refresh_container(actor_id, removed=(action == 'destroy'))
+		elif event_type == 'image':
+			if action not in IGNORED_IMAGE_ACTIONS:
+				self._refresh_image(actor_id, removed=(action == 'delete'))
+		self.last_confirmed = time.time()
+
+	def _refresh_container(self, container_id, removed=False):
+		summary = None
+		if not removed:
+			found = self.handle.containers(all=True, filters={'id': container_id})
+			summary = found[0] if found else None
+		with self.lock:
+			if summary is None:
+				self.containers.pop(container_id, None)
+			else:
+				self.containers[summary['Id']] = summary
+			self._container_list = None
+
+	def _refresh_image(self, image_id, removed=False):
+		summary = None
+		if not removed:
+			try:
+				summary = image_summary(self.handle.inspect_image(image_id))
+			except errors.NotFound:
+				pass
+		with self.lock:
+			if summary is not None:
+				self.images[summary['Id']] = summary
+			elif image_id in self.images:
+				del self.images[image_id]
+			else:
+				return
+			self._image_list = None
+		for listener in self.image_listeners:
+			if summary is not None:
+				listener.update(summary)
+			else:
+				listener.remove(image_id)
+
+	def _watch(self):
+		while not self._stop.is_set():
+			failed = False
+			try:
+				# events are replayed from before the resync, so nothing happened in between is lost
+				since = int(time.time())
+				self._resync_requested = False
+				self.resync()
+				self._stream = self.handle.events(since=since, decode=True)
+				self.connected = True
+				for event in self._stream:
+					self.apply_event(event)
+			except Exception as e:
+				if not self._resync_requested:
+					failed = True
+					logging.warning("Inventory event stream dropped: {}".format(str(e)))
+			finally:
+				self.connected = False
+				self._close_stream()
+			if failed:
+				self._stop.wait(self.retry_interval)
+
+	def _resync_timer(self):
+		while not self._stop.wait(self.resync_interval):
+			# closing the stream makes the watcher do a full resync and reconnect
+			self._resync_requested = True
+			self._close_stream()
+
+	def _close_stream(self):
+		stream = self._stream
+		self._stream = None
+		if stream is not None:
+			try:
+				stream.close()
+			except Exception:
+				pass
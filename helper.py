@@ -1,13 +1,666 @@
 # -*- coding: utf-8 -*-
 
+import base64
+import calendar
+import collections
+import fnmatch
 import json
+import Queue
+import re
+import threading
+import time
+import types
+import uuid
 
-def search_result_filter(result_list, field_list, keyword):
-	# input_data = json.loads(str(json_str))
-	input_data = result_list
-	output = []
-	for field in field_list:
-		results = [e for e in input_data if keyword in e[field] or keyword in ' '.join(e[field])]
-		output += results
-	return output
+# query modes supported by ImageSearchIndex.search()
+SEARCH_MODES = ('prefix', 'exact', 'glob')
+# separators used to split "repo/name:tag" into searchable tokens
+TOKEN_SEPARATORS = re.compile(r'[/:@._-]+')
+GLOB_CHARS = re.compile(r'[*?\[]')
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+LOG_TIMESTAMP = re.compile(r'^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d{1,9}))?Z$')
+# one step of a field path: .Key or Key, [0], [*] or ['key.with.dots']
+FIELD_PATH_STEP = re.compile(r'''\.?([^.\[\]'"]+)|\[(\d+|\*)\]|\[(['"])(.+?)\3\]''')
 
+# ranking scores, higher is better
+SCORE_EXACT = 100
+SCORE_ID_PREFIX = 80
+SCORE_TAG_PREFIX = 60
+SCORE_TOKEN = 50
+SCORE_GLOB = 40
+SCORE_TOKEN_PREFIX = 30
+
+
+class _TrieNode(object):
+	__slots__ = ('children', 'ids')
+
+	def __init__(self):
+		self.children = {}
+		self.ids = None
+
+
+class PrefixTrie:
+	"""
+	Character trie mapping string keys to sets of image IDs
+	"""
+	def __init__(self):
+		self.root = _TrieNode()
+
+	def add(self, key, image_id):
+		node = self.root
+		for ch in key:
+			child = node.children.get(ch)
+			if child is None:
+				child = node.children[ch] = _TrieNode()
+			node = child
+		if node.ids is None:
+			node.ids = set()
+		node.ids.add(image_id)
+
+	def remove(self, key, image_id):
+		path = [self.root]
+		for ch in key:
+			node = path[-1].children.get(ch)
+			if node is None:
+				return
+			path.append(node)
+		node = path[-1]
+		if node.ids is not None:
+			node.ids.discard(image_id)
+			if not node.ids:
+				node.ids = None
+		# prune the branches which don't lead to any key
+		for depth in range(len(key), 0, -1):
+			node = path[depth]
+			if node.ids is not None or node.children:
+				break
+			del path[depth - 1].children[key[depth - 1]]
+
+	def exact(self, key):
+		node = self._find(key)
+		if node is None or node.ids is None:
+			return set()
+		return node.ids
+
+	def prefix(self, prefix):
+		"""
+		:param prefix: string of key prefix
+		:return: generator of (key, ids) for all of the keys starting with prefix
+		"""
+		node = self._find(prefix)
+		if node is None:
+			return
+		stack = [(prefix, node)]
+		while stack:
+			key, node = stack.pop()
+			if node.ids is not None:
+				yield key, node.ids
+			for ch, child in node.children.items():
+				stack.append((key + ch, child))
+
+	def _find(self, key):
+		node = self.root
+		for ch in key:
+			node = node.children.get(ch)
+			if node is None:
+				return None
+		return node
+
+
+def image_id_keys(image):
+	"""
+	:param image: DICT of image summary
+	:return: LIST of the ID and digest keys of an image, with and without the "sha256:" algorithm prefix
+	"""
+	keys = []
+	for key in [image['Id']] + [d.split('@', 1)[-1] for d in (image.get('RepoDigests') or [])]:
+		keys.append(key)
+		if ':' in key:
+			keys.append(key.split(':', 1)[1])
+	return keys
+
+
+def image_tags(image):
+	"""
+	:param image: DICT of image summary
+	:return: LIST of the lower case "repo/name:tag" of an image, the dangling "<none>:<none>" is skipped
+	"""
+	return [t.lower() for t in (image.get('RepoTags') or []) if t != '<none>:<none>']
+
+
+def tag_tokens(tag):
+	"""
+	Split "registry:5000/repo/name:tag" into the searchable tokens, the full tag and the name without tag included
+	:param tag: string of lower case repo tag
+	:return: SET of tokens
+	"""
+	tokens = set(t for t in TOKEN_SEPARATORS.split(tag) if t)
+	tokens.add(tag)
+	tokens.add(tag.rsplit(':', 1)[0])
+	tokens.update(tag.split('/'))
+	return tokens
+
+
+class ImageSearchIndex:
+	"""
+	Search index of images: a prefix trie on image IDs/digests and an inverted index from the tokens of
+	repo/tag names. It is maintained incrementally through rebuild()/update()/remove(), which are called by
+	the InventoryCache as the images change.
+	"""
+	def __init__(self):
+		self.lock = threading.RLock()
+		self.images = {}
+		self.id_trie = PrefixTrie()
+		self.token_trie = PrefixTrie()
+		# image id -> (id keys, tokens) indexed for that image, used to remove the stale entries on update
+		self.indexed = {}
+
+	def rebuild(self, images):
+		"""
+		Replace the index content
+		:param images: LIST of image summaries
+		:return: None
+		"""
+		with self.lock:
+			self.images = {}
+			self.id_trie = PrefixTrie()
+			self.token_trie = PrefixTrie()
+			self.indexed = {}
+			for image in images:
+				self._add(image)
+
+	def update(self, image):
+		"""
+		Add or replace one image
+		:param image: DICT of image summary
+		:return: None
+		"""
+		with self.lock:
+			self._discard(image['Id'])
+			self._add(image)
+
+	def remove(self, image_id):
+		"""
+		Remove one image
+		:param image_id: string of image ID
+		:return: None
+		"""
+		with self.lock:
+			self._discard(image_id)
+
+	def search(self, keyword, mode='prefix', limit=None):
+		"""
+		Search images by ID, digest or repo/tag name
+		:param keyword: string to search
+		:param mode: 'prefix'(default), 'exact' or 'glob'
+		:param limit: INT of maximum number of results, None for all
+		:return: LIST of de-duplicated image summaries, best match first
+		"""
+		if mode not in SEARCH_MODES:
+			raise ValueError("Unsupported search mode: {}".format(mode))
+		keyword = str(keyword).strip().lower()
+		if keyword == "":
+			return []
+		with self.lock:
+			scores = {}
+			if mode == 'exact':
+				self._search_exact(keyword, scores)
+			elif mode == 'glob':
+				self._search_glob(keyword, scores)
+			else:
+				self._search_exact(keyword, scores)
+				self._search_prefix(keyword, scores)
+			ranked = sorted(scores.items(), key=lambda s: (-s[1], image_tags(self.images[s[0]]), s[0]))
+			if limit is not None:
+				ranked = ranked[:limit]
+			return [self.images[image_id] for image_id, _ in ranked]
+
+	def _search_exact(self, keyword, scores):
+		self._score(scores, self.id_trie.exact(keyword), SCORE_EXACT)
+		# "name" is the same as "name:latest"
+		for tag in (keyword, keyword + ':latest'):
+			for image_id in self.token_trie.exact(tag):
+				if tag in image_tags(self.images[image_id]):
+					self._score(scores, [image_id], SCORE_EXACT)
+
+	def _search_prefix(self, keyword, scores):
+		for key, ids in self.id_trie.prefix(keyword):
+			self._score(scores, ids, SCORE_ID_PREFIX)
+		for token, ids in self.token_trie.prefix(keyword):
+			if token == keyword:
+				self._score(scores, ids, SCORE_TOKEN)
+			for image_id in ids:
+				if token in image_tags(self.images[image_id]):
+					self._score(scores, [image_id], SCORE_TAG_PREFIX)
+				else:
+					self._score(scores, [image_id], SCORE_TOKEN_PREFIX)
+
+	def _search_glob(self, keyword, scores):
+		# narrow the candidates with the literal part before the first wildcard
+		literal = GLOB_CHARS.split(keyword, 1)[0]
+		if literal:
+			candidates = set()
+			for trie in (self.id_trie, self.token_trie):
+				for key, ids in trie.prefix(literal):
+					candidates.update(ids)
+		else:
+			candidates = self.images.keys()
+		for image_id in candidates:
+			image = self.images[image_id]
+			keys = image_tags(image) + [k.lower() for k in image_id_keys(image)]
+			if any(fnmatch.fnmatchcase(k, keyword) for k in keys):
+				self._score(scores, [image_id], SCORE_GLOB)
+
+	def _score(self, scores, ids, score):
+		for image_id in ids:
+			if scores.get(image_id, 0) < score:
+				scores[image_id] = score
+
+	def _add(self, image):
+		image_id = image['Id']
+		id_keys = [k.lower() for k in image_id_keys(image)]
+		tokens = set()
+		for tag in image_tags(image):
+			tokens.update(tag_tokens(tag))
+		for key in id_keys:
+			self.id_trie.add(key, image_id)
+		for token in tokens:
+			self.token_trie.add(token, image_id)
+		self.images[image_id] = image
+		self.indexed[image_id] = (id_keys, tokens)
+
+	def _discard(self, image_id):
+		indexed = self.indexed.pop(image_id, None)
+		if indexed is None:
+			return
+		id_keys, tokens = indexed
+		for key in id_keys:
+			self.id_trie.remove(key, image_id)
+		for token in tokens:
+			self.token_trie.remove(token, image_id)
+		del self.images[image_id]
+
+
+def parse_byte_range(range_header):
+	"""
+	Parse a single HTTP "Range: bytes=start-end" header. Suffix ranges ("bytes=-500") are not supported as the
+	stream length is not known in advance.
+	:param range_header: string of Range header value or None
+	:return: tuple of (start, end), end is None for an open range. None if there is no Range header
+	"""
+	if range_header is None or range_header.strip() == "":
+		return None
+	match = BYTE_RANGE.match(range_header.strip())
+	if match is None or match.group(1) == "":
+		raise ValueError("Unsupported range: {}".format(range_header))
+	start = int(match.group(1))
+	end = int(match.group(2)) if match.group(2) != "" else None
+	if end is not None and end < start:
+		raise ValueError("Unsupported range: {}".format(range_header))
+	return start, end
+
+
+class TransferStats:
+	"""
+	Byte counter and throughput of one streamed transfer
+	"""
+	def __init__(self, kind, name, offset=0, counter=None):
+		self.id = uuid.uuid4().hex
+		self.kind = kind
+		self.name = name
+		self.offset = offset
+		self.bytes = 0
+		# bytes after compression, None for the uncompressed transfers
+		self.compressed = None
+		self.started = time.time()
+		self.finished = None
+		self.status = 'running'
+		# shared counter of the bytes of every transfer by kind, eg. metrics.stream_bytes
+		self.counter = counter
+
+	def add(self, size):
+		self.bytes += size
+		if self.counter is not None:
+			self.counter.inc((self.kind,), size)
+
+	def add_compressed(self, size):
+		self.compressed = (self.compressed or 0) + size
+
+	def finish(self, status='succeed'):
+		self.finished = time.time()
+		self.status = status
+
+	def to_dict(self):
+		seconds = (self.finished or time.time()) - self.started
+		result = {'id': self.id, 'kind': self.kind, 'name': self.name, 'offset': self.offset, 'bytes': self.bytes,
+		          'status': self.status, 'started': self.started, 'seconds': round(seconds, 3),
+		          'throughput': int(self.bytes / seconds) if seconds > 0 else 0}
+		if self.compressed is not None:
+			result['compressed_bytes'] = self.compressed
+			result['ratio'] = round(float(self.bytes) / self.compressed, 3) if self.compressed else None
+		return result
+
+
+class TransferRegistry:
+	"""
+	Keeps the stats of the latest streamed transfers
+	"""
+	def __init__(self, size=100, counter=None):
+		self.lock = threading.Lock()
+		self.transfers = collections.deque(maxlen=size)
+		self.counter = counter
+
+	def new(self, kind, name, offset=0):
+		stats = TransferStats(kind, name, offset=offset, counter=self.counter)
+		with self.lock:
+			self.transfers.append(stats)
+		return stats
+
+	def list(self):
+		with self.lock:
+			return [t.to_dict() for t in self.transfers]
+
+
+class ClosingStream:
+	"""
+	Iterator over a stream returned by a method, calls on_close once when the stream is exhausted, closed or garbage
+	collected without being read
+	"""
+	def __init__(self, generator, on_close):
+		self.generator = generator
+		self._on_close = on_close
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		try:
+			return next(self.generator)
+		except:
+			self.close()
+			raise
+
+	def close(self):
+		on_close, self._on_close = self._on_close, None
+		if on_close is not None:
+			try:
+				self.generator.close()
+			finally:
+				on_close()
+
+	__del__ = close
+
+
+def hold_streams(result, on_close):
+	"""
+	Wrap the generator returned by a method, alone or in a tuple, so on_close runs when the stream is done
+	:param result: value returned by the method
+	:param on_close: function without arguments
+	:return: tuple of the result, wrapped or not, and True when a stream was wrapped
+	"""
+	# a stream already wrapped by an inner decorator, eg. the scheduler, is wrapped again
+	streams = (types.GeneratorType, ClosingStream)
+	if isinstance(result, streams):
+		return ClosingStream(result, on_close), True
+	if isinstance(result, tuple) and any(isinstance(r, streams) for r in result):
+		index = [isinstance(r, streams) for r in result].index(True)
+		result = result[:index] + (ClosingStream(result[index], on_close),) + result[index + 1:]
+		return result, True
+	return result, False
+
+
+def str_to_bool(value, default=False):
+	"""
+	Convert a request argument to boolean
+	:param value: string like 'true', '1', 'false', '0' or None
+	:param default: value returned when the argument is not given
+	:return: Boolean
+	"""
+	if value is None or str(value).strip() == "":
+		return default
+	return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def parse_log_timestamp(timestamp):
+	"""
+	Parse the RFC3339Nano timestamp docker prefixes log lines with. Trailing zeros of the fraction are trimmed by
+	docker, so the strings couldn't be compared directly.
+	:param timestamp: string like "2018-05-22T21:54:52.12345Z"
+	:return: tuple of (epoch seconds, nanoseconds)
+	"""
+	match = LOG_TIMESTAMP.match(timestamp)
+	if match is None:
+		raise ValueError("Invalidate timestamp: {}".format(timestamp))
+	seconds = calendar.timegm(time.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S'))
+	nanos = int((match.group(2) or '0').ljust(9, '0'))
+	return seconds, nanos
+
+
+def parse_log_cursor(cursor):
+	"""
+	Parse a log page cursor "<timestamp>_<n>": the n first lines of that timestamp were returned. A cursor with only
+	the timestamp skips all of the lines of that timestamp.
+	:param cursor: string of cursor
+	:return: tuple of (timestamp tuple of parse_log_timestamp(), INT of lines seen or None)
+	"""
+	timestamp, _, seen = cursor.partition('_')
+	if seen and not seen.isdigit():
+		raise ValueError("Invalidate cursor: {}".format(cursor))
+	return parse_log_timestamp(timestamp), int(seen) if seen else None
+
+
+def skip_log_lines(lines, cursor):
+	"""
+	Drop the lines returned before a cursor, the daemon 'since' has only one second precision
+	:param lines: iterable of (timestamp, line)
+	:param cursor: string of parse_log_cursor() cursor, None to keep all of the lines
+	:return: generator of (timestamp, line, cursor of the line)
+	"""
+	after, seen = parse_log_cursor(cursor) if cursor is not None else (None, None)
+	last, count = None, 0
+	for timestamp, line in lines:
+		parsed = parse_log_timestamp(timestamp)
+		if after is not None and parsed <= after:
+			if parsed < after:
+				continue
+			# the lines of the cursor timestamp are counted from the first one, returned ones included
+			count = count + 1 if last == parsed else 1
+			last = parsed
+			if seen is None or count <= seen:
+				continue
+		else:
+			count = count + 1 if last == parsed else 1
+			last = parsed
+		yield timestamp, line, '{}_{}'.format(timestamp, count)
+
+
+def split_lines(chunks):
+	"""
+	Re-split a stream of chunks into lines, only the incomplete last line is held between chunks
+	:param chunks: iterable of strings
+	:return: generator of lines without the line break
+	"""
+	pending = ''
+	for chunk in chunks:
+		pending += chunk
+		lines = pending.split('\n')
+		pending = lines.pop()
+		for line in lines:
+			yield line
+	if pending:
+		yield pending
+
+
+class ParallelTimeout(Exception):
+	pass
+
+
+def iter_parallel(func, items, max_workers, timeout=None):
+	"""
+	Run func on every item on at most max_workers threads and yield the results as they finish.
+	The items not finished before the timeout are yielded with a ParallelTimeout error, their threads are left
+	to finish in background.
+	:param func: callable taking one item
+	:param items: LIST of items
+	:param max_workers: INT of max number of concurrent calls
+	:param timeout: seconds for all of the items, None to wait forever
+	:return: generator of (item, result, exception or None) in completion order
+	"""
+	pending = Queue.Queue()
+	for index, item in enumerate(items):
+		pending.put((index, item))
+	done = Queue.Queue()
+
+	def work():
+		while True:
+			try:
+				index, item = pending.get_nowait()
+			except Queue.Empty:
+				return
+			try:
+				done.put((index, item, func(item), None))
+			except Exception as e:
+				done.put((index, item, None, e))
+
+	for i in range(min(max_workers, len(items))):
+		worker = threading.Thread(target=work)
+		worker.daemon = True
+		worker.start()
+	deadline = time.time() + timeout if timeout is not None else None
+	unfinished = dict(enumerate(items))
+	try:
+		while unfinished:
+			try:
+				if deadline is None:
+					# a timeout keeps the wait interruptible
+					index, item, result, error = done.get(timeout=3600)
+				else:
+					index, item, result, error = done.get(timeout=max(deadline - time.time(), 0))
+			except Queue.Empty:
+				if deadline is None:
+					continue
+				break
+			del unfinished[index]
+			yield item, result, error
+	finally:
+		# drop the items not started yet, also when the caller stops early
+		while True:
+			try:
+				pending.get_nowait()
+			except Queue.Empty:
+				break
+	for index in sorted(unfinished):
+		yield unfinished[index], None, ParallelTimeout("Timed out")
+
+
+def parse_field_paths(paths):
+	"""
+	Compile JSON-path like field paths into a projection tree, eg. ['State.Status',
+	"Config.Labels['com.example.tier']", 'NetworkSettings.Networks.*.IPAddress', 'Mounts[*].Source', 'Args[0]'].
+	A leading '$.' is allowed. A name step applies to every item of a list.
+	:param paths: LIST of string of field path
+	:return: DICT of step -> sub-tree, None for the whole value
+	"""
+	tree = {}
+	for path in paths:
+		position = 2 if path.startswith('$.') else 0
+		steps = []
+		while position < len(path):
+			match = FIELD_PATH_STEP.match(path, position)
+			if match is None or (not steps and match.group(0).startswith('.')):
+				raise ValueError("Invalidate field path: {}".format(path))
+			name, index, _, quoted = match.groups()
+			if index is not None:
+				steps.append('*' if index == '*' else int(index))
+			else:
+				steps.append(quoted if quoted is not None else name)
+			position = match.end()
+		if not steps:
+			raise ValueError("Invalidate field path: {}".format(path))
+		node = tree
+		for step in steps[:-1]:
+			child = node.get(step, {})
+			if child is None:
+				# a shorter path already selects the whole value
+				break
+			node = node.setdefault(step, child)
+		else:
+			node[steps[-1]] = None
+	return tree
+
+
+_MISSING = object()
+
+
+def project(document, tree):
+	"""
+	Keep only the fields of a projection tree, the missing fields are left out
+	:param document: JSON value, eg. an inspect document
+	:param tree: DICT of parse_field_paths(), None for the whole document
+	:return: the projected document, an empty DICT if none of the fields is there
+	"""
+	projected = _project(document, tree)
+	return {} if projected is _MISSING else projected
+
+
+def _project(value, tree):
+	if tree is None:
+		return value
+	if isinstance(value, list):
+		if '*' in tree:
+			items = [_project(item, tree['*']) for item in value]
+		elif any(isinstance(step, int) for step in tree):
+			items = [_project(value[i], tree[i]) for i in sorted(tree) if isinstance(i, int) and i < len(value)]
+		else:
+			items = [_project(item, tree) for item in value]
+		items = [item for item in items if item is not _MISSING]
+		return items if items or not value else _MISSING
+	if not isinstance(value, dict):
+		return _MISSING
+	if '*' in tree:
+		# a named step wins over the wildcard
+		keys = [(key, tree.get(key, tree['*'])) for key in value]
+	else:
+		keys = [(key, sub) for key, sub in tree.items() if key in value]
+	result = {}
+	for key, sub in keys:
+		projected = _project(value[key], sub)
+		if projected is not _MISSING:
+			result[key] = projected
+	return result if result else _MISSING
+
+
+def encode_cursor(position):
+	return base64.urlsafe_b64encode(json.dumps(position))
+
+
+def decode_cursor(cursor):
+	try:
+		return tuple(json.loads(base64.urlsafe_b64decode(str(cursor))))
+	except (TypeError, ValueError):
+		raise ValueError("Invalidate cursor: {}".format(cursor))
+
+
+def sorted_page(items, sort_key, descending=False, limit=None, cursor=None):
+	"""
+	One page of a listing in a stable order: by sort key, then by 'Id'. The next page starts after the position of
+	the last item of the previous one, so the objects created or removed meanwhile don't shift the pages.
+	:param items: LIST of DICT with an 'Id', eg. container summaries
+	:param sort_key: callable returning the sort value of an item
+	:param descending: True for the largest first
+	:param limit: INT of items per page, None for all of them
+	:param cursor: string of 'cursor' of the previous page, None for the first page
+	:return: tuple of (LIST of items, cursor of the next page, has_more)
+	"""
+	position = lambda item: (sort_key(item), item.get('Id'))
+	items = sorted(items, key=position, reverse=descending)
+	if cursor is not None:
+		after = decode_cursor(cursor)
+		if descending:
+			items = [item for item in items if position(item) < after]
+		else:
+			items = [item for item in items if position(item) > after]
+	if limit is None:
+		return items, None, False
+	page = items[:limit]
+	return page, encode_cursor(position(page[-1])) if page else cursor, len(items) > limit
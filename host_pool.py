@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the registry of the docker hosts in `docker_host_list`, a pool of APIClient
+#              connections per host and the fan-out of list/info/df calls to all of the hosts in parallel
+
+import contextlib
+import logging
+import Queue
+import threading
+import time
+from docker import APIClient
+from api_env import *
+from helper import iter_parallel, ParallelTimeout
+
+
+class HostUnavailable(Exception):
+	pass
+
+
+class DockerHost:
+	"""
+	One docker host with a pool of APIClient connections
+	"""
+	def __init__(self, base_url, pool_size=host_pool_size, client_timeout=host_client_timeout):
+		self.base_url = base_url
+		self.pool_size = pool_size
+		self.client_timeout = client_timeout
+		self.pool = Queue.Queue()
+		self.created = 0
+		self.lock = threading.Lock()
+		self.healthy = None
+		self.last_check = None
+		self.latency = None
+		self.error = None
+
+	@contextlib.contextmanager
+	def client(self, timeout=None):
+		"""
+		Borrow an APIClient from the pool, a new one is created while the pool isn't full
+		:param timeout: seconds to wait for a free client
+		:return: context manager of APIClient
+		"""
+		client = None
+		try:
+			client = self.pool.get_nowait()
+		except Queue.Empty:
+			with self.lock:
+				if self.created < self.pool_size:
+					self.created += 1
+					client = APIClient(base_url=self.base_url, timeout=self.client_timeout)
+		if client is None:
+			try:
+				client = self.pool.get(timeout=timeout if timeout is not None else self.client_timeout)
+			except Queue.Empty:
+				raise HostUnavailable("No free connection to {}".format(self.base_url))
+		try:
+			yield client
+		finally:
+			self.pool.put(client)
+
+	def check_health(self):
+		"""
+		Ping the docker daemon and record the result
+		:return: True if the daemon answered
+		"""
+		started = time.time()
+		try:
+			with self.client() as client:
+				client.ping()
+			self.healthy = True
+			self.error = None
+			self.latency = round(time.time() - started, 4)
+		except Exception as e:
+			self.healthy = False
+			self.error = str(e)
+			self.latency = None
+		self.last_check = time.time()
+		return self.healthy
+
+	def to_dict(self):
+		return {'host': self.base_url, 'healthy': self.healthy, 'last_check': self.last_check,
+		        'latency': self.latency, 'error': self.error, 'connections': self.created}
+
+
+def tag_host(result, host):
+	"""
+	Tag the result of one host with the host url
+	:param result: LIST of DICT or DICT
+	:param host: string of host url
+	:return: LIST of copied DICT with 'Host' key, or the DICT result with 'Host' key
+	"""
+	if isinstance(result, list):
+		tagged = []
+		for item in result:
+			item = dict(item)
+			item['Host'] = host
+			tagged.append(item)
+		return tagged
+	result = dict(result or {})
+	result['Host'] = host
+	return result
+
+
+class HostRegistry:
+	"""
+	Registry of the docker hosts, checks their health in background and fans out calls to all of them
+	"""
+	def __init__(self, host_list=docker_host_list, health_interval=host_health_interval):
+		self.hosts = dict((url, DockerHost(url)) for url in host_list)
+		self.health_interval = health_interval
+		self._stop = threading.Event()
+		self._checker = None
+
+	def start(self):
+		if self._checker is not None:
+			return
+		self._stop.clear()
+		self._checker = threading.Thread(target=self._check, name='host-health')
+		self._checker.daemon = True
+		self._checker.start()
+
+	def stop(self):
+		self._stop.set()
+		self._checker = None
+
+	def status(self):
+		return [host.to_dict() for host in self.hosts.values()]
+
+	def fan_out(self, call, timeout=host_call_timeout, hosts=None):
+		"""
+		Run call(client) on every healthy host in parallel. The hosts which don't answer before the timeout are
+		reported in errors and the results of the others are returned.
+		:param call: callable taking an APIClient
+		:param timeout: seconds to wait for the hosts
+		:param hosts: LIST of host urls, None for all
+		:return: DICT of results per host url, errors per host url, and partial=True if any host failed
+		"""
+		targets = []
+		errors = {}
+		for url in (hosts if hosts is not None else self.hosts.keys()):
+			host = self.hosts.get(url)
+			if host is None:
+				errors[url] = 'Unknown host'
+			elif host.healthy is False:
+				errors[url] = 'Unhealthy: {}'.format(host.error)
+			else:
+				targets.append(host)
+
+		def run(host):
+			with host.client(timeout=timeout) as client:
+				return call(client)
+
+		results = {}
+		for host, result, error in iter_parallel(run, targets, len(targets), timeout=timeout):
+			if error is None:
+				results[host.base_url] = result
+			elif isinstance(error, ParallelTimeout):
+				errors[host.base_url] = 'Timed out after {}s'.format(timeout)
+			else:
+				errors[host.base_url] = str(error)
+		return {'results': results, 'errors': errors, 'partial': len(errors) > 0}
+
+	def fan_out_merged(self, call, timeout=host_call_timeout, hosts=None):
+		"""
+		Same as fan_out() for the calls returning a list, the lists are merged and each item tagged with 'Host'
+		:return: DICT of merged results, errors per host url and partial
+		"""
+		outcome = self.fan_out(call, timeout=timeout, hosts=hosts)
+		merged = []
+		for url in sorted(outcome['results']):
+			merged += tag_host(outcome['results'][url], url)
+		outcome['results'] = merged
+		return outcome
+
+	def _check(self):
+		while not self._stop.is_set():
+			for host, healthy, error in iter_parallel(lambda h: h.check_health(), self.hosts.values(),
+			                                          len(self.hosts), timeout=self.health_interval):
+				if error is not None:
+					host.healthy = False
+					host.error = str(error)
+				elif not healthy:
+					logging.warning("Docker host {} is unhealthy: {}".format(host.base_url, host.error))
+			self._stop.wait(self.health_interval)
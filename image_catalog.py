@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the image catalog. The image metadata of every host in the host registry is
+#              mirrored into the 'images' collection, only the changes found since the previous sync are written.
+#              Removed images are kept in the catalog with Present=False.
+
+import logging
+import threading
+import time
+from api_env import *
+from helper import iter_parallel, ParallelTimeout
+
+CATALOG_COLLECTION = u'images'
+# fields compared between two syncs, a change of any of them is written
+CATALOG_FIELDS = ('RepoTags', 'RepoDigests', 'Digests', 'Size', 'Created', 'LastUsed', 'Present')
+# query sort keys -> catalog field
+CATALOG_SORTS = {'size': 'Size', 'created': 'Created', 'last_used': 'LastUsed'}
+
+
+def catalog_entry(image, last_used):
+	"""
+	Build the catalog fields of an image
+	:param image: DICT of one item of images()
+	:param last_used: epoch seconds of the last use by a container, 0 if never used
+	:return: DICT of CATALOG_FIELDS
+	"""
+	repo_digests = sorted(image.get('RepoDigests') or [])
+	return {
+		'RepoTags': sorted(t for t in image.get('RepoTags') or [] if t != '<none>:<none>'),
+		'RepoDigests': repo_digests,
+		# "repo@sha256:..." -> "sha256:...", a digest is the same image on every host and registry
+		'Digests': sorted(set(d.partition('@')[2] for d in repo_digests if '@' in d)),
+		'Size': image.get('Size'),
+		'Created': image.get('Created'),
+		'LastUsed': last_used,
+		'Present': True
+	}
+
+
+def last_used_times(containers, now):
+	"""
+	:param containers: LIST of DICT of containers(all=True)
+	:param now: epoch seconds of the sync
+	:return: DICT of image id -> epoch seconds, now for the images of the running containers
+	"""
+	used = {}
+	for container in containers:
+		image_id = container.get('ImageID')
+		when = now if container.get('State') == 'running' else container.get('Created', 0)
+		if when > used.get(image_id, 0):
+			used[image_id] = when
+	return used
+
+
+class ImageCatalog:
+	"""
+	Mirror of the images of all of the hosts in a HostRegistry. Every `sync_interval` seconds each healthy host is
+	listed, compared with the catalog state of the previous sync and only the differences are written as
+	buffered bulk updates. The layers of an image are read once, when it first appears on a host.
+	"""
+	def __init__(self, registry, database_factory, sync_interval=image_catalog_sync_interval):
+		self.registry = registry
+		self.database_factory = database_factory
+		self.database = None
+		self.sync_interval = sync_interval
+		# host url -> image id -> DICT of CATALOG_FIELDS as written to the catalog
+		self.known = None
+		self.lock = threading.Lock()
+		self.last_sync = {}
+		self._stop = threading.Event()
+		self._syncer = None
+
+	def start(self):
+		if self._syncer is not None:
+			return
+		self._stop.clear()
+		self._syncer = threading.Thread(target=self._sync_periodically, name='image-catalog')
+		self._syncer.daemon = True
+		self._syncer.start()
+
+	def stop(self):
+		self._stop.set()
+		self._syncer = None
+
+	def _db(self):
+		if self.database is None:
+			self.database = self.database_factory()
+		return self.database
+
+	def _load(self):
+		# the catalog state is read back once so a restart doesn't rewrite every image
+		if self.known is None:
+			known = {}
+			for record in self._db().document_search(CATALOG_COLLECTION, {}, ('Host', 'Id') + CATALOG_FIELDS):
+				fields = dict((f, record.get(f)) for f in CATALOG_FIELDS)
+				known.setdefault(record['Host'], {})[record['Id']] = fields
+			self.known = known
+		return self.known
+
+	def sync(self, timeout=None):
+		"""
+		Sync the catalog with all of the healthy hosts in parallel
+		:param timeout: seconds for all of the hosts, sync_interval by default
+		:return: DICT of host url -> number of written changes, or error message
+		"""
+		with self.lock:
+			self._load()
+			hosts = [h for h in self.registry.hosts.values() if h.healthy is not False]
+			summary = {}
+			for host, changes, error in iter_parallel(self.sync_host, hosts, len(hosts),
+			                                          timeout=timeout or self.sync_interval):
+				if error is None:
+					summary[host.base_url] = changes
+				elif isinstance(error, ParallelTimeout):
+					summary[host.base_url] = 'Timed out'
+				else:
+					summary[host.base_url] = str(error)
+			self._db().flush(CATALOG_COLLECTION)
+		return summary
+
+	def sync_host(self, host):
+		"""
+		Sync the catalog with one host
+		:param host: DockerHost instance
+		:return: INT of number of written changes
+		"""
+		now = int(time.time())
+		with host.client() as client:
+			images = client.images()
+			used = last_used_times(client.containers(all=True), now)
+			known = self._load().setdefault(host.base_url, {})
+			current = set()
+			changes = 0
+			for image in images:
+				image_id = image['Id']
+				current.add(image_id)
+				fields = catalog_entry(image, used.get(image_id, 0))
+				previous = known.get(image_id)
+				if previous is not None:
+					# keep the last use of an image whose containers were removed
+					fields['LastUsed'] = max(fields['LastUsed'], previous.get('LastUsed') or 0)
+					diff = dict((f, v) for f, v in fields.items() if previous.get(f) != v)
+				else:
+					diff = dict(fields, FirstSeen=now, RemovedAt=None, Layers=self._layers(client, image_id))
+				if previous is not None and 'Present' in diff:
+					diff['RemovedAt'] = None
+				if diff:
+					self._db().document_update(CATALOG_COLLECTION, {'Host': host.base_url, 'Id': image_id}, diff,
+					                           buffered=True)
+					known[image_id] = fields
+					changes += 1
+		for image_id, previous in known.items():
+			if image_id not in current and previous.get('Present'):
+				self._db().document_update(CATALOG_COLLECTION, {'Host': host.base_url, 'Id': image_id},
+				                           {'Present': False, 'RemovedAt': now}, buffered=True)
+				previous['Present'] = False
+				changes += 1
+		self.last_sync[host.base_url] = now
+		return changes
+
+	def _layers(self, client, image_id):
+		try:
+			return (client.inspect_image(image_id).get('RootFS') or {}).get('Layers') or []
+		except Exception as e:
+			logging.warning("Inspecting image {} failed: {}".format(image_id, str(e)))
+			return []
+
+	def query(self, filters, sort=None, descending=True, limit=db_page_size, cursor=None):
+		"""
+		Query the catalog without contacting the hosts
+		:param filters: DICT of search keys, see database.build_query()
+		:param sort: one of CATALOG_SORTS to get the top `limit` images in that order, None for pages in catalog order
+		:param descending: True for the largest/newest first
+		:param limit: INT of images per page
+		:param cursor: string of 'cursor' of the previous page, only without sort
+		:return: DICT of images, cursor and has_more
+		"""
+		if sort is None:
+			page = self._db().document_page(CATALOG_COLLECTION, filters, limit=limit, cursor=cursor)
+			return {'images': page['documents'], 'cursor': page['cursor'], 'has_more': page['has_more']}
+		direction = -1 if descending else 1
+		documents = list(self._db().document_search(CATALOG_COLLECTION, filters)
+		                 .sort([(CATALOG_SORTS[sort], direction), ('_id', direction)])
+		                 .limit(min(limit, db_page_size_max)))
+		for document in documents:
+			document['_id'] = str(document['_id'])
+		return {'images': documents, 'cursor': None, 'has_more': False}
+
+	def _sync_periodically(self):
+		while not self._stop.is_set():
+			try:
+				self.sync()
+			except Exception as e:
+				logging.warning("Image catalog sync failed: {}".format(str(e)))
+			self._stop.wait(self.sync_interval)
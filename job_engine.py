@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the asynchronous job engine for the long running daemon operations
+#              (pull/push/save/commit). Jobs run on bounded worker pools and publish their progress events.
+
+import collections
+import json
+import logging
+import Queue
+import threading
+import time
+import uuid
+from api_env import *
+
+
+class JobQueueFull(Exception):
+	pass
+
+
+class JobFailed(Exception):
+	pass
+
+
+class Job:
+	"""
+	One asynchronous operation. Progress events are kept with a sequence number, so a client could poll or
+	follow them from any point (SSE Last-Event-ID).
+	"""
+	def __init__(self, kind, func, key=None, params=None, event_history=job_event_history):
+		self.id = uuid.uuid4().hex
+		self.kind = kind
+		self.key = key
+		self.params = params or {}
+		self.func = func
+		self.status = 'queued'
+		self.created = time.time()
+		self.started = None
+		self.finished = None
+		self.result = None
+		self.error = None
+		# layer/item id -> latest progress of it
+		self.progress = collections.OrderedDict()
+		# number of requests merged into this job
+		self.subscribers = 1
+		self.seq = 0
+		self.events = collections.deque(maxlen=event_history)
+		self.cond = threading.Condition()
+
+	def is_done(self):
+		return self.status in ('succeed', 'failed')
+
+	def publish(self, event):
+		"""
+		Publish a progress event of the job
+		:param event: DICT of event
+		:return: None
+		"""
+		with self.cond:
+			self.seq += 1
+			self.events.append((self.seq, event))
+			self.cond.notify_all()
+
+	def update_progress(self, item_id, status, current=None, total=None, event=None):
+		"""
+		Record the progress of one item and publish it
+		:param item_id: string of layer/item id
+		:param event: DICT of event published, by default a message in the format of the daemon progress messages
+		"""
+		with self.cond:
+			self.progress[item_id] = {'status': status, 'current': current, 'total': total}
+			if event is None:
+				event = {'id': item_id, 'status': status, 'progressDetail': {'current': current, 'total': total}}
+			self.publish(event)
+
+	def wait_events(self, after=0, timeout=None):
+		"""
+		Wait for the events published after the sequence number `after`
+		:param after: INT of last seen sequence number
+		:param timeout: seconds to wait for a new event
+		:return: LIST of (seq, event), empty on timeout or when the job is done
+		"""
+		with self.cond:
+			if self.seq <= after and not self.is_done():
+				self.cond.wait(timeout)
+			return [e for e in self.events if e[0] > after]
+
+	def run(self):
+		self.status = 'running'
+		self.started = time.time()
+		self.publish({'status': 'running'})
+		try:
+			self.result = self.func(self)
+			status = 'succeed'
+		except Exception as e:
+			logging.error("Job {} {} failed: {}".format(self.kind, self.id, str(e)))
+			self.error = str(e)
+			status = 'failed'
+		self.finished = time.time()
+		with self.cond:
+			self.status = status
+			self.publish({'status': status, 'result': self.result, 'error': self.error})
+
+	def to_dict(self, with_progress=True):
+		job = {'id': self.id, 'kind': self.kind, 'key': self.key, 'params': self.params, 'status': self.status,
+		       'created': self.created, 'started': self.started, 'finished': self.finished, 'result': self.result,
+		       'error': self.error, 'subscribers': self.subscribers}
+		if with_progress:
+			with self.cond:
+				job['progress'] = dict(self.progress)
+			job['overall'] = overall_progress(job['progress'])
+		return job
+
+
+def overall_progress(progress):
+	"""
+	Sum the byte progress of all of the items (layers)
+	:param progress: DICT of item id -> {'current':, 'total':}
+	:return: DICT of current/total bytes
+	"""
+	current = total = 0
+	for item in progress.values():
+		if item.get('total'):
+			total += item['total']
+			current += min(item.get('current') or 0, item['total'])
+	return {'current': current, 'total': total}
+
+
+def track_progress(job, stream):
+	"""
+	Consume the decoded JSON progress stream of pull(stream=True)/push(stream=True) into the job
+	:param job: Job instance
+	:param stream: generator of DICT progress messages
+	:return: LIST of the status messages which are not per layer progress
+	"""
+	messages = []
+	for message in stream:
+		if 'error' in message:
+			raise JobFailed(message['error'])
+		detail = message.get('progressDetail') or {}
+		if 'id' in message:
+			job.update_progress(message['id'], message.get('status'), detail.get('current'), detail.get('total'),
+			                    event=message)
+		else:
+			messages.append(message)
+			job.publish(message)
+	return messages
+
+
+class JobEngine:
+	"""
+	Run the jobs on bounded pools of worker threads, each pool with its own queue so the jobs waiting for a busy
+	pool don't hold the workers of the others. Jobs submitted with the same key while one is still queued or running
+	are merged into the existing one.
+	"""
+	def __init__(self, workers=job_workers, queue_size=job_queue_size, history=job_history_size):
+		self.lock = threading.Lock()
+		self.jobs = collections.OrderedDict()
+		self.history = history
+		# key -> job not finished yet
+		self.inflight = {}
+		# pool name -> Queue of its jobs
+		self.queues = {}
+		self.workers = []
+		for pool, count in sorted(workers.items()):
+			self.queues[pool] = Queue.Queue(maxsize=queue_size)
+			for i in range(count):
+				worker = threading.Thread(target=self._work, args=(self.queues[pool],),
+				                          name='job-worker-{}-{}'.format(pool, i))
+				worker.daemon = True
+				worker.start()
+				self.workers.append(worker)
+
+	def submit(self, kind, func, key=None, params=None, pool='default'):
+		"""
+		Queue a job
+		:param kind: string of job type, eg. 'pull'
+		:param func: callable taking the Job, its return value is the job result
+		:param key: string to merge identical jobs, eg. 'pull:repo/name:tag'. None to never merge
+		:param params: DICT of parameters shown in the job status
+		:param pool: string of worker pool running the job, the 'default' one if there is no such pool
+		:return: the new Job or the in-flight one with the same key
+		"""
+		with self.lock:
+			if key is not None and key in self.inflight:
+				job = self.inflight[key]
+				job.subscribers += 1
+				return job
+			job = Job(kind, func, key=key, params=params)
+			try:
+				self.queues.get(pool, self.queues['default']).put_nowait(job)
+			except Queue.Full:
+				raise JobQueueFull("Job queue is full, retry later")
+			self.jobs[job.id] = job
+			if key is not None:
+				self.inflight[key] = job
+			# forget the oldest finished jobs
+			while len(self.jobs) > self.history:
+				oldest = next(iter(self.jobs.values()))
+				if not oldest.is_done():
+					break
+				del self.jobs[oldest.id]
+			return job
+
+	def get(self, job_id):
+		return self.jobs.get(job_id)
+
+	def get_inflight(self, key):
+		return self.inflight.get(key)
+
+	def pending(self, kinds):
+		"""
+		:param kinds: LIST of job types, eg. ['pull', 'push']
+		:return: INT of the jobs of the types not started yet
+		"""
+		with self.lock:
+			return sum(1 for job in self.jobs.values() if job.status == 'queued' and job.kind in kinds)
+
+	def list(self):
+		with self.lock:
+			return [job.to_dict(with_progress=False) for job in self.jobs.values()]
+
+	def _work(self, queue):
+		while True:
+			job = queue.get()
+			try:
+				job.run()
+			finally:
+				with self.lock:
+					if job.key is not None and self.inflight.get(job.key) is job:
+						del self.inflight[job.key]
+				queue.task_done()
+
+
+def sse_events(job, last_event_id=0, heartbeat=sse_heartbeat_interval):
+	"""
+	Server-sent events stream of the job progress
+	:param job: Job instance
+	:param last_event_id: INT of the last event the client received
+	:param heartbeat: seconds between keep-alive comments
+	:return: generator of SSE formatted strings, ends after the job is done
+	"""
+	seq = last_event_id
+	while True:
+		events = job.wait_events(after=seq, timeout=heartbeat)
+		for seq, event in events:
+			yield "id: {}\nevent: {}\ndata: {}\n\n".format(seq, job.kind, json.dumps(event))
+		if job.is_done() and not job.wait_events(after=seq, timeout=0):
+			yield "event: end\ndata: {}\n\n".format(json.dumps(job.to_dict(with_progress=False)))
+			return
+		if not events:
+			yield ": keep-alive\n\n"
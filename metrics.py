@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the metrics of the API served on /metrics in the Prometheus text format. Every
+#              request of the Flask app and every call of the Docker methods is counted and timed. A metric update
+#              is one lock and a few dict operations, the text is only built when /metrics is scraped.
+
+import bisect
+import functools
+import threading
+import time
+from flask import g, request
+from helper import hold_streams
+from api_env import *
+
+# upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+	pairs = ['{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values)]
+	if extra is not None:
+		pairs.append('{}="{}"'.format(*extra))
+	return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+	if value == float('inf'):
+		return '+Inf'
+	if isinstance(value, float) and value.is_integer():
+		return str(int(value))
+	return repr(value)
+
+
+class Counter:
+	"""
+	Monotonic counter per label values
+	"""
+	kind = 'counter'
+
+	def __init__(self, name, description, labels=()):
+		self.name = name
+		self.description = description
+		self.labels = labels
+		self.lock = threading.Lock()
+		# tuple of label values -> value
+		self.values = {}
+
+	def inc(self, labels=(), amount=1):
+		with self.lock:
+			self.values[labels] = self.values.get(labels, 0) + amount
+
+	def samples(self):
+		with self.lock:
+			values = self.values.items()
+		return [(self.name, _format_labels(self.labels, k), v) for k, v in sorted(values)]
+
+
+class Gauge(Counter):
+	"""
+	Value going up and down per label values, eg. the requests in progress
+	"""
+	kind = 'gauge'
+
+	def dec(self, labels=(), amount=1):
+		self.inc(labels, -amount)
+
+
+class Histogram:
+	"""
+	Distribution of observed values per label values, in cumulative buckets with their sum and count
+	"""
+	kind = 'histogram'
+
+	def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+		self.name = name
+		self.description = description
+		self.labels = labels
+		self.buckets = tuple(buckets)
+		self.lock = threading.Lock()
+		# tuple of label values -> [count of every bucket..., sum, count]
+		self.values = {}
+
+	def observe(self, labels, value):
+		index = bisect.bisect_left(self.buckets, value)
+		with self.lock:
+			counts = self.values.get(labels)
+			if counts is None:
+				counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+			# the observations over the last bucket are only counted in +Inf, ie. the total count
+			if index < len(self.buckets):
+				counts[index] += 1
+			counts[-2] += value
+			counts[-1] += 1
+
+	def samples(self):
+		with self.lock:
+			values = [(k, list(v)) for k, v in self.values.items()]
+		samples = []
+		for key, counts in sorted(values):
+			cumulative = 0
+			for bound, count in zip(self.buckets, counts):
+				cumulative += count
+				samples.append((self.name + '_bucket', _format_labels(self.labels, key, ('le', _format_value(float(bound)))),
+				                cumulative))
+			samples.append((self.name + '_bucket', _format_labels(self.labels, key, ('le', '+Inf')), counts[-1]))
+			samples.append((self.name + '_sum', _format_labels(self.labels, key), round(counts[-2], 6)))
+			samples.append((self.name + '_count', _format_labels(self.labels, key), counts[-1]))
+		return samples
+
+
+class MetricRegistry:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.metrics = []
+
+	def register(self, metric):
+		with self.lock:
+			self.metrics.append(metric)
+		return metric
+
+	def render(self):
+		"""
+		:return: string of all of the metrics in the Prometheus text exposition format 0.0.4
+		"""
+		lines = []
+		for metric in self.metrics:
+			lines.append('# HELP {} {}'.format(metric.name, metric.description))
+			lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+			for name, labels, value in metric.samples():
+				lines.append('{}{} {}'.format(name, labels, _format_value(value)))
+		return '\n'.join(lines) + '\n'
+
+
+registry = MetricRegistry()
+
+http_requests = registry.register(Counter(
+	'tesseract_http_requests_total', 'Requests answered, by route, method and status code.',
+	('route', 'method', 'status')))
+http_errors = registry.register(Counter(
+	'tesseract_http_request_errors_total', 'Requests answered with a 5xx status or an unhandled exception.',
+	('route', 'method')))
+http_in_flight = registry.register(Gauge(
+	'tesseract_http_requests_in_flight', 'Requests in progress, by route.', ('route',)))
+http_latency = registry.register(Histogram(
+	'tesseract_http_request_duration_seconds',
+	'Seconds until the response is returned by the resource, the body of a streamed response is not included.',
+	('route', 'method')))
+docker_calls = registry.register(Counter(
+	'tesseract_docker_calls_total', 'Calls of the Docker methods.', ('method',)))
+docker_errors = registry.register(Counter(
+	'tesseract_docker_call_errors_total', 'Calls of the Docker methods raising or returning a failed status.',
+	('method',)))
+docker_in_flight = registry.register(Gauge(
+	'tesseract_docker_calls_in_flight', 'Calls of the Docker methods in progress.', ('method',)))
+docker_latency = registry.register(Histogram(
+	'tesseract_docker_call_duration_seconds',
+	'Seconds of the calls of the Docker methods returning a value, the streams are in the stream duration.',
+	('method',)))
+docker_stream_latency = registry.register(Histogram(
+	'tesseract_docker_stream_duration_seconds',
+	'Seconds of the calls of the Docker methods returning a stream, until the stream is exhausted or closed.',
+	('method',)))
+stream_bytes = registry.register(Counter(
+	'tesseract_stream_bytes_total', 'Bytes streamed between the daemon and the clients, by transfer kind.',
+	('kind',)))
+
+
+def _route():
+	return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def instrument_app(app):
+	"""
+	Count and time every request of a Flask app
+	:param app: Flask instance
+	"""
+	@app.before_request
+	def start_request():
+		g.metrics_route = _route()
+		g.metrics_started = time.time()
+		http_in_flight.inc((g.metrics_route,))
+
+	@app.after_request
+	def observe_request(response):
+		started = g.pop('metrics_started', None)
+		if started is not None:
+			route, method = g.metrics_route, request.method
+			http_latency.observe((route, method), time.time() - started)
+			http_requests.inc((route, method, str(response.status_code)))
+			if response.status_code >= 500:
+				http_errors.inc((route, method))
+		return response
+
+	@app.teardown_request
+	def finish_request(exception=None):
+		route = g.pop('metrics_route', None)
+		if route is None:
+			return
+		http_in_flight.dec((route,))
+		# after_request is skipped when the request failed with an exception
+		started = g.pop('metrics_started', None)
+		if started is not None:
+			http_latency.observe((route, request.method), time.time() - started)
+			http_requests.inc((route, request.method, '500'))
+			http_errors.inc((route, request.method))
+
+
+def _instrument(name, method):
+	labels = (name,)
+
+	@functools.wraps(method)
+	def timed(*args, **kwargs):
+		docker_in_flight.inc(labels)
+		started = time.time()
+		failed = True
+		held = False
+		try:
+			result = method(*args, **kwargs)
+			failed = isinstance(result, dict) and result.get('status') == 'failed'
+			# a returned generator is only created here, the call is timed until the stream is done
+			result, held = hold_streams(result, lambda: finish(docker_stream_latency, started))
+			return result
+		finally:
+			docker_calls.inc(labels)
+			if failed:
+				docker_errors.inc(labels)
+			if not held:
+				finish(docker_latency, started)
+
+	def finish(histogram, started):
+		histogram.observe(labels, time.time() - started)
+		docker_in_flight.dec(labels)
+	return timed
+
+
+def instrument_methods(cls):
+	"""
+	Count and time the calls of every public method of a class, the methods returning a stream are timed until the
+	stream is exhausted or closed
+	:param cls: class to patch, eg. Docker
+	"""
+	for name, method in list(cls.__dict__.items()):
+		if callable(method) and not name.startswith('_'):
+			setattr(cls, name, _instrument(name, method))
+	return cls
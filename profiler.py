@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the on-demand sampling profiler of the requests. A request is profiled when its
+#              `profiler_header` header is `profiler_token` or it is picked by the sampling rate set with
+#              /api/v1/system/profiler. One sampler thread reads the stacks of the profiled request threads every
+#              `interval` seconds, the samples are stored per route as collapsed stacks (flamegraph.pl, speedscope)
+#              when the request ends. Nothing runs when no request is profiled.
+
+import collections
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from flask import g, request
+from api_env import *
+
+PROFILE_FORMATS = ('collapsed', 'speedscope')
+PROFILE_NAME = re.compile(r'^[A-Za-z0-9_.-]+/[0-9]+-[A-Z]+-[0-9a-f]{32}\.collapsed$')
+
+
+def _real_thread_api():
+	# in the 'gevent' server mode the sampler must be a real thread, a greenlet would only run when the profiled
+	# request yields. The samples are then the stacks of the greenlets running on the request thread meanwhile.
+	try:
+		from gevent import monkey
+		if monkey.is_module_patched('thread'):
+			return (monkey.get_original('thread', 'start_new_thread'), monkey.get_original('thread', 'get_ident'),
+			        monkey.get_original('time', 'sleep'))
+	except ImportError:
+		pass
+	import thread
+	return thread.start_new_thread, thread.get_ident, time.sleep
+
+
+# code object -> frame name, a frame name is only formatted once
+_frame_names = {}
+
+
+def _frame_name(code):
+	name = _frame_names.get(code)
+	if name is None:
+		filename = code.co_filename
+		# the path relative to the sys.path entry it was imported from, eg. 'flask/app.py'
+		for entry in sorted((os.path.abspath(p) for p in sys.path if p), key=len, reverse=True):
+			if filename.startswith(entry + os.sep):
+				filename = filename[len(entry) + 1:]
+				break
+		name = _frame_names[code] = '{} ({})'.format(code.co_name, filename)
+	return name
+
+
+class Profile:
+	"""
+	Stack samples of one request, as collapsed stack -> number of samples
+	"""
+	def __init__(self, route, method):
+		self.id = uuid.uuid4().hex
+		# path of the profile file under the profiler directory, see SamplingProfiler.start()
+		self.name = None
+		self.route = route
+		self.method = method
+		self.started = time.time()
+		self.duration = None
+		self.status = None
+		self.stacks = collections.Counter()
+		self.samples = 0
+
+	def add(self, frame):
+		names = []
+		while frame is not None:
+			names.append(_frame_name(frame.f_code))
+			frame = frame.f_back
+		names.reverse()
+		self.stacks[';'.join(names)] += 1
+		self.samples += 1
+
+
+class SamplingProfiler:
+	"""
+	Profiles the requests selected by header or by `rate`, keeps the latest `max_profiles` ones under `path`
+	"""
+	def __init__(self, path=profiler_path, interval=profiler_interval, rate=profiler_sample_rate,
+	             max_profiles=profiler_max_profiles):
+		self.path = path
+		self.interval = interval
+		self.rate = rate
+		# route rule profiled by the rate, all of the routes if None
+		self.route = None
+		self.max_profiles = max_profiles
+		self.lock = threading.Lock()
+		# profile id -> (real thread ident, Profile) of the requests being profiled
+		self.active = {}
+		self.profiles = None
+		self._start_thread, self._get_ident, self._sleep = _real_thread_api()
+		self._sampling = False
+
+	def configure(self, rate, route=None):
+		"""
+		:param rate: float of fraction of the requests profiled, 0 to profile only the requests with the header
+		:param route: string of route rule, eg. '/api/v1/docker/container', None for all of the routes
+		"""
+		if not 0 <= rate <= 1:
+			raise ValueError("Invalidate sampling rate: {}".format(rate))
+		self.rate, self.route = rate, route
+
+	def selected(self, route):
+		if self._forced(request.headers.get(profiler_header)):
+			return True
+		return self.rate > 0 and (self.route is None or self.route == route) and random.random() < self.rate
+
+	def _forced(self, value):
+		# the header is compared with the token in constant time, it's the only thing limiting the profiled requests.
+		# Without a token only the sampling rate set by the admins applies.
+		if not value or profiler_token is None:
+			return False
+		return hmac.compare_digest(str(value), str(profiler_token))
+
+	def start(self, route, method):
+		profile = Profile(route, method)
+		profile.name = '{}/{}-{}-{}.collapsed'.format(self._route_dir(route), int(profile.started * 1000), method,
+		                                              profile.id)
+		with self.lock:
+			self.active[profile.id] = (self._get_ident(), profile)
+			if not self._sampling:
+				self._sampling = True
+				self._start_thread(self._sample, ())
+		return profile
+
+	def finish(self, profile, status):
+		with self.lock:
+			self.active.pop(profile.id, None)
+		profile.duration = time.time() - profile.started
+		profile.status = status
+		try:
+			self._save(profile)
+		except (IOError, OSError) as e:
+			logging.warning("Saving the profile of {} failed: {}".format(profile.route, str(e)))
+
+	def _sample(self):
+		# the sampler thread exits when no request is profiled, it costs nothing meanwhile
+		while True:
+			with self.lock:
+				if not self.active:
+					self._sampling = False
+					return
+				active = self.active.values()
+			frames = sys._current_frames()
+			for ident, profile in active:
+				frame = frames.get(ident)
+				if frame is not None:
+					profile.add(frame)
+			del frames
+			self._sleep(self.interval)
+
+	def _route_dir(self, route):
+		return re.sub(r'[^A-Za-z0-9_.-]+', '_', route).strip('_') or 'root'
+
+	def _load(self):
+		if self.profiles is None:
+			profiles = []
+			if os.path.isdir(self.path):
+				for route_dir in os.listdir(self.path):
+					for name in os.listdir(os.path.join(self.path, route_dir)):
+						name = route_dir + '/' + name
+						if PROFILE_NAME.match(name):
+							started, method, _ = name.split('/')[1].split('-', 2)
+							profiles.append({'name': name, 'route': None, 'method': method,
+							                 'started': int(started) / 1000.0, 'duration': None, 'status': None,
+							                 'samples': None})
+			self.profiles = collections.deque(sorted(profiles, key=lambda p: p['started']))
+		return self.profiles
+
+	def _save(self, profile):
+		name = profile.name
+		path = os.path.join(self.path, name)
+		with self.lock:
+			# the profiles of the previous runs are listed before this one is written
+			self._load()
+		if not os.path.isdir(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+		with open(path, 'w') as f:
+			for stack, count in sorted(profile.stacks.items()):
+				f.write('{} {}\n'.format(stack, count))
+		with self.lock:
+			profiles = self._load()
+			profiles.append({'name': name, 'route': profile.route, 'method': profile.method,
+			                 'started': profile.started, 'duration': round(profile.duration, 6),
+			                 'status': profile.status, 'samples': profile.samples})
+			while len(profiles) > self.max_profiles:
+				try:
+					os.remove(os.path.join(self.path, profiles.popleft()['name']))
+				except OSError:
+					pass
+
+	def list(self, route=None):
+		"""
+		:param route: string of route rule, None for all of the profiles
+		:return: LIST of profile DICT, the latest first
+		"""
+		with self.lock:
+			profiles = list(self._load())
+		return [p for p in reversed(profiles) if route is None or p['route'] == route]
+
+	def read(self, name, format='collapsed'):
+		"""
+		:param name: string of profile name of list()
+		:param format: one of PROFILE_FORMATS
+		:return: string of the profile in the format
+		"""
+		if not PROFILE_NAME.match(name or ''):
+			raise KeyError(name)
+		path = os.path.join(self.path, name)
+		if not os.path.isfile(path):
+			raise KeyError(name)
+		with open(path) as f:
+			collapsed = f.read()
+		if format == 'collapsed':
+			return collapsed
+		return json.dumps(self.speedscope(name, collapsed))
+
+	def speedscope(self, name, collapsed):
+		"""
+		Convert collapsed stacks to the speedscope file format, one sampled profile weighted in seconds
+		:param name: string of profile name
+		:param collapsed: string of collapsed stacks
+		:return: DICT of speedscope document
+		"""
+		frames = []
+		indexes = {}
+		samples = []
+		weights = []
+		for line in collapsed.splitlines():
+			stack, _, count = line.rpartition(' ')
+			sample = []
+			for frame in stack.split(';'):
+				index = indexes.get(frame)
+				if index is None:
+					function, _, location = frame.partition(' (')
+					index = indexes[frame] = len(frames)
+					frames.append({'name': function, 'file': location.rstrip(')')})
+				sample.append(index)
+			samples.append(sample)
+			weights.append(int(count) * self.interval)
+		return {'$schema': 'https://www.speedscope.app/file-format-schema.json', 'name': name,
+		        'shared': {'frames': frames},
+		        'profiles': [{'type': 'sampled', 'name': name, 'unit': 'seconds', 'startValue': 0,
+		                      'endValue': sum(weights), 'samples': samples, 'weights': weights}]}
+
+
+def instrument_app(app, profiler):
+	"""
+	Profile the selected requests of a Flask app
+	:param app: Flask instance
+	:param profiler: SamplingProfiler instance
+	"""
+	@app.before_request
+	def start_profile():
+		route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+		if profiler.selected(route):
+			g.profile = profiler.start(route, request.method)
+
+	@app.after_request
+	def profile_status(response):
+		profile = g.get('profile')
+		if profile is not None:
+			profile.status = response.status_code
+			response.headers['X-Profile'] = profile.name
+		return response
+
+	@app.teardown_request
+	def finish_profile(exception=None):
+		profile = g.pop('profile', None)
+		if profile is not None:
+			profiler.finish(profile, profile.status or 500)
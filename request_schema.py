@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the per-endpoint request schemas. A schema is built once when the resource is
+#              defined, it only reads and converts the fields its endpoint uses and rejects a request with a
+#              structured 400 listing every invalid field.
+
+from flask import request
+from flask_restful import abort
+
+
+def text(value):
+	return value if isinstance(value, basestring) else unicode(value)
+
+
+def boolean(value):
+	if isinstance(value, bool):
+		return value
+	value = text(value).strip().lower()
+	if value in ('1', 'true', 'yes', 'on'):
+		return True
+	if value in ('0', 'false', 'no', 'off'):
+		return False
+	raise ValueError("Invalidate boolean: {}".format(value))
+
+
+def positive_int(value):
+	value = int(value)
+	if value <= 0:
+		raise ValueError("Must be a positive integer")
+	return value
+
+
+def comma_list(value):
+	"""
+	:param value: LIST from a JSON body or comma separated string
+	:return: LIST of non-empty strings
+	"""
+	if isinstance(value, (list, tuple)):
+		return [text(v) for v in value]
+	return [v.strip() for v in text(value).split(',') if v.strip()]
+
+
+def raw(value):
+	# JSON values (objects, lists) passed through as they are
+	return value
+
+
+class Field:
+	"""
+	One request field
+	:param name: string of field name
+	:param type: callable converting the raw value, it raises ValueError/TypeError on invalid values
+	:param required: True to reject the request when the field is missing
+	:param default: value used when the field is missing
+	:param choices: tuple of accepted values
+	"""
+	def __init__(self, name, type=text, required=False, default=None, choices=None):
+		self.name = name
+		self.type = type
+		self.required = required
+		self.default = default
+		self.choices = choices
+
+
+class RequestSchema:
+	"""
+	Typed schema of the request fields of one endpoint. Fields are read from the JSON body first, then from the
+	query string and form (location='values') or only from the query string (location='args', for endpoints whose
+	body is a raw upload).
+	"""
+	def __init__(self, *fields, **options):
+		self.fields = fields
+		self.location = options.get('location', 'values')
+
+	def parse(self):
+		"""
+		Parse the current request
+		:return: DICT of field name -> converted value or default
+		"""
+		body = None
+		if self.location == 'values':
+			body = request.get_json(silent=True)
+		if not isinstance(body, dict):
+			body = {}
+		values = request.values if self.location == 'values' else request.args
+		args = {}
+		errors = {}
+		for field in self.fields:
+			value = body[field.name] if field.name in body else values.get(field.name)
+			if value is None or (value == '' and field.type is not text):
+				if field.required:
+					errors[field.name] = "Missing required parameter"
+				args[field.name] = field.default
+				continue
+			try:
+				value = field.type(value)
+			except (TypeError, ValueError) as e:
+				errors[field.name] = str(e) or "Invalidate value"
+				continue
+			if field.choices is not None and value not in field.choices:
+				errors[field.name] = "Must be one of: {}".format(', '.join(str(c) for c in field.choices))
+				continue
+			args[field.name] = value
+		if errors:
+			abort(400, message="Invalidate Parameter", errors=errors)
+		return args
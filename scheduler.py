@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the admission control of the daemon operations of one docker host. Every
+#              operation belongs to a class (interactive reads, registry pulls/pushes, image/container transfers,
+#              builds/commits) with its own limit of running and waiting operations. A free slot goes to the waiting
+#              operation of the highest priority, so a burst of bulk transfers doesn't delay the interactive reads.
+#              An operation is rejected with 429 and a Retry-After when its class queue is full or it waited too long.
+
+import contextlib
+import functools
+import heapq
+import itertools
+import math
+import threading
+import time
+from werkzeug.exceptions import TooManyRequests
+from helper import hold_streams
+from api_env import *
+
+# weight of the latest sample in the moving averages of the wait and run times
+AVERAGE_WEIGHT = 0.2
+
+
+class SchedulerBusy(TooManyRequests):
+	"""
+	The operation was not admitted, answered as 429 with a Retry-After header by the API
+	"""
+	def __init__(self, op_class, retry_after, reason):
+		self.retry_after = retry_after
+		description = "Too many {} operations {}, retry after {} seconds".format(op_class, reason, retry_after)
+		TooManyRequests.__init__(self, description)
+		self.data = {'message': description, 'status': 'failed', 'retry_after': retry_after}
+
+	def get_headers(self, environ=None):
+		return TooManyRequests.get_headers(self, environ) + [('Retry-After', str(self.retry_after))]
+
+
+class OperationClass:
+	def __init__(self, name, priority, max_running, max_waiting):
+		self.name = name
+		self.priority = priority
+		self.max_running = max_running
+		self.max_waiting = max_waiting
+		self.running = 0
+		self.waiting = 0
+		self.admitted = 0
+		self.rejected = 0
+		self.wait_average = 0.0
+		self.wait_max = 0.0
+		self.run_average = 0.0
+
+	def retry_after(self):
+		# seconds until the operations ahead of a new one are done, at least one
+		rounds = float(self.waiting + 1) / max(self.max_running, 1)
+		return max(int(math.ceil(rounds * self.run_average)), 1)
+
+	def to_dict(self):
+		return {'priority': self.priority, 'max_running': self.max_running, 'max_waiting': self.max_waiting,
+		        'running': self.running, 'waiting': self.waiting, 'admitted': self.admitted,
+		        'rejected': self.rejected, 'wait_average': round(self.wait_average, 3),
+		        'wait_max': round(self.wait_max, 3), 'run_average': round(self.run_average, 3),
+		        'retry_after': self.retry_after()}
+
+
+class HostScheduler:
+	"""
+	Slots of the daemon operations of one host: at most `max_running` at once, and at most the limit of its class
+	"""
+	def __init__(self, name, classes=scheduler_classes, max_running=scheduler_max_running,
+	             wait_timeout=scheduler_wait_timeout):
+		self.name = name
+		self.max_running = max_running
+		self.wait_timeout = wait_timeout
+		self.classes = dict((c, OperationClass(c, *limits)) for c, limits in classes.items())
+		# reentrant, a stream may be collected and release its slot while the lock is held
+		self.lock = threading.RLock()
+		self.running = 0
+		# heap of (priority, sequence number, queued time, class, Event) of the waiting operations
+		self.queue = []
+		self.seq = itertools.count()
+		# the operations started inside a running one (eg. a method calling another one) don't take a new slot
+		self.local = threading.local()
+
+	def check(self, op_class, pending=0):
+		"""
+		Reject now if the class queue is full, eg. before a job is queued
+		:param op_class: string of operation class
+		:param pending: INT of operations of the class queued elsewhere, eg. in the job engine
+		"""
+		cls = self.classes[op_class]
+		with self.lock:
+			if cls.waiting + pending >= cls.max_waiting:
+				cls.rejected += 1
+				raise SchedulerBusy(op_class, cls.retry_after(), 'queued')
+
+	def acquire(self, op_class):
+		"""
+		Wait for a slot of the class
+		:param op_class: string of operation class
+		:return: float of start time of the operation, pass it to release()
+		"""
+		cls = self.classes[op_class]
+		ready = threading.Event()
+		wait_timeout = getattr(self.local, 'wait_timeout', self.wait_timeout)
+		with self.lock:
+			if cls.waiting >= cls.max_waiting:
+				cls.rejected += 1
+				raise SchedulerBusy(op_class, cls.retry_after(), 'queued')
+			entry = (cls.priority, next(self.seq), time.time(), cls, ready)
+			heapq.heappush(self.queue, entry)
+			cls.waiting += 1
+			self._dispatch()
+		if not ready.is_set():
+			ready.wait(wait_timeout)
+			with self.lock:
+				if not ready.is_set():
+					self.queue.remove(entry)
+					heapq.heapify(self.queue)
+					cls.waiting -= 1
+					cls.rejected += 1
+					raise SchedulerBusy(op_class, cls.retry_after(),
+					                    'waiting for {} seconds'.format(wait_timeout))
+		return time.time()
+
+	@contextlib.contextmanager
+	def admitted(self, wait_timeout=scheduler_job_wait_timeout):
+		"""
+		Run the operations of this thread with another wait timeout, eg. a job already admitted by check() waits
+		longer in the queue of its class than a request
+		:param wait_timeout: seconds to wait for a slot, None to wait until one is free
+		"""
+		previous = getattr(self.local, 'wait_timeout', self.wait_timeout)
+		self.local.wait_timeout = wait_timeout
+		try:
+			yield
+		finally:
+			self.local.wait_timeout = previous
+
+	def release(self, op_class, started):
+		cls = self.classes[op_class]
+		with self.lock:
+			cls.run_average += AVERAGE_WEIGHT * (time.time() - started - cls.run_average)
+			cls.running -= 1
+			self.running -= 1
+			self._dispatch()
+
+	def _dispatch(self):
+		# start the waiting operations by priority then arrival, skipping the ones whose class is at its limit
+		if not self.queue or self.running >= self.max_running:
+			return
+		now = time.time()
+		started = []
+		for entry in sorted(self.queue):
+			if self.running >= self.max_running:
+				break
+			_, _, queued, cls, ready = entry
+			if cls.running < cls.max_running and not ready.is_set():
+				started.append(entry)
+				cls.waiting -= 1
+				cls.running += 1
+				cls.admitted += 1
+				self.running += 1
+				cls.wait_average += AVERAGE_WEIGHT * (now - queued - cls.wait_average)
+				cls.wait_max = max(cls.wait_max, now - queued)
+				ready.set()
+		if started:
+			self.queue = [e for e in self.queue if e not in started]
+			heapq.heapify(self.queue)
+
+	def run(self, op_class, method, *args, **kwargs):
+		"""
+		Call a method in a slot of the class. A generator returned by the method, alone or in a tuple, keeps the slot
+		until it is exhausted or closed.
+		"""
+		if getattr(self.local, 'depth', 0):
+			return method(*args, **kwargs)
+		started = self.acquire(op_class)
+		self.local.depth = 1
+		held = False
+		try:
+			result = method(*args, **kwargs)
+			result, held = hold_streams(result, lambda: self.release(op_class, started))
+			return result
+		finally:
+			self.local.depth = 0
+			if not held:
+				self.release(op_class, started)
+
+	def stats(self):
+		with self.lock:
+			return {'host': self.name, 'max_running': self.max_running, 'running': self.running,
+			        'waiting': len(self.queue), 'wait_timeout': self.wait_timeout,
+			        'classes': dict((c, cls.to_dict()) for c, cls in self.classes.items())}
+
+
+def _scheduled(op_class, method):
+	@functools.wraps(method)
+	def scheduled(self, *args, **kwargs):
+		return self.scheduler.run(op_class, method, self, *args, **kwargs)
+	return scheduled
+
+
+def schedule_methods(cls, methods):
+	"""
+	Run the methods of a class in the slots of the `scheduler` attribute of the instance
+	:param cls: class to patch, eg. Docker
+	:param methods: DICT of method name -> operation class
+	"""
+	for name, op_class in methods.items():
+		setattr(cls, name, _scheduled(op_class, cls.__dict__[name]))
+	return cls
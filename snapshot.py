@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the background refreshed snapshots of the expensive daemon calls (`docker info`,
+#              `docker system df`). The latest snapshot is served with its age and an ETag, concurrent forced
+#              refreshes share one daemon call.
+
+import hashlib
+import json
+import logging
+import threading
+import time
+
+
+class Snapshot:
+	"""
+	Latest result of one daemon call, refreshed every `interval` seconds in background
+	"""
+	def __init__(self, name, fetch, interval, volatile=()):
+		self.name = name
+		self.fetch = fetch
+		self.interval = interval
+		# top level keys left out of the ETag, eg. the clock of `docker info` changing on every call
+		self.volatile = volatile
+		self.lock = threading.Lock()
+		self.data = None
+		self.etag = None
+		self.taken = None
+		self.duration = None
+		self.error = None
+		# Event of the refresh in progress, the callers arriving meanwhile wait for it instead of calling again
+		self._inflight = None
+		self._stop = threading.Event()
+		self._refresher = None
+
+	def start(self):
+		if self._refresher is not None:
+			return
+		self._stop.clear()
+		self._refresher = threading.Thread(target=self._refresh_periodically, name='snapshot-' + self.name)
+		self._refresher.daemon = True
+		self._refresher.start()
+
+	def stop(self):
+		self._stop.set()
+		self._refresher = None
+
+	def latest(self):
+		"""
+		:return: DICT of data, etag, taken (epoch seconds), age (seconds), duration of the daemon call and error of
+		         the last failed refresh. The first call waits for the first snapshot.
+		"""
+		if self.taken is None and self.error is None:
+			self.refresh()
+		with self.lock:
+			return {'data': self.data, 'etag': self.etag, 'taken': self.taken,
+			        'age': round(time.time() - self.taken, 3) if self.taken is not None else None,
+			        'duration': self.duration, 'error': self.error}
+
+	def refresh(self):
+		"""
+		Take a new snapshot now. If a refresh is already running, wait for it and return its snapshot.
+		:return: DICT of latest snapshot, see latest()
+		"""
+		with self.lock:
+			inflight = self._inflight
+			leader = inflight is None
+			if leader:
+				inflight = self._inflight = threading.Event()
+		if leader:
+			try:
+				self._take()
+			finally:
+				with self.lock:
+					self._inflight = None
+				inflight.set()
+		else:
+			inflight.wait()
+		return self.latest()
+
+	def _take(self):
+		started = time.time()
+		try:
+			data = self.fetch()
+		except Exception as e:
+			# the previous snapshot is still served, with its growing age
+			self.error = str(e)
+			logging.warning("Refreshing the {} snapshot failed: {}".format(self.name, self.error))
+			return
+		# the ETag only changes with the content besides the volatile keys, a poller gets 304 across refreshes
+		# returning the same data
+		stable = dict((k, v) for k, v in data.items() if k not in self.volatile) if isinstance(data, dict) else data
+		etag = hashlib.sha1(json.dumps(stable, sort_keys=True)).hexdigest()
+		with self.lock:
+			self.data, self.etag, self.taken = data, etag, time.time()
+			self.duration = round(self.taken - started, 3)
+			self.error = None
+
+	def _refresh_periodically(self):
+		while not self._stop.is_set():
+			self.refresh()
+			self._stop.wait(self.interval)
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the background container resource sampler. It keeps one streaming stats
+#              subscription per running container and stores the computed usage in fixed size ring buffers.
+
+import json
+import logging
+import threading
+import time
+from api_env import *
+
+
+# fields of a computed sample, samples are stored as tuples in this order
+SAMPLE_FIELDS = ('time', 'cpu_percent', 'mem_usage', 'mem_limit', 'mem_percent', 'net_rx_bytes', 'net_tx_bytes',
+                 'net_rx_rate', 'net_tx_rate', 'blk_read_bytes', 'blk_write_bytes', 'blk_read_rate',
+                 'blk_write_rate', 'pids')
+
+
+def sample_to_dict(sample):
+	return dict(zip(SAMPLE_FIELDS, sample))
+
+
+def _blkio_bytes(stats):
+	read = write = 0
+	for entry in (stats.get('blkio_stats') or {}).get('io_service_bytes_recursive') or []:
+		op = entry.get('op', '').lower()
+		if op == 'read':
+			read += entry.get('value', 0)
+		elif op == 'write':
+			write += entry.get('value', 0)
+	return read, write
+
+
+def _net_bytes(stats):
+	rx = tx = 0
+	for net in (stats.get('networks') or {}).values():
+		rx += net.get('rx_bytes', 0)
+		tx += net.get('tx_bytes', 0)
+	return rx, tx
+
+
+def compute_sample(stats, previous, now):
+	"""
+	Compute the usage from a raw stats document and the previous one of the same container
+	:param stats: DICT of raw docker stats
+	:param previous: tuple of (time, raw stats) of the previous document, None for the first one
+	:param now: float of epoch seconds when the stats were received
+	:return: tuple of sample in SAMPLE_FIELDS order
+	"""
+	cpu = stats.get('cpu_stats') or {}
+	memory = stats.get('memory_stats') or {}
+	cpu_percent = 0.0
+	net_rx, net_tx = _net_bytes(stats)
+	blk_read, blk_write = _blkio_bytes(stats)
+	net_rx_rate = net_tx_rate = blk_read_rate = blk_write_rate = 0.0
+	if previous is not None:
+		prev_time, prev = previous
+		prev_cpu = prev.get('cpu_stats') or {}
+		cpu_delta = (cpu.get('cpu_usage') or {}).get('total_usage', 0) - \
+		            (prev_cpu.get('cpu_usage') or {}).get('total_usage', 0)
+		system_delta = cpu.get('system_cpu_usage', 0) - prev_cpu.get('system_cpu_usage', 0)
+		online_cpus = cpu.get('online_cpus') or len((cpu.get('cpu_usage') or {}).get('percpu_usage') or []) or 1
+		if cpu_delta > 0 and system_delta > 0:
+			cpu_percent = float(cpu_delta) / system_delta * online_cpus * 100.0
+		elapsed = now - prev_time
+		if elapsed > 0:
+			prev_rx, prev_tx = _net_bytes(prev)
+			prev_read, prev_write = _blkio_bytes(prev)
+			net_rx_rate = max(net_rx - prev_rx, 0) / elapsed
+			net_tx_rate = max(net_tx - prev_tx, 0) / elapsed
+			blk_read_rate = max(blk_read - prev_read, 0) / elapsed
+			blk_write_rate = max(blk_write - prev_write, 0) / elapsed
+	# page cache is reclaimable, it is not counted as used like `docker stats` does
+	mem_usage = memory.get('usage', 0) - (memory.get('stats') or {}).get('cache', 0)
+	mem_limit = memory.get('limit', 0)
+	mem_percent = float(mem_usage) / mem_limit * 100.0 if mem_limit else 0.0
+	pids = (stats.get('pids_stats') or {}).get('current', 0)
+	return (now, round(cpu_percent, 3), mem_usage, mem_limit, round(mem_percent, 3), net_rx, net_tx,
+	        round(net_rx_rate, 1), round(net_tx_rate, 1), blk_read, blk_write, round(blk_read_rate, 1),
+	        round(blk_write_rate, 1), pids)
+
+
+def average_samples(samples):
+	"""
+	Downsample several samples into one, the time is the one of the last sample
+	:param samples: LIST of sample tuples
+	:return: tuple of averaged sample
+	"""
+	count = len(samples)
+	averaged = [samples[-1][0]]
+	for i in range(1, len(SAMPLE_FIELDS)):
+		averaged.append(round(sum(s[i] for s in samples) / float(count), 3))
+	return tuple(averaged)
+
+
+class RingBuffer:
+	"""
+	Fixed size buffer, the oldest item is overwritten when it is full
+	"""
+	def __init__(self, size):
+		self.size = size
+		self.items = [None] * size
+		self.next = 0
+		self.count = 0
+
+	def append(self, item):
+		self.items[self.next] = item
+		self.next = (self.next + 1) % self.size
+		if self.count < self.size:
+			self.count += 1
+
+	def last(self):
+		if self.count == 0:
+			return None
+		return self.items[self.next - 1]
+
+	def to_list(self):
+		"""
+		:return: LIST of items, oldest first
+		"""
+		if self.count < self.size:
+			return self.items[:self.count]
+		return self.items[self.next:] + self.items[:self.next]
+
+
+class TieredHistory:
+	"""
+	Sample history of one container in several resolutions. Every sample goes to the finest tier, coarser tiers
+	get the average of the samples within each of their intervals.
+	"""
+	def __init__(self, tiers=stats_tiers):
+		# tier resolution in seconds -> (ring buffer, pending samples, end of current interval)
+		self.tiers = {}
+		for resolution, size in tiers:
+			self.tiers[resolution] = [RingBuffer(size), [], 0]
+		self.finest = min(self.tiers)
+
+	def add(self, sample):
+		now = sample[0]
+		for resolution, tier in self.tiers.items():
+			ring, pending, interval_end = tier
+			if resolution == self.finest:
+				ring.append(sample)
+				continue
+			if pending and now >= interval_end:
+				ring.append(average_samples(pending))
+				del pending[:]
+			if not pending:
+				tier[2] = (int(now) // resolution + 1) * resolution
+			pending.append(sample)
+
+	def window(self, resolution, seconds=None):
+		"""
+		:param resolution: INT of tier resolution in seconds
+		:param seconds: length of the window to return, None for the whole tier
+		:return: LIST of sample tuples, oldest first
+		"""
+		samples = self.tiers[resolution][0].to_list()
+		if seconds is not None:
+			since = time.time() - seconds
+			samples = [s for s in samples if s[0] >= since]
+		return samples
+
+
+class StatsSampler:
+	"""
+	Keep one streaming stats subscription per running container. The running containers are discovered from
+	`list_running` (the inventory backed container listing) every `discovery_interval` seconds.
+	"""
+	def __init__(self, handle, list_running, discovery_interval=stats_discovery_interval, tiers=stats_tiers):
+		self.handle = handle
+		self.list_running = list_running
+		self.discovery_interval = discovery_interval
+		self.tier_config = tiers
+		self.lock = threading.Lock()
+		# container id -> TieredHistory
+		self.histories = {}
+		# container id -> (sequence number, latest sample)
+		self.latest = {}
+		self.seq = 0
+		# container id -> Event to stop its sampling thread
+		self.samplers = {}
+		self._stop = threading.Event()
+		self._discovery = None
+
+	def start(self):
+		if self._discovery is not None:
+			return
+		self._stop.clear()
+		self._discovery = threading.Thread(target=self._discover, name='stats-discovery')
+		self._discovery.daemon = True
+		self._discovery.start()
+
+	def stop(self):
+		self._stop.set()
+		with self.lock:
+			for stop in self.samplers.values():
+				stop.set()
+		self._discovery = None
+
+	def resolutions(self):
+		return sorted(r for r, _ in self.tier_config)
+
+	def current(self, container_id=None):
+		"""
+		:param container_id: string of container id, None for all of the sampled containers
+		:return: DICT of latest sample, or DICT of container id -> latest sample. None if not sampled
+		"""
+		if container_id is not None:
+			latest = self.latest.get(self._resolve(container_id))
+			return sample_to_dict(latest[1]) if latest is not None else None
+		return dict((cid, sample_to_dict(latest[1])) for cid, latest in self.latest.items())
+
+	def history(self, container_id, resolution=None, seconds=None):
+		"""
+		:param container_id: string of container id
+		:param resolution: INT of tier resolution in seconds, None for the finest one
+		:param seconds: length of the window, None for the whole tier
+		:return: LIST of sample DICT, oldest first. None if the container is not sampled
+		"""
+		history = self.histories.get(self._resolve(container_id))
+		if history is None:
+			return None
+		if resolution is None:
+			resolution = history.finest
+		if resolution not in history.tiers:
+			raise ValueError("Unsupported resolution: {}".format(resolution))
+		with self.lock:
+			samples = history.window(resolution, seconds)
+		return [sample_to_dict(s) for s in samples]
+
+	def updates(self, after, container_ids=None):
+		"""
+		:param after: INT of sequence number seen by the caller
+		:param container_ids: LIST of container ids to watch, None for all
+		:return: tuple of (latest sequence number, DICT of container id -> sample updated after `after`)
+		"""
+		seq = self.seq
+		if container_ids is None:
+			container_ids = self.latest.keys()
+		else:
+			container_ids = [self._resolve(cid) for cid in container_ids]
+		changed = {}
+		for cid in container_ids:
+			latest = self.latest.get(cid)
+			if latest is not None and latest[0] > after:
+				changed[cid] = sample_to_dict(latest[1])
+		return seq, changed
+
+	def record(self, container_id, sample):
+		with self.lock:
+			history = self.histories.get(container_id)
+			if history is None:
+				history = self.histories[container_id] = TieredHistory(self.tier_config)
+			history.add(sample)
+			self.seq += 1
+			self.latest[container_id] = (self.seq, sample)
+
+	def _resolve(self, container_id):
+		# accept the short container id as `docker` cli does
+		if container_id in self.histories:
+			return container_id
+		for cid in self.histories.keys():
+			if cid.startswith(container_id):
+				return cid
+		return container_id
+
+	def _discover(self):
+		while not self._stop.is_set():
+			try:
+				running = set(c['Id'] for c in self.list_running())
+				with self.lock:
+					for cid in running - set(self.samplers):
+						stop = self.samplers[cid] = threading.Event()
+						sampler = threading.Thread(target=self._sample, args=(cid, stop), name='stats-' + cid[:12])
+						sampler.daemon = True
+						sampler.start()
+					for cid in set(self.samplers) - running:
+						self.samplers.pop(cid).set()
+						self.histories.pop(cid, None)
+						self.latest.pop(cid, None)
+			except Exception as e:
+				logging.warning("Stats sampler discovery failed: {}".format(str(e)))
+			self._stop.wait(self.discovery_interval)
+
+	def _sample(self, container_id, stop):
+		previous = None
+		try:
+			for stats in self.handle.stats(container_id, decode=True, stream=True):
+				if stop.is_set():
+					break
+				now = time.time()
+				self.record(container_id, compute_sample(stats, previous, now))
+				previous = (now, stats)
+		except Exception as e:
+			logging.warning("Stats stream of {} dropped: {}".format(container_id, str(e)))
+		finally:
+			with self.lock:
+				# let the discovery start a new subscription if the container is still running
+				if self.samplers.get(container_id) is stop:
+					del self.samplers[container_id]
+
+
+def sse_stats(sampler, container_ids=None, interval=stats_stream_interval, heartbeat=sse_heartbeat_interval):
+	"""
+	Server-sent events stream multiplexing the live samples of many containers. One event is sent per
+	interval with the samples updated since the previous one.
+	:param sampler: StatsSampler instance
+	:param container_ids: LIST of container ids, None for all
+	:param interval: seconds between events
+	:param heartbeat: seconds between keep-alive comments when nothing changed
+	:return: generator of SSE formatted strings
+	"""
+	seq = 0
+	idle = 0
+	while True:
+		seq, changed = sampler.updates(seq, container_ids)
+		if changed:
+			idle = 0
+			yield "id: {}\nevent: stats\ndata: {}\n\n".format(seq, json.dumps(changed))
+		else:
+			idle += interval
+			if idle >= heartbeat:
+				idle = 0
+				yield ": keep-alive\n\n"
+		time.sleep(interval)
@@ -1 +1,307 @@
-# -*- coding: utf-8 -*-
\ No newline at end of file
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the host hardware collector. /proc/meminfo, /proc/diskstats, /proc/stat and the
+#              usage of the mounted filesystems are sampled every interval in background. The samples are kept in
+#              fixed size arrays, the API answers from them and never reads /proc itself.
+
+import array
+import logging
+import os
+import threading
+import time
+from api_env import *
+
+# /proc/meminfo keys collected, in kB in the file and stored in bytes
+MEMORY_KEYS = ('MemTotal', 'MemFree', 'MemAvailable', 'Buffers', 'Cached', 'SwapTotal', 'SwapFree', 'Dirty',
+               'Writeback')
+MEMORY_FIELDS = ('total', 'free', 'available', 'buffers', 'cached', 'swap_total', 'swap_free', 'dirty', 'writeback',
+                 'used', 'percent')
+CPU_FIELDS = ('busy_percent', 'iowait_percent')
+DISK_FIELDS = ('reads', 'writes', 'read_bytes', 'write_bytes', 'read_rate', 'write_rate', 'util_percent',
+               'in_flight')
+MOUNT_FIELDS = ('total', 'used', 'free', 'percent')
+# devices of /proc/diskstats not reported
+IGNORED_DEVICES = ('loop', 'ram', 'fd', 'sr')
+SECTOR_SIZE = 512
+
+
+class SeriesRing:
+	"""
+	History of samples of fixed fields, one array of doubles per field used as a ring buffer
+	"""
+	def __init__(self, fields, size):
+		self.fields = fields
+		self.size = size
+		self.times = array.array('d', [0.0]) * size
+		self.columns = [array.array('d', [0.0]) * size for _ in fields]
+		self.next = 0
+		self.count = 0
+
+	def append(self, now, values):
+		i = self.next
+		self.times[i] = now
+		for column, value in zip(self.columns, values):
+			column[i] = value
+		self.next = (i + 1) % self.size
+		if self.count < self.size:
+			self.count += 1
+
+	def last(self):
+		"""
+		:return: DICT of the latest sample, None if empty
+		"""
+		if self.count == 0:
+			return None
+		i = self.next - 1
+		sample = dict((field, column[i]) for field, column in zip(self.fields, self.columns))
+		sample['time'] = self.times[i]
+		return sample
+
+	def window(self, seconds=None):
+		"""
+		:param seconds: length of the window, None for the whole history
+		:return: DICT of 'time' and every field -> LIST of values, oldest first
+		"""
+		start = self.next - self.count
+		indexes = [(start + k) % self.size for k in range(self.count)]
+		if seconds is not None:
+			since = time.time() - seconds
+			indexes = [i for i in indexes if self.times[i] >= since]
+		series = {'time': [self.times[i] for i in indexes]}
+		for field, column in zip(self.fields, self.columns):
+			series[field] = [column[i] for i in indexes]
+		return series
+
+
+class ProcFile:
+	"""
+	A /proc file kept open, every read seeks back to the start instead of opening it again
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.file = None
+
+	def read(self):
+		if self.file is None:
+			self.file = open(self.path, 'r')
+		self.file.seek(0)
+		return self.file.read()
+
+	def close(self):
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+
+def parse_meminfo(text, values):
+	"""
+	:param text: string of /proc/meminfo
+	:param values: DICT updated with key -> bytes for the MEMORY_KEYS
+	"""
+	for line in text.splitlines():
+		key, _, rest = line.partition(':')
+		if key in values:
+			values[key] = int(rest.split(None, 1)[0]) * 1024
+
+
+def parse_cpu(text):
+	"""
+	:param text: string of /proc/stat
+	:return: tuple of (total jiffies, idle jiffies, iowait jiffies) of all of the cpus
+	"""
+	# the first line is the aggregate 'cpu' line, the rest of the file is not needed
+	fields = text[:text.index('\n')].split()
+	# guest times are already included in user and nice
+	ticks = [int(f) for f in fields[1:9]]
+	return sum(ticks), ticks[3], ticks[4]
+
+
+def parse_diskstats(text, counters):
+	"""
+	:param text: string of /proc/diskstats
+	:param counters: DICT updated with device -> [reads, sectors read, writes, sectors written, in flight, io ms]
+	"""
+	for line in text.splitlines():
+		fields = line.split()
+		if len(fields) < 14 or fields[2].startswith(IGNORED_DEVICES):
+			continue
+		counter = counters.get(fields[2])
+		if counter is None:
+			counter = counters[fields[2]] = [0] * 6
+		counter[0] = int(fields[3])
+		counter[1] = int(fields[5])
+		counter[2] = int(fields[7])
+		counter[3] = int(fields[9])
+		counter[4] = int(fields[11])
+		counter[5] = int(fields[12])
+
+
+def parse_mounts(text):
+	"""
+	:param text: string of /proc/mounts
+	:return: DICT of mount point -> device, only the block device backed filesystems
+	"""
+	mounts = {}
+	for line in text.splitlines():
+		fields = line.split()
+		if len(fields) >= 2 and fields[0].startswith('/dev/'):
+			# spaces in mount points are escaped as \040
+			mounts[fields[1].replace('\\040', ' ')] = fields[0]
+	return mounts
+
+
+class SystemCollector:
+	"""
+	Samples the host memory, cpu, disks and mounted filesystems every `interval` seconds and keeps `history_size`
+	samples of each. The mount list is read again every `mount_refresh` samples.
+	"""
+	def __init__(self, interval=system_collector_interval, history_size=system_history_size, proc='/proc',
+	             mount_refresh=system_mount_refresh):
+		self.interval = interval
+		self.history_size = history_size
+		self.mount_refresh = mount_refresh
+		self.lock = threading.Lock()
+		self.meminfo = ProcFile(os.path.join(proc, 'meminfo'))
+		self.stat = ProcFile(os.path.join(proc, 'stat'))
+		self.diskstats = ProcFile(os.path.join(proc, 'diskstats'))
+		self.mounts_file = ProcFile(os.path.join(proc, 'mounts'))
+		self.memory = SeriesRing(MEMORY_FIELDS, history_size)
+		self.cpu = SeriesRing(CPU_FIELDS, history_size)
+		# device -> SeriesRing, mount point -> SeriesRing
+		self.disks = {}
+		self.mounts = {}
+		self.mount_devices = {}
+		# parsed values reused by every sample, and the counters of the previous sample to compute the rates
+		self._memory_values = dict((key, 0) for key in MEMORY_KEYS)
+		self._cpu_previous = None
+		# device -> counters of parse_diskstats()
+		self._disk_counters = {}
+		self._disk_previous = {}
+		self._previous_time = None
+		self.samples = 0
+		self.error = None
+		self._stop = threading.Event()
+		self._collector = None
+
+	def start(self):
+		if self._collector is not None:
+			return
+		self._stop.clear()
+		self._collector = threading.Thread(target=self._collect_periodically, name='system-collector')
+		self._collector.daemon = True
+		self._collector.start()
+
+	def stop(self):
+		self._stop.set()
+		self._collector = None
+		for f in (self.meminfo, self.stat, self.diskstats, self.mounts_file):
+			f.close()
+
+	def collect(self):
+		"""
+		Take one sample of every source now
+		"""
+		now = time.time()
+		elapsed = now - self._previous_time if self._previous_time is not None else None
+		parse_meminfo(self.meminfo.read(), self._memory_values)
+		cpu = parse_cpu(self.stat.read())
+		parse_diskstats(self.diskstats.read(), self._disk_counters)
+		if self.samples % self.mount_refresh == 0:
+			self.mount_devices = parse_mounts(self.mounts_file.read())
+		usages = {}
+		for mount in self.mount_devices:
+			try:
+				usages[mount] = os.statvfs(mount)
+			except OSError:
+				pass
+		with self.lock:
+			self._record_memory(now)
+			self._record_cpu(now, cpu)
+			self._record_disks(now, elapsed)
+			self._record_mounts(now, usages)
+			self._previous_time = now
+			self.samples += 1
+
+	def _record_memory(self, now):
+		m = self._memory_values
+		available = m['MemAvailable'] or m['MemFree'] + m['Buffers'] + m['Cached']
+		used = m['MemTotal'] - available
+		percent = round(used * 100.0 / m['MemTotal'], 2) if m['MemTotal'] else 0.0
+		self.memory.append(now, [m[key] for key in MEMORY_KEYS] + [used, percent])
+
+	def _record_cpu(self, now, cpu):
+		busy = iowait = 0.0
+		if self._cpu_previous is not None:
+			total = cpu[0] - self._cpu_previous[0]
+			if total > 0:
+				busy = round((total - (cpu[1] - self._cpu_previous[1]) - (cpu[2] - self._cpu_previous[2])) * 100.0 /
+				             total, 2)
+				iowait = round((cpu[2] - self._cpu_previous[2]) * 100.0 / total, 2)
+		self._cpu_previous = cpu
+		self.cpu.append(now, (busy, iowait))
+
+	def _record_disks(self, now, elapsed):
+		for device, counter in self._disk_counters.items():
+			ring = self.disks.get(device)
+			if ring is None:
+				ring = self.disks[device] = SeriesRing(DISK_FIELDS, self.history_size)
+			read_rate = write_rate = util = 0.0
+			previous = self._disk_previous.get(device)
+			if previous is not None and elapsed:
+				read_rate = round(max(counter[1] - previous[1], 0) * SECTOR_SIZE / elapsed, 1)
+				write_rate = round(max(counter[3] - previous[3], 0) * SECTOR_SIZE / elapsed, 1)
+				util = round(min(max(counter[5] - previous[5], 0) / (elapsed * 10.0), 100.0), 2)
+				previous[:] = counter
+			else:
+				self._disk_previous[device] = list(counter)
+			ring.append(now, (counter[0], counter[2], counter[1] * SECTOR_SIZE, counter[3] * SECTOR_SIZE,
+			                  read_rate, write_rate, util, counter[4]))
+
+	def _record_mounts(self, now, usages):
+		for mount in set(self.mounts) - set(usages):
+			del self.mounts[mount]
+		for mount, st in usages.items():
+			ring = self.mounts.get(mount)
+			if ring is None:
+				ring = self.mounts[mount] = SeriesRing(MOUNT_FIELDS, self.history_size)
+			total = st.f_blocks * st.f_frsize
+			free = st.f_bavail * st.f_frsize
+			used = total - st.f_bfree * st.f_frsize
+			percent = round(used * 100.0 / (used + free), 2) if used + free else 0.0
+			ring.append(now, (total, used, free, percent))
+
+	def _collect_periodically(self):
+		while not self._stop.is_set():
+			try:
+				self.collect()
+				self.error = None
+			except Exception as e:
+				self.error = str(e)
+				logging.warning("System collector failed: {}".format(self.error))
+			self._stop.wait(self.interval)
+
+	def memory_info(self, seconds=None):
+		"""
+		:param seconds: length of the history window, None for the latest sample only
+		:return: DICT of the latest memory and cpu samples, and their history if `seconds` is set
+		"""
+		with self.lock:
+			result = {'memory': self.memory.last(), 'cpu': self.cpu.last(), 'error': self.error}
+			if seconds is not None:
+				result['history'] = {'memory': self.memory.window(seconds), 'cpu': self.cpu.window(seconds)}
+		return result
+
+	def disk_info(self, seconds=None):
+		"""
+		:param seconds: length of the history window, None for the latest sample only
+		:return: DICT of the latest sample of every disk and mounted filesystem, and their history if `seconds` is set
+		"""
+		with self.lock:
+			result = {'disks': dict((d, ring.last()) for d, ring in self.disks.items()),
+			          'mounts': dict((m, dict(ring.last(), device=self.mount_devices.get(m)))
+			                         for m, ring in self.mounts.items()),
+			          'error': self.error}
+			if seconds is not None:
+				result['history'] = {'disks': dict((d, ring.window(seconds)) for d, ring in self.disks.items()),
+				                     'mounts': dict((m, ring.window(seconds)) for m, ring in self.mounts.items())}
+		return result
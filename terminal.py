@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+# Description: this file contains the WebSocket terminal gateway. A session relays a browser WebSocket and the
+#              hijacked docker socket of an exec/attach TTY both ways. Binary frames from the browser are stdin,
+#              text frames are JSON control messages: {"type": "resize", "rows": 40, "cols": 120} or
+#              {"type": "stdin", "data": "ls\r"}. The output is sent back as binary frames.
+
+import collections
+import json
+import logging
+import socket
+import threading
+import time
+import uuid
+from api_env import *
+
+
+class TerminalSession:
+	"""
+	One terminal session with its byte counters
+	"""
+	def __init__(self, container_id, cmd):
+		self.id = uuid.uuid4().hex
+		self.container_id = container_id
+		self.cmd = cmd
+		self.bytes_in = 0
+		self.bytes_out = 0
+		self.started = time.time()
+		self.last_active = self.started
+		self.finished = None
+		self.status = 'running'
+		self.ws = None
+		self.sock = None
+		self.lock = threading.Lock()
+
+	def close(self, status='closed'):
+		# closing both ends unblocks the relay reading from the other one
+		with self.lock:
+			if self.finished is not None:
+				return
+			self.finished = time.time()
+			self.status = status
+		try:
+			self.sock.shutdown(socket.SHUT_RDWR)
+		except Exception:
+			pass
+		for end in (self.sock, self.ws):
+			try:
+				end.close()
+			except Exception:
+				pass
+
+	def to_dict(self):
+		return {'id': self.id, 'container_id': self.container_id, 'cmd': self.cmd, 'bytes_in': self.bytes_in,
+		        'bytes_out': self.bytes_out, 'started': self.started, 'last_active': self.last_active,
+		        'finished': self.finished, 'status': self.status}
+
+
+class TerminalGateway:
+	"""
+	Runs the terminal sessions and closes the ones idle for more than `idle_timeout` seconds. In 'gevent' server
+	mode every session costs two greenlets, so many sessions share one process.
+	"""
+	def __init__(self, idle_timeout=terminal_idle_timeout, history=terminal_history_size):
+		self.idle_timeout = idle_timeout
+		self.lock = threading.Lock()
+		self.sessions = {}
+		self.finished = collections.deque(maxlen=history)
+		self._watchdog = None
+
+	def list(self):
+		with self.lock:
+			return [s.to_dict() for s in self.sessions.values()] + [s.to_dict() for s in self.finished]
+
+	def run(self, ws, container_id, cmd, terminal):
+		"""
+		Relay a WebSocket and a docker TTY until one of them closes or the session is idle
+		:param ws: WebSocket with receive(), send(message, binary) and close()
+		:param container_id: string of container id or name
+		:param cmd: string of exec command, None for attach
+		:param terminal: tuple of (socket, iterator of output chunks, resize(rows, cols)) of Docker.open_terminal()
+		:return: TerminalSession instance, finished
+		"""
+		session = TerminalSession(container_id, cmd)
+		session.ws = ws
+		session.sock, chunks, resize = terminal
+		with self.lock:
+			self.sessions[session.id] = session
+			if self._watchdog is None:
+				self._watchdog = threading.Thread(target=self._close_idle, name='terminal-watchdog')
+				self._watchdog.daemon = True
+				self._watchdog.start()
+		downstream = threading.Thread(target=self._downstream, args=(session, chunks),
+		                              name='terminal-' + session.id[:8])
+		downstream.daemon = True
+		downstream.start()
+		try:
+			self._upstream(session, resize)
+		finally:
+			session.close()
+			downstream.join(1)
+			with self.lock:
+				self.sessions.pop(session.id, None)
+				self.finished.append(session)
+		return session
+
+	def _upstream(self, session, resize):
+		# browser -> container
+		try:
+			self._relay_input(session, resize)
+		except Exception as e:
+			if session.finished is None:
+				session.close('failed')
+				logging.warning("Terminal {} input dropped: {}".format(session.id, str(e)))
+
+	def _relay_input(self, session, resize):
+		while session.finished is None:
+			message = session.ws.receive()
+			if message is None:
+				return
+			session.last_active = time.time()
+			if isinstance(message, unicode):
+				try:
+					control = json.loads(message)
+					if control.get('type') == 'resize':
+						self._resize(session, resize, int(control['rows']), int(control['cols']))
+						continue
+					if control.get('type') != 'stdin':
+						raise ValueError("Unsupported message type: {}".format(control.get('type')))
+					data = control['data'].encode('utf-8')
+				except (ValueError, KeyError, TypeError, AttributeError) as e:
+					logging.warning("Terminal {} ignored a message: {}".format(session.id, str(e)))
+					continue
+			else:
+				data = bytes(message)
+			session.sock.sendall(data)
+			session.bytes_in += len(data)
+
+	def _resize(self, session, resize, rows, cols):
+		# a failed resize leaves the session as it is
+		try:
+			resize(rows, cols)
+		except Exception as e:
+			logging.warning("Terminal {} resize failed: {}".format(session.id, str(e)))
+
+	def _downstream(self, session, chunks):
+		# container -> browser, the chunks are sent as they are read from the docker socket
+		status = 'exited'
+		try:
+			for chunk in chunks:
+				if chunk is None:
+					continue
+				session.last_active = time.time()
+				session.bytes_out += len(chunk)
+				session.ws.send(chunk, binary=True)
+		except Exception as e:
+			if session.finished is None:
+				status = 'failed'
+				logging.warning("Terminal {} output dropped: {}".format(session.id, str(e)))
+		session.close(status)
+
+	def _close_idle(self):
+		while True:
+			time.sleep(min(self.idle_timeout / 4.0, 5))
+			now = time.time()
+			with self.lock:
+				idle = [s for s in self.sessions.values() if now - s.last_active > self.idle_timeout]
+			for session in idle:
+				session.close('idle')
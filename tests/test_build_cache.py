@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+# Description: unit tests of the build context blob cache of build_cache.py
+# Usage: python -m unittest discover tests
+
+import hashlib
+import os
+import shutil
+import StringIO
+import tarfile
+import tempfile
+import unittest
+from build_cache import BlobStore
+
+
+def blob(content):
+	return hashlib.sha256(content).hexdigest(), StringIO.StringIO(content)
+
+
+class BlobStoreTest(unittest.TestCase):
+	def setUp(self):
+		self.path = tempfile.mkdtemp(prefix='build-cache-')
+		self.store = BlobStore(path=self.path, max_bytes=10)
+
+	def tearDown(self):
+		shutil.rmtree(self.path, ignore_errors=True)
+
+	def test_put_checks_the_digest(self):
+		digest, _ = blob('abc')
+		self.assertRaises(ValueError, self.store.put, digest, StringIO.StringIO('abd'))
+		self.assertEqual(self.store.missing([digest]), [digest])
+		self.assertEqual(os.listdir(os.path.join(self.path, digest[:2])), [])
+
+	def test_pinned_blobs_are_not_evicted(self):
+		first, content = blob('a' * 6)
+		self.store.put(first, content)
+		self.assertEqual(self.store.pin([first]), [])
+		second, content = blob('b' * 6)
+		self.store.put(second, content)
+		# over max_bytes, but one blob is pinned and the other one is waiting for its build
+		self.assertEqual(self.store.missing([first, second]), [])
+		tar = tarfile.open(fileobj=StringIO.StringIO(''.join(self.store.context_tar([('f', first, 0644)]))))
+		self.assertEqual(tar.extractfile('f').read(), 'a' * 6)
+		self.store.unpin([first])
+		self.assertEqual(self.store.missing([first, second]), [first])
+		self.assertEqual(self.store.stats()['bytes'], 6)
+
+	def test_stored_blob_is_not_evicted(self):
+		self.store.upload_grace = 0
+		first, content = blob('a' * 6)
+		self.store.put(first, content)
+		second, content = blob('b' * 12)
+		self.assertEqual(self.store.put(second, content), 12)
+		self.assertEqual(self.store.missing([first, second]), [first])
+
+	def test_pin_nothing_when_a_blob_is_missing(self):
+		digest, content = blob('abc')
+		self.store.put(digest, content)
+		missing, _ = blob('other')
+		self.assertEqual(self.store.pin([digest, missing]), [missing])
+		self.assertEqual(self.store.pins, {})
+
+	def test_load_skips_the_files_of_the_cache_directory(self):
+		digest, content = blob('abc')
+		self.store.put(digest, content)
+		open(os.path.join(self.path, 'README'), 'w').close()
+		self.assertEqual(BlobStore(path=self.path).missing([digest]), [])
+
+
+if __name__ == '__main__':
+	unittest.main()
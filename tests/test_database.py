@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+# Description: unit tests of database.py against an in-process stand-in of the pymongo client, no mongod needed.
+# Usage: python -m unittest discover tests
+
+import unittest
+from bson import ObjectId
+from pymongo import errors, InsertOne, UpdateOne
+import database
+from database import Database, build_query
+
+
+class FakeCursor:
+	def __init__(self, documents):
+		self.documents = documents
+
+	def sort(self, key, direction):
+		self.documents.sort(key=lambda d: d[key], reverse=direction < 0)
+		return self
+
+	def limit(self, count):
+		self.documents = self.documents[:count]
+		return self
+
+	def __iter__(self):
+		return iter(self.documents)
+
+
+class FakeCollection:
+	"""
+	Only the queries of document_page(): exact values, {'_id': {'$gt': ...}} and '$and'
+	"""
+	def __init__(self):
+		self.documents = []
+		self.bulk_writes = []
+		self.indexes = []
+		self.fail_with = None
+
+	def _match(self, document, query):
+		for key, value in query.items():
+			if key == '$and':
+				if not all(self._match(document, q) for q in value):
+					return False
+			elif isinstance(value, dict):
+				if '$gt' in value and not document.get(key) > value['$gt']:
+					return False
+			elif document.get(key) != value:
+				return False
+		return True
+
+	def find(self, query, projection=None):
+		return FakeCursor([dict(d) for d in self.documents if self._match(d, query)])
+
+	def bulk_write(self, operations, ordered=True):
+		self.bulk_writes.append(list(operations))
+		if self.fail_with is not None:
+			raise self.fail_with
+
+	def create_indexes(self, indexes):
+		self.indexes.extend(indexes)
+
+
+class FakeDatabase:
+	def __init__(self):
+		self.collections = {}
+
+	def collection_names(self):
+		return self.collections.keys()
+
+	def create_collection(self, name):
+		self.collections[name] = FakeCollection()
+
+	def __getitem__(self, name):
+		return self.collections.setdefault(name, FakeCollection())
+
+
+class FakeClient:
+	def __init__(self):
+		self.db = FakeDatabase()
+		self.closed = False
+
+	def __getitem__(self, name):
+		return self.db
+
+	def close(self):
+		self.closed = True
+
+
+class BuildQueryTest(unittest.TestCase):
+	def test_exact_values_are_passed_as_they_are(self):
+		self.assertEqual(build_query({'Host': 'h1', 'Present': True}), {'Host': 'h1', 'Present': True})
+		self.assertEqual(build_query(None), {})
+
+	def test_operators(self):
+		self.assertEqual(build_query({'Size__gte': 10, 'Size__lt': 20, 'Id__in': ('a', 'b')}),
+		                 {'Size': {'$gte': 10, '$lt': 20}, 'Id': {'$in': ['a', 'b']}})
+
+	def test_exact_value_merged_with_operator(self):
+		self.assertEqual(build_query({'Size': 5, 'Size__ne': 6}), {'Size': {'$eq': 5, '$ne': 6}})
+
+	def test_dollar_keys_are_passed(self):
+		query = {'$or': [{'a': 1}, {'b': 2}]}
+		self.assertEqual(build_query(query), query)
+
+	def test_invalid_operators(self):
+		self.assertRaises(ValueError, build_query, {'Size__between': 1})
+		self.assertRaises(ValueError, build_query, {'Id__in': 'a'})
+
+
+class DatabaseTest(unittest.TestCase):
+	def setUp(self):
+		self.original_client = database.MongoClient
+		database.MongoClient = FakeClient
+		# a long interval, the tests flush explicitly
+		self.db = Database(batch_size=3, flush_interval=3600)
+		self.collection = self.db.db['images']
+
+	def tearDown(self):
+		self.db.close()
+		database.MongoClient = self.original_client
+
+	def test_indexes_are_created(self):
+		self.assertTrue(self.collection.indexes)
+
+	def test_buffered_writes_wait_for_a_full_batch(self):
+		self.assertEqual(self.db.document_add('images', [{'Id': 'a'}, {'Id': 'b'}], buffered=True), 2)
+		self.assertEqual(self.collection.bulk_writes, [])
+		self.db.document_update('images', {'Id': 'a'}, {'Size': 1}, buffered=True)
+		self.assertEqual(len(self.collection.bulk_writes), 1)
+		operations = self.collection.bulk_writes[0]
+		self.assertEqual([type(o) for o in operations], [InsertOne, InsertOne, UpdateOne])
+		self.assertEqual(self.db.pending.get('images'), None)
+
+	def test_flush_writes_the_partial_batches(self):
+		self.db.document_add('images', [{'Id': 'a'}], buffered=True)
+		self.db.document_add('users', [{'username': 'u'}], buffered=True)
+		self.db.flush('images')
+		self.assertEqual(len(self.collection.bulk_writes), 1)
+		self.assertEqual(self.db.db['users'].bulk_writes, [])
+		self.db.flush()
+		self.assertEqual(len(self.db.db['users'].bulk_writes), 1)
+
+	def test_failed_bulk_write_is_not_raised(self):
+		self.collection.fail_with = errors.BulkWriteError({'writeErrors': [{'errmsg': 'duplicate key'}]})
+		self.db.document_add('images', [{'Id': 'a'}], buffered=True)
+		self.db.flush()
+		self.assertEqual(self.db.pending, {})
+
+	def test_search_flushes_the_buffered_writes_first(self):
+		self.db.document_add('images', [{'Id': 'a'}], buffered=True)
+		self.db.document_search('images', {'Id': 'a'})
+		self.assertEqual(len(self.collection.bulk_writes), 1)
+
+	def test_document_page(self):
+		self.collection.documents = [{'_id': ObjectId(), 'Host': 'h1' if i % 2 else 'h2', 'n': i} for i in range(7)]
+		page = self.db.document_page('images', {'Host': 'h1'}, limit=2)
+		self.assertEqual([d['n'] for d in page['documents']], [1, 3])
+		self.assertTrue(page['has_more'])
+		self.assertEqual(page['cursor'], page['documents'][-1]['_id'])
+		page = self.db.document_page('images', {'Host': 'h1'}, limit=2, cursor=page['cursor'])
+		self.assertEqual([d['n'] for d in page['documents']], [5])
+		self.assertFalse(page['has_more'])
+		last = self.db.document_page('images', {'Host': 'h1'}, limit=2, cursor=page['cursor'])
+		self.assertEqual((last['documents'], last['cursor']), ([], page['cursor']))
+
+	def test_document_page_invalid_cursor(self):
+		self.assertRaises(ValueError, self.db.document_page, 'images', {}, cursor='not an id')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+# Description: unit tests of the pure helpers of helper.py
+# Usage: python -m unittest discover tests
+
+import unittest
+from helper import PrefixTrie, parse_byte_range, sorted_page, parse_field_paths, project, parse_log_cursor, \
+	skip_log_lines
+
+
+class PrefixTrieTest(unittest.TestCase):
+	def setUp(self):
+		self.trie = PrefixTrie()
+		self.trie.add('nginx', 'a')
+		self.trie.add('nginx', 'b')
+		self.trie.add('node', 'c')
+
+	def test_exact(self):
+		self.assertEqual(self.trie.exact('nginx'), set(['a', 'b']))
+		self.assertEqual(self.trie.exact('ngin'), set())
+		self.assertEqual(self.trie.exact('redis'), set())
+
+	def test_prefix(self):
+		self.assertEqual(sorted(k for k, _ in self.trie.prefix('n')), ['nginx', 'node'])
+		self.assertEqual(list(self.trie.prefix('x')), [])
+
+	def test_remove_prunes_the_branch(self):
+		self.trie.remove('nginx', 'a')
+		self.assertEqual(self.trie.exact('nginx'), set(['b']))
+		self.trie.remove('nginx', 'b')
+		self.assertEqual(self.trie.exact('nginx'), set())
+		self.assertEqual(sorted(k for k, _ in self.trie.prefix('n')), ['node'])
+		self.assertNotIn('g', self.trie.root.children['n'].children)
+		# removing a missing key is a no-op
+		self.trie.remove('redis', 'a')
+
+
+class ParseByteRangeTest(unittest.TestCase):
+	def test_ranges(self):
+		self.assertEqual(parse_byte_range(None), None)
+		self.assertEqual(parse_byte_range(' '), None)
+		self.assertEqual(parse_byte_range('bytes=0-99'), (0, 99))
+		self.assertEqual(parse_byte_range('bytes=100-'), (100, None))
+
+	def test_unsupported_ranges(self):
+		for value in ('bytes=-500', 'bytes=10-5', 'items=0-1', 'bytes=0-1,5-6'):
+			self.assertRaises(ValueError, parse_byte_range, value)
+
+
+class LogCursorTest(unittest.TestCase):
+	# a burst of lines written in the same nanosecond, then later ones
+	lines = [('2018-05-22T21:54:52.1Z', 'a'), ('2018-05-22T21:54:52.1Z', 'b'), ('2018-05-22T21:54:52.1Z', 'c'),
+	         ('2018-05-22T21:54:52.100Z', 'd'), ('2018-05-22T21:54:53Z', 'e')]
+
+	def pages(self, size):
+		lines, cursor = [], None
+		while True:
+			page = list(skip_log_lines(self.lines, cursor))[:size]
+			if not page:
+				return lines
+			lines.extend(line for _, line, _ in page)
+			cursor = page[-1][2]
+
+	def test_pages_keep_the_lines_of_the_same_timestamp(self):
+		for size in (1, 2, 3, 10):
+			self.assertEqual(self.pages(size), ['a', 'b', 'c', 'd', 'e'])
+
+	def test_cursor(self):
+		self.assertEqual([c for _, _, c in skip_log_lines(self.lines, None)][2:],
+		                 ['2018-05-22T21:54:52.1Z_3', '2018-05-22T21:54:52.100Z_4', '2018-05-22T21:54:53Z_1'])
+		self.assertEqual(parse_log_cursor('2018-05-22T21:54:53Z_2'), ((1527026093, 0), 2))
+
+	def test_timestamp_only_cursor_skips_the_whole_timestamp(self):
+		self.assertEqual([l for _, l, _ in skip_log_lines(self.lines, '2018-05-22T21:54:52.1Z')], ['e'])
+
+	def test_invalid_cursor(self):
+		self.assertRaises(ValueError, parse_log_cursor, '2018-05-22T21:54:53Z_x')
+		self.assertRaises(ValueError, parse_log_cursor, 'yesterday')
+
+
+class SortedPageTest(unittest.TestCase):
+	def setUp(self):
+		# the same created time for several items, the id breaks the ties
+		self.items = [{'Id': 'c%02d' % i, 'Created': i % 3} for i in range(10)]
+		self.key = lambda item: item['Created']
+
+	def test_all_pages_in_order(self):
+		seen = []
+		cursor = None
+		while True:
+			page, cursor, has_more = sorted_page(self.items, self.key, descending=True, limit=4, cursor=cursor)
+			seen.extend(page)
+			if not has_more:
+				break
+		self.assertEqual(seen, sorted(self.items, key=lambda i: (i['Created'], i['Id']), reverse=True))
+
+	def test_pages_are_stable_when_items_change(self):
+		page, cursor, _ = sorted_page(self.items, self.key, limit=4)
+		# an item removed from the first page doesn't shift the next one
+		items = [i for i in self.items if i['Id'] != page[0]['Id']]
+		next_page, _, _ = sorted_page(items, self.key, limit=4, cursor=cursor)
+		expected, _, _ = sorted_page(self.items, self.key, limit=4, cursor=cursor)
+		self.assertEqual(next_page, expected)
+
+	def test_without_limit(self):
+		page, cursor, has_more = sorted_page(self.items, self.key)
+		self.assertEqual((len(page), cursor, has_more), (10, None, False))
+
+	def test_invalid_cursor(self):
+		self.assertRaises(ValueError, sorted_page, self.items, self.key, limit=2, cursor='garbage')
+
+
+class ProjectionTest(unittest.TestCase):
+	document = {'Id': 'abc', 'State': {'Status': 'running', 'Pid': 3},
+	            'Config': {'Labels': {'com.example.tier': 'web', 'other': 'x'}},
+	            'NetworkSettings': {'Networks': {'bridge': {'IPAddress': '10.0.0.2', 'Gateway': '10.0.0.1'},
+	                                             'backend': {'IPAddress': '10.1.0.2'}}},
+	            'Mounts': [{'Source': '/a', 'Destination': '/b'}, {'Source': '/c'}], 'Args': ['-x', '-y']}
+
+	def test_parse(self):
+		self.assertEqual(parse_field_paths(['$.State.Status', "Config.Labels['com.example.tier']", 'Mounts[*].Source',
+		                                    'Args[1]']),
+		                 {'State': {'Status': None}, 'Config': {'Labels': {'com.example.tier': None}},
+		                  'Mounts': {'*': {'Source': None}}, 'Args': {1: None}})
+
+	def test_shorter_path_selects_the_whole_value(self):
+		self.assertEqual(parse_field_paths(['State', 'State.Pid']), {'State': None})
+		self.assertEqual(parse_field_paths(['State.Pid', 'State']), {'State': None})
+
+	def test_invalid_paths(self):
+		for path in ('', '$.', '.State', 'State..Pid', 'Args[', "Labels['x]"):
+			self.assertRaises(ValueError, parse_field_paths, [path])
+
+	def test_project(self):
+		fields = parse_field_paths(['Id', 'State.Status', 'NetworkSettings.Networks.*.IPAddress', 'Mounts.Source',
+		                            "Config.Labels['com.example.tier']", 'Args[1]', 'Missing.Field'])
+		self.assertEqual(project(self.document, fields),
+		                 {'Id': 'abc', 'State': {'Status': 'running'},
+		                  'NetworkSettings': {'Networks': {'bridge': {'IPAddress': '10.0.0.2'},
+		                                                   'backend': {'IPAddress': '10.1.0.2'}}},
+		                  'Mounts': [{'Source': '/a'}, {'Source': '/c'}],
+		                  'Config': {'Labels': {'com.example.tier': 'web'}}, 'Args': ['-y']})
+
+	def test_project_nothing_matched(self):
+		self.assertEqual(project(self.document, parse_field_paths(['Missing'])), {})
+		self.assertEqual(project(self.document, None), self.document)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+# Description: unit tests of the metric types of metrics.py
+# Usage: python -m unittest discover tests
+
+import unittest
+import metrics
+from metrics import Counter, Gauge, Histogram, MetricRegistry, instrument_methods
+
+
+class HistogramTest(unittest.TestCase):
+	def setUp(self):
+		self.histogram = Histogram('latency_seconds', 'Latency.', ('route',), buckets=(0.1, 1))
+
+	def test_buckets_are_cumulative(self):
+		for value in (0.05, 0.1, 0.5, 5):
+			self.histogram.observe(('/a',), value)
+		self.assertEqual(self.histogram.samples(), [
+			('latency_seconds_bucket', '{route="/a",le="0.1"}', 2),
+			('latency_seconds_bucket', '{route="/a",le="1"}', 3),
+			('latency_seconds_bucket', '{route="/a",le="+Inf"}', 4),
+			('latency_seconds_sum', '{route="/a"}', 5.65),
+			('latency_seconds_count', '{route="/a"}', 4)])
+
+	def test_label_values_are_separate(self):
+		self.histogram.observe(('/a',), 0.01)
+		self.histogram.observe(('/b',), 0.01)
+		counts = [s for s in self.histogram.samples() if s[0] == 'latency_seconds_count']
+		self.assertEqual(counts, [('latency_seconds_count', '{route="/a"}', 1),
+		                          ('latency_seconds_count', '{route="/b"}', 1)])
+
+
+class RegistryTest(unittest.TestCase):
+	def test_render(self):
+		registry = MetricRegistry()
+		counter = registry.register(Counter('calls_total', 'Calls.', ('method',)))
+		gauge = registry.register(Gauge('in_flight', 'In flight.'))
+		counter.inc(('get "x"\n',), 2)
+		gauge.inc()
+		gauge.dec()
+		self.assertEqual(registry.render(), '# HELP calls_total Calls.\n# TYPE calls_total counter\n'
+		                                    'calls_total{method="get \\"x\\"\\n"} 2\n'
+		                                    '# HELP in_flight In flight.\n# TYPE in_flight gauge\nin_flight 0\n')
+
+
+class Streams:
+	def inspect(self):
+		return {'Id': 'a'}
+
+	def logs(self):
+		yield 'line'
+
+	def save(self):
+		return (chunk for chunk in ('tar',)), 'image.tar'
+
+
+instrument_methods(Streams)
+
+def _count(histogram, name):
+	return histogram.values.get((name,), [0])[-1]
+
+
+class InstrumentTest(unittest.TestCase):
+	def setUp(self):
+		self.streams = Streams()
+
+	def test_value_is_timed_when_returned(self):
+		self.streams.inspect()
+		self.assertEqual(_count(metrics.docker_latency, 'inspect'), 1)
+
+	def test_stream_is_timed_until_exhausted(self):
+		stream = self.streams.logs()
+		self.assertEqual(metrics.docker_in_flight.values[('logs',)], 1)
+		self.assertEqual(list(stream), ['line'])
+		self.assertEqual(metrics.docker_in_flight.values[('logs',)], 0)
+		self.assertEqual(_count(metrics.docker_stream_latency, 'logs'), 1)
+		self.assertEqual(_count(metrics.docker_latency, 'logs'), 0)
+
+	def test_stream_in_a_tuple_is_timed_until_closed(self):
+		stream, name = self.streams.save()
+		self.assertEqual(name, 'image.tar')
+		stream.close()
+		self.assertEqual(_count(metrics.docker_stream_latency, 'save'), 1)
+		self.assertEqual(metrics.docker_in_flight.values[('save',)], 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# Description: unit tests of the admission control of scheduler.py
+# Usage: python -m unittest discover tests
+
+import gc
+import heapq
+import threading
+import time
+import unittest
+from scheduler import HostScheduler, SchedulerBusy
+
+# name -> (priority, max running, max waiting)
+CLASSES = {'interactive': (0, 2, 10), 'transfer': (2, 1, 10), 'build': (2, 1, 0)}
+
+
+def chunks():
+	yield 'a'
+	yield 'b'
+
+
+class SchedulerTest(unittest.TestCase):
+	def setUp(self):
+		self.scheduler = HostScheduler('test', classes=CLASSES, max_running=2, wait_timeout=0.05)
+
+	def running(self):
+		return dict((c, cls.running) for c, cls in self.scheduler.classes.items() if cls.running)
+
+	def test_dispatch_by_priority_then_arrival(self):
+		scheduler = self.scheduler
+		scheduler.running = scheduler.max_running
+		events = []
+		for op_class in ('transfer', 'interactive', 'interactive'):
+			cls = scheduler.classes[op_class]
+			events.append(threading.Event())
+			heapq.heappush(scheduler.queue, (cls.priority, next(scheduler.seq), time.time(), cls, events[-1]))
+			cls.waiting += 1
+		scheduler.running = 1
+		scheduler._dispatch()
+		# one free slot, the first interactive operation goes before the transfer queued earlier
+		self.assertEqual([e.is_set() for e in events], [False, True, False])
+		self.assertEqual(len(scheduler.queue), 2)
+		self.assertEqual(scheduler.classes['interactive'].waiting, 1)
+
+	def test_timed_out_waiter_is_removed(self):
+		started = self.scheduler.acquire('transfer')
+		self.assertRaises(SchedulerBusy, self.scheduler.acquire, 'transfer')
+		cls = self.scheduler.classes['transfer']
+		self.assertEqual((self.scheduler.queue, cls.waiting, cls.rejected), ([], 0, 1))
+		self.scheduler.release('transfer', started)
+		self.assertEqual(self.running(), {})
+
+	def test_class_limit(self):
+		self.scheduler.acquire('transfer')
+		self.assertRaises(SchedulerBusy, self.scheduler.acquire, 'transfer')
+		# the other class still has a slot of the host
+		self.scheduler.acquire('interactive')
+		self.assertEqual(self.running(), {'transfer': 1, 'interactive': 1})
+
+	def test_host_limit(self):
+		self.scheduler.acquire('interactive')
+		self.scheduler.acquire('transfer')
+		self.assertRaises(SchedulerBusy, self.scheduler.acquire, 'interactive')
+		self.assertEqual(self.scheduler.running, 2)
+
+	def test_full_class_queue_is_rejected(self):
+		self.assertRaises(SchedulerBusy, self.scheduler.check, 'build')
+		self.assertRaises(SchedulerBusy, self.scheduler.acquire, 'build')
+		self.assertEqual(self.scheduler.classes['build'].rejected, 2)
+
+	def test_waiter_starts_when_a_slot_is_released(self):
+		started = self.scheduler.acquire('transfer')
+		threading.Timer(0.01, self.scheduler.release, ('transfer', started)).start()
+		with self.scheduler.admitted(wait_timeout=5):
+			self.scheduler.acquire('transfer')
+		self.assertEqual(self.running(), {'transfer': 1})
+
+	def test_value_releases_the_slot_at_once(self):
+		self.assertEqual(self.scheduler.run('transfer', lambda: 'done'), 'done')
+		self.assertEqual(self.running(), {})
+
+	def test_exhausted_stream_releases_the_slot(self):
+		stream = self.scheduler.run('transfer', chunks)
+		self.assertEqual(self.running(), {'transfer': 1})
+		self.assertEqual(list(stream), ['a', 'b'])
+		self.assertEqual(self.running(), {})
+
+	def test_closed_stream_releases_the_slot(self):
+		stream, name = self.scheduler.run('transfer', lambda: (chunks(), 'image.tar'))
+		self.assertEqual(next(stream), 'a')
+		stream.close()
+		stream.close()
+		self.assertEqual(self.running(), {})
+		self.assertEqual(self.scheduler.running, 0)
+
+	def test_collected_stream_releases_the_slot(self):
+		stream = self.scheduler.run('transfer', chunks)
+		del stream
+		gc.collect()
+		self.assertEqual(self.running(), {})
+
+	def test_nested_call_takes_no_slot(self):
+		result = self.scheduler.run('transfer', self.scheduler.run, 'transfer', lambda: 'done')
+		self.assertEqual(result, 'done')
+		self.assertEqual(self.scheduler.classes['transfer'].admitted, 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+# Description: unit tests of the sample history of system_wrap.py
+# Usage: python -m unittest discover tests
+
+import time
+import unittest
+from system_wrap import SeriesRing
+
+
+class SeriesRingTest(unittest.TestCase):
+	def setUp(self):
+		self.ring = SeriesRing(('used', 'free'), 3)
+
+	def test_empty(self):
+		self.assertEqual(self.ring.last(), None)
+		self.assertEqual(self.ring.window(), {'time': [], 'used': [], 'free': []})
+
+	def test_the_oldest_samples_are_overwritten(self):
+		for i in range(5):
+			self.ring.append(100.0 + i, (i, 10 - i))
+		self.assertEqual(self.ring.last(), {'time': 104.0, 'used': 4.0, 'free': 6.0})
+		self.assertEqual(self.ring.window(), {'time': [102.0, 103.0, 104.0], 'used': [2.0, 3.0, 4.0],
+		                                      'free': [8.0, 7.0, 6.0]})
+
+	def test_window(self):
+		now = time.time()
+		self.ring.append(now - 100, (1, 1))
+		self.ring.append(now - 1, (2, 2))
+		self.assertEqual(self.ring.window(10)['used'], [2.0])
+
+
+if __name__ == '__main__':
+	unittest.main()